@@ -1,11 +1,40 @@
+import logging
+
 import streamlit as st
-import pandas as pd
 from PIL import Image
 
-from recommender import Recommender
+import instrumentation
+from recommendation_service import get_recommendation_service
+from shared_data import get_shared_data
 from user import UserInteraction
 
 
+@st.cache_resource
+def load_shared_data():
+    """
+    Carga una sola vez por proceso el dataset y el modelo, compartidos por todas las sesiones
+    """
+    return get_shared_data()
+
+
+@st.cache_resource
+def load_recommendation_service():
+    """
+    Crea una sola vez por proceso el servicio que calcula las recomendaciones en segundo plano
+    """
+    return get_recommendation_service(load_shared_data())
+
+
+@st.cache_resource
+def load_user_ids():
+    """
+    Arma una sola vez por proceso la lista de IDs de usuario del selector, en lugar de en cada recarga de la página
+    """
+    user_ids = load_shared_data().ratings['userId'].unique().tolist()
+    user_ids.insert(0, None)
+    return user_ids
+
+
 def load_films(movies_to_display, name_tag):
     """
     Carga las películas que recibe en movies_to_display en la vista de la aplicación
@@ -31,7 +60,8 @@ def load_films(movies_to_display, name_tag):
     if search_query:
         # si se hace una búsqueda se sale de las recomendaciones y se muestran todas las películas del dataset que coincidan con el criterio de búsqueda
         st.session_state.show_recommended = False
-        results = st.session_state.user.merged_df[st.session_state.user.merged_df[name_tag].str.contains(search_query, case=False, na=False)].head(20)
+        # búsqueda en el índice de títulos compartido, sin recorrer todo el catálogo
+        results = st.session_state.user.search_movies(search_query, limit=20)
     else:
         results = movies_to_display.head(20)
 
@@ -57,11 +87,38 @@ def load_films(movies_to_display, name_tag):
                     rating = st.selectbox(f"Select your rating for {movie[name_tag]}", [1, 2, 3, 4, 5], key=f"rating_select_{idx}")
                     submit_button = st.form_submit_button(label="Guardar calificación")
                     if submit_button:
-                        st.session_state.user.rate_movie(movie['movieId'], rating)
+                        # solo guarda la calificación; el modelo se actualiza y las recomendaciones se recalculan en segundo plano
+                        load_recommendation_service().rate_movie(st.session_state.user, movie['movieId'], rating)
                         st.write(f"Rating for {movie[name_tag]}: {rating} stars")
 
 
 
+def debug_panel():
+    """
+    Muestra en la barra lateral las últimas solicitudes medidas (ver ``instrumentation``)
+    Solo aparece si la instrumentación está activa (RECOMMENDER_INSTRUMENT=1)
+    """
+    with st.sidebar.expander("Depuración"):
+        traces = instrumentation.recent_traces()[-5:]
+        for trace in reversed(traces):
+            st.json(trace.to_dict())
+            if trace.profile:
+                st.code(trace.profile)
+        st.json(instrumentation.totals())
+
+
+@st.fragment(run_every=0.5)
+def wait_for_recommendations():
+    """
+    Mientras las recomendaciones se calculan en segundo plano, revisa cada medio segundo si ya están listas
+    Cuando lo están, recarga la página para mostrarlas en lugar de las provisorias
+    """
+    if load_recommendation_service().pending(st.session_state.user):
+        st.caption("Calculando recomendaciones...")
+    else:
+        st.rerun()
+
+
 def main():
     """
     Función main para correr la aplicación de streamlit
@@ -69,6 +126,8 @@ def main():
     """
 
     st.title("Sistema de recomendación de películas")
+    if instrumentation.enabled():
+        debug_panel()
 
     if 'user' not in st.session_state:
         st.session_state.user = None
@@ -86,15 +145,15 @@ def main():
 
         if recommend_button:
             st.session_state.show_recommended = True
-            recommended_movies = recommend_movies(st.session_state.user)
-            st.session_state.recommendations = recommended_movies
-            # st.session_state.recommendations representa las películas recomendadas para el usuario actual
+
+        if st.session_state.show_recommended:
+            # no espera al modelo: si las recomendaciones no están listas se muestran las provisorias
+            recommended_movies, ready = recommend_movies(st.session_state.user)
+            if not ready:
+                wait_for_recommendations()
             load_films(recommended_movies, 'title')
         else:
-            if st.session_state.show_recommended:
-                load_films(st.session_state.recommendations, 'title')
-            else:
-                load_films(st.session_state.user.merged_df, 'title')
+            load_films(st.session_state.user.merged_df, 'title')
 
     else:
         if 'creating_new_user' in st.session_state:
@@ -102,21 +161,22 @@ def main():
             if new_user_name:
                 user = create_user(new_user_name)
                 st.session_state.user = user
-                st.session_state.recommendations = recommend_movies(user)
+                st.session_state.recommendations = None
+                load_recommendation_service().submit(user)  # empieza a calcular sin esperar el resultado
                 st.write(f"{new_user_name}, your id is: {st.session_state.user.user_id}")
                 st.session_state.creating_new_user = False
                 # st.session_state.creating_new_user guarda un booleano para indicar si se va a crear un nuevo usuario
                 st.rerun()
         else:
-            user_ids = ratings_df['userId'].unique().tolist()
-            user_ids.insert(0, None)
+            user_ids = load_user_ids()
 
             # Create the select component with the default value
             user_id = st.selectbox('Seleccione su ID', user_ids)
 
             if user_id:
                 st.session_state.user = UserInteraction(str(user_id))
-                st.session_state.recommendations = recommend_movies(st.session_state.user)
+                st.session_state.recommendations = None
+                load_recommendation_service().submit(st.session_state.user)  # empieza a calcular sin esperar el resultado
                 st.write(f"UserId: {st.session_state.user.user_id}")
                 st.rerun()
             else:
@@ -138,15 +198,27 @@ def create_user(user_name):
 
 def recommend_movies(user):
     """
-    Llama al método get_recommendations de la instancia de la clase UserInteraction
-    Devuelve las películas recomendadas para el usuario
+    Pide las recomendaciones del usuario al servicio en segundo plano, sin esperar a que se calculen
+    Devuelve las películas a mostrar y si son las recomendaciones finales; mientras se calculan, devuelve
+    las últimas recomendaciones mostradas o, si no hay, las películas más populares
     """
-    return user.get_recommendation()
+    recommendation, ready = load_recommendation_service().recommendation(user)
+    if ready:
+        st.session_state.recommendations = recommendation
+        # st.session_state.recommendations representa las últimas películas recomendadas para el usuario actual
+        return recommendation, True
+    previous = st.session_state.get('recommendations')
+    return (previous if previous is not None else user.popular_recommendation()), False
 
 if __name__ == "__main__":
 
-    # carga el csv con ratings iniciales
-    ratings_df = pd.read_csv('dataset/ratings.csv')
+    # con la instrumentación activa, cada solicitud escribe una línea de log con sus tiempos
+    if instrumentation.enabled():
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+
+    # carga el dataset compartido y empieza a cargar el modelo en segundo plano antes de atender a la primera sesión
+    load_shared_data()
+    load_recommendation_service()
 
     # establece la dirección de la imagen que se utiliza para mostrar las películas
     image_path = './movie_icon.jpg'
@@ -0,0 +1,101 @@
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import uuid
+
+import numpy as np
+
+
+def write_arrays(directory, arrays, meta):
+    """
+    Escribe un artefacto: un ``.npy`` por arreglo más ``meta.json``.
+
+    Cada escritura arma una carpeta nueva (``<directory>.v-<id>``) y ``directory`` es un enlace
+    simbólico que pasa a apuntarla con un solo ``os.replace``, así que un lector siempre ve un
+    artefacto completo: el anterior o el nuevo, nunca ninguno. Las escrituras en paralelo (de hilos
+    o de procesos) arman carpetas temporales distintas y publican de a una, con un bloqueo sobre
+    ``<directory>.lock``. Después de publicar se borran las versiones viejas, salvo la que se acaba
+    de reemplazar, por si un lector la está leyendo (ver ``resolve``).
+
+    Parameters
+    ----------
+    directory : str
+        Ruta del artefacto. Si es una carpeta común (de versiones anteriores), se convierte en enlace.
+    arrays : dict
+        Nombre -> arreglo.
+    meta : dict
+        El contenido de ``meta.json``.
+    """
+    parent, name = os.path.split(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=f'{name}.tmp-', dir=parent)
+    try:
+        os.chmod(tmp_dir, 0o755)  # ``mkdtemp`` la crea solo para su dueño
+        for array_name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f'{array_name}.npy'), np.ascontiguousarray(array))
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        with _publish_lock(parent, name):
+            version = f'{name}.v-{uuid.uuid4().hex}'
+            os.rename(tmp_dir, os.path.join(parent, version))
+            previous = _previous_version(parent, name)
+            link = os.path.join(parent, f'{name}.link-{uuid.uuid4().hex}')
+            os.symlink(version, link)
+            os.replace(link, os.path.join(parent, name))
+            for entry in os.listdir(parent):
+                if entry.startswith(f'{name}.v-') and entry not in (version, previous):
+                    shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _previous_version(parent, name):
+    # La versión que se va a reemplazar; una carpeta común se mueve a una versión (solo pasa una vez,
+    # y durante ese ``os.rename`` el artefacto no está)
+    path = os.path.join(parent, name)
+    if os.path.islink(path):
+        return os.readlink(path)
+    if os.path.isdir(path):
+        previous = f'{name}.v-{uuid.uuid4().hex}'
+        os.rename(path, os.path.join(parent, previous))
+        return previous
+    return None
+
+
+@contextlib.contextmanager
+def _publish_lock(parent, name):
+    fd = os.open(os.path.join(parent, f'{name}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def resolve(directory):
+    """
+    Devuelve la carpeta de la versión actual de un artefacto.
+
+    Quien lee ``meta.json`` y después los arreglos tiene que leerlos de la carpeta devuelta, para
+    no mezclar dos versiones si en el medio se publica otra.
+    """
+    return os.path.realpath(directory)
+
+
+def read_meta(directory):
+    """Devuelve el contenido de ``meta.json`` del artefacto, o None si no existe o no se puede leer."""
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_arrays(directory, names, mmap=True):
+    """Carga los arreglos de un artefacto escrito con ``write_arrays`` (con mmap copy-on-write si ``mmap``)."""
+    mmap_mode = 'c' if mmap else None
+    return {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode) for name in names}
@@ -0,0 +1,347 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from data_reader import read_data
+from model_store import (DEFAULT_DATASET_DIR, DEFAULT_MODEL_DIR, checkpoint_model, extends_position, load_model,
+                         load_or_build_model, model_position)
+from neighbor_finder import top_k_indices
+
+RESULT_COLUMNS = ['userId', 'rank', 'movieId', 'score']
+DEFAULT_OUTPUT = os.path.join('dataset', 'recommendations.csv')
+
+_worker = {}  # BatchScorer de cada proceso del pool
+
+
+class BatchScorer:
+    """
+    Calcula las mejores recomendaciones de bloques de usuarios con productos de matrices dispersas.
+
+    Usa la misma fórmula que ``Recommender.predict_user_ratings``, pero para un bloque de usuarios
+    a la vez: los vecinos del bloque se buscan con ``NeighborFinder.find_batch`` y las sumas
+    ponderadas de todas las películas salen de multiplicar una matriz dispersa de similitudes
+    (usuarios del bloque x usuarios) por la matriz de calificaciones centradas en la media.
+
+    Attributes
+    ----------
+    model : RecommenderModel
+        El modelo a partir del cual se recomienda.
+    ratings : RatingMatrix
+        Las calificaciones del modelo, compactadas.
+    top_n : int
+        Cantidad de recomendaciones por usuario.
+    """
+
+    def __init__(self, model, top_n=10):
+        """
+        Parameters
+        ----------
+        model : RecommenderModel
+            El modelo a partir del cual se recomienda.
+        top_n : int, optional
+            Cantidad de recomendaciones por usuario.
+        """
+        self.model = model
+        self.top_n = top_n
+        self.ratings = model.ratings.compacted()
+
+        csr = self.ratings.csr
+        rows = np.repeat(np.arange(csr.shape[0]), np.diff(csr.indptr))
+        valid = csr.data > 0
+        centered = np.where(valid, csr.data.astype(np.float64) - self.ratings.user_means[rows], 0)
+        self._centered = sp.csr_matrix((centered, csr.indices, csr.indptr), shape=csr.shape)
+        self._rated = sp.csr_matrix((valid.astype(np.float64), csr.indices, csr.indptr), shape=csr.shape)
+        self._stored = sp.csr_matrix((np.ones(csr.nnz), csr.indices, csr.indptr), shape=csr.shape)
+
+    def user_ids(self):
+        """Devuelve los usuarios a los que se les puede recomendar: los que tienen calificaciones y vecinos."""
+        user_ids = self.ratings.user_ids
+        return user_ids[[user_id in self.model.finder for user_id in user_ids.tolist()]]
+
+    def score(self, user_ids, batch_size=256):
+        """
+        Calcula las recomendaciones de varios usuarios.
+
+        Parameters
+        ----------
+        user_ids : array_like of int
+            Los usuarios, que deben estar en la matriz híbrida y en la de calificaciones.
+        batch_size : int, optional
+            Cantidad de usuarios por producto de matrices.
+
+        Returns
+        -------
+        DataFrame
+            Columnas ``userId``, ``rank`` (desde 1), ``movieId`` y ``score`` (calificación predicha).
+        """
+        user_ids = np.asarray(user_ids)
+        frames = [self._score_block(user_ids[start:start + batch_size])
+                  for start in range(0, len(user_ids), batch_size)]
+        if not frames:
+            return pd.DataFrame({column: [] for column in RESULT_COLUMNS})
+        return pd.concat(frames, ignore_index=True)
+
+    def predict(self, user_ids):
+        """
+        Predice las calificaciones de un bloque de usuarios para todas las películas.
+
+        Parameters
+        ----------
+        user_ids : ndarray of int
+            Los usuarios del bloque, que deben estar en la matriz híbrida y en la de calificaciones.
+
+        Returns
+        -------
+        ndarray of float64
+            Una fila por usuario con la calificación predicha para cada columna de ``ratings``, como
+            ``Recommender.predict_user_ratings`` (0 si ningún vecino calificó la película).
+        """
+        n_users = self.ratings.shape[0]
+        neighbors = self.model.finder.find_batch(user_ids.tolist())
+        counts = np.array([len(user_neighbors) for user_neighbors in neighbors])
+        owner = np.repeat(np.arange(len(user_ids)), counts)
+        cols = self.ratings.user_indices([n for user_neighbors in neighbors for n, _ in user_neighbors])
+        sims = np.array([sim for user_neighbors in neighbors for _, sim in user_neighbors], dtype=np.float64)
+
+        shape = (len(user_ids), n_users)
+        weights = sp.csr_matrix((sims, (owner, cols)), shape=shape)
+        abs_weights = sp.csr_matrix((np.abs(sims), (owner, cols)), shape=shape)
+        is_neighbor = sp.csr_matrix((np.ones(len(sims)), (owner, cols)), shape=shape)
+
+        numerator = (weights @ self._centered).toarray()
+        denominator = (abs_weights @ self._rated).toarray()
+        rated_by_neighbors = (is_neighbor @ self._rated).toarray() > 0
+
+        user_avgs = self.ratings.user_means[self.ratings.user_indices(user_ids)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            offsets = np.where(denominator != 0, numerator / denominator, 0)
+        return np.where(rated_by_neighbors, user_avgs[:, None] + offsets, 0)
+
+    def _score_block(self, user_ids):
+        predictions = np.round(self.predict(user_ids), 2)
+        user_rows = self.ratings.user_indices(user_ids)
+        candidates = (predictions > 3) & (self._stored[user_rows].toarray() == 0)
+        scores = np.where(candidates, predictions, -np.inf)
+        top = top_k_indices(scores, self.top_n)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        keep = np.isfinite(top_scores)
+
+        return pd.DataFrame({
+            'userId': np.repeat(user_ids, keep.sum(axis=1)),
+            'rank': np.broadcast_to(np.arange(1, top.shape[1] + 1), top.shape)[keep],
+            'movieId': self.ratings.movie_ids[top[keep]],
+            'score': top_scores[keep],
+        })
+
+
+def _init_worker(model_dir, top_n):
+    model, _ = load_model(model_dir)
+    _worker['scorer'] = BatchScorer(model, top_n)
+
+
+def _score_chunk(args):
+    user_ids, batch_size = args
+    return _worker['scorer'].score(user_ids, batch_size)
+
+
+def recommend_all(model_dir=DEFAULT_MODEL_DIR, user_ids=None, top_n=10, workers=None, chunk_size=2048,
+                  batch_size=256):
+    """
+    Calcula las recomendaciones de todos los usuarios, repartiendo el trabajo entre procesos.
+
+    Cada proceso carga el artefacto de ``model_dir`` con mmap, así que los arreglos del modelo se
+    comparten entre procesos a través de la cache de páginas del sistema operativo en lugar de
+    copiarse.
+
+    Parameters
+    ----------
+    model_dir : str, optional
+        Carpeta del artefacto del modelo (ver ``model_store``).
+    user_ids : array_like of int, optional
+        Los usuarios. Por defecto, todos los que tienen calificaciones y vecinos.
+    top_n : int, optional
+        Cantidad de recomendaciones por usuario.
+    workers : int, optional
+        Cantidad de procesos. Con 1 se calcula en el proceso actual.
+    chunk_size : int, optional
+        Cantidad de usuarios que se envían juntos a un proceso.
+    batch_size : int, optional
+        Cantidad de usuarios por producto de matrices.
+
+    Yields
+    ------
+    DataFrame
+        Las recomendaciones de cada grupo de usuarios, en el orden de ``user_ids``.
+    """
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1:
+        _init_worker(model_dir, top_n)
+    if user_ids is None:
+        if workers <= 1:
+            user_ids = _worker['scorer'].user_ids()
+        else:
+            user_ids = BatchScorer(load_model(model_dir)[0], top_n).user_ids()
+    user_ids = np.asarray(user_ids)
+    chunks = [(user_ids[start:start + chunk_size], batch_size) for start in range(0, len(user_ids), chunk_size)]
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield _score_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_dir, top_n)) as pool:
+        yield from pool.map(_score_chunk, chunks)
+
+
+def meta_path(output):
+    """Devuelve la ruta del archivo con los datos del modelo con el que se calcularon las recomendaciones."""
+    return f'{output}.meta.json'
+
+
+def write_recommendations(frames, output, position=None):
+    """
+    Escribe las recomendaciones a medida que se calculan, sin juntarlas todas en memoria.
+
+    El formato se elige por la extensión: ``.parquet`` (requiere pyarrow) o CSV. El archivo se
+    escribe con otro nombre y se mueve a su lugar al final. ``position`` (el ``model_position`` del
+    modelo usado) se guarda al lado, en ``meta_path(output)``, para que ``PrecomputedRecommendations``
+    pueda descartar el archivo cuando el modelo cambie.
+
+    Returns
+    -------
+    int
+        La cantidad de filas escritas.
+    """
+    tmp_path = f'{output}.tmp-{os.getpid()}'
+    rows = 0
+    if output.endswith('.parquet'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        for frame in frames:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+            rows += len(frame)
+        if writer is not None:
+            writer.close()
+    else:
+        with open(tmp_path, 'w', newline='') as f:
+            f.write(','.join(RESULT_COLUMNS) + '\n')
+            for frame in frames:
+                frame.to_csv(f, header=False, index=False)
+                rows += len(frame)
+    os.replace(tmp_path, output)
+
+    # Se escribe después del archivo: mientras tanto, un lector ve datos nuevos con la posición vieja y los descarta
+    with open(tmp_path, 'w') as f:
+        json.dump(position, f)
+    os.replace(tmp_path, meta_path(output))
+    return rows
+
+
+class PrecomputedRecommendations:
+    """
+    Recomendaciones calculadas por ``batch_recommender``, listas para servirse sin recalcularlas.
+
+    Se guardan ordenadas por usuario en arreglos planos: las películas del usuario ``user_ids[i]``
+    son ``movie_ids[indptr[i]:indptr[i + 1]]``, de mejor a peor.
+
+    Attributes
+    ----------
+    position : dict or None
+        Los datos del modelo con el que se calcularon (ver ``model_store.model_position``); None si
+        no se conocen, en cuyo caso las recomendaciones nunca coinciden con el modelo actual.
+    """
+
+    def __init__(self, results, position=None):
+        """
+        Parameters
+        ----------
+        results : DataFrame
+            Recomendaciones con las columnas de ``RESULT_COLUMNS``.
+        position : dict, optional
+            Los datos del modelo con el que se calcularon.
+        """
+        self.position = position
+        results = results.sort_values(['userId', 'rank'], kind='stable')
+        self.user_ids, counts = np.unique(results['userId'].to_numpy(), return_counts=True)
+        self.indptr = np.zeros(len(self.user_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.movie_ids = results['movieId'].to_numpy()
+
+    @classmethod
+    def load(cls, path):
+        """Lee un archivo escrito por ``write_recommendations``, junto con los datos de su modelo."""
+        try:
+            with open(meta_path(path)) as f:
+                position = json.load(f)
+        except (OSError, ValueError):
+            position = None
+        if path.endswith('.parquet'):
+            return cls(pd.read_parquet(path), position)
+        return cls(pd.read_csv(path), position)
+
+    def matches(self, position):
+        """
+        Indica si las recomendaciones siguen sirviendo para el modelo de ``position`` (ver ``model_position``).
+
+        Sirven mientras el modelo sea el mismo con el que se calcularon más calificaciones agregadas
+        después al diario (ver ``extends_position``); qué usuarios calificaron desde entonces, y
+        tienen que recalcularse, lo lleva ``SharedData``.
+        """
+        return extends_position(self.position, position)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def get(self, user_id):
+        """Devuelve las películas recomendadas a un usuario, o None si no tiene recomendaciones guardadas."""
+        pos = np.searchsorted(self.user_ids, user_id)
+        if pos == len(self.user_ids) or self.user_ids[pos] != user_id:
+            return None
+        return self.movie_ids[self.indptr[pos]:self.indptr[pos + 1]]
+
+
+def main():
+    """
+    Punto de entrada de línea de comandos para precalcular las recomendaciones de todos los usuarios.
+
+    Ejemplo: ``python batch_recommender.py --top-n 10 --workers 4 --output dataset/recommendations.csv``
+    """
+    parser = argparse.ArgumentParser(description="Precalcula las recomendaciones de todos los usuarios.")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Archivo .csv o .parquet de salida.")
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=None, help="Procesos (por defecto, uno por CPU).")
+    parser.add_argument('--chunk-size', type=int, default=2048)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR)
+    parser.add_argument('--model-dir', default=DEFAULT_MODEL_DIR)
+    args = parser.parse_args()
+    if args.output.endswith('.parquet'):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("Parquet output requires pyarrow; use a .csv output instead")
+
+    # El artefacto tiene que estar al día con el diario para que todos los procesos usen el mismo modelo.
+    md_genres, ratings, md = read_data(args.dataset_dir, compact=True)
+    load_or_build_model(md_genres, ratings, md, model_dir=args.model_dir, dataset_dir=args.dataset_dir)
+    checkpoint_model(args.model_dir, args.dataset_dir)
+    position = model_position(args.model_dir)
+
+    frames = recommend_all(args.model_dir, top_n=args.top_n, workers=args.workers,
+                           chunk_size=args.chunk_size, batch_size=args.batch_size)
+    rows = write_recommendations(frames, args.output, position)
+    print(f"Wrote {rows} recommendations to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
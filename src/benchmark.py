@@ -0,0 +1,346 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from data_reader import DATASET_FILES, read_data
+from matrix_builder import build_matrix
+from neighbor_finder import find_neighbors
+from rating_matrix import RatingMatrix
+from recommender import Recommender
+from shared_data import get_shared_data
+from user import UserInteraction
+
+SCALES = {'bundled': None, '1m': 1_000_000, '10m': 10_000_000}
+BUNDLED_DATASET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset')
+GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Fantasy',
+          'Film-Noir', 'Horror', 'IMAX', 'Musical', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'War', 'Western']
+
+
+def write_synthetic_dataset(dataset_dir, n_ratings, seed=0):
+    """
+    Escribe un dataset sintético con el formato de MovieLens, para medir a mayor escala.
+
+    La popularidad de las películas sigue una ley de potencias y la cantidad de calificaciones por
+    usuario una distribución log-normal (con al menos 20, como en MovieLens). Los pares
+    usuario-película repetidos se descartan, así que el total puede quedar un poco por debajo de
+    ``n_ratings``.
+
+    Parameters
+    ----------
+    dataset_dir : str
+        Carpeta donde se escriben ``movies.csv`` y ``ratings.csv``.
+    n_ratings : int
+        Cantidad aproximada de calificaciones.
+    seed : int, optional
+        Semilla del generador.
+
+    Returns
+    -------
+    int
+        La cantidad de calificaciones escritas.
+    """
+    rng = np.random.default_rng(seed)
+    n_users = max(n_ratings // 150, 10)
+    n_movies = int(min(60_000, max(1_000, n_ratings // 100)))
+    os.makedirs(dataset_dir, exist_ok=True)
+
+    years = rng.integers(1920, 2019, n_movies)
+    n_genres = rng.integers(1, 4, n_movies)
+    genres = ['|'.join(rng.choice(GENRES, size=k, replace=False)) for k in n_genres]
+    movie_ids = np.arange(1, n_movies + 1)
+    titles = [f'Movie {movie_id} ({year})' for movie_id, year in zip(movie_ids.tolist(), years.tolist())]
+    pd.DataFrame({'movieId': movie_ids, 'title': titles, 'genres': genres}).to_csv(
+        os.path.join(dataset_dir, 'movies.csv'), index=False)
+
+    activity = rng.lognormal(0, 1, n_users)
+    counts = 20 + np.floor(activity / activity.sum() * max(n_ratings - 20 * n_users, 0)).astype(np.int64)
+    user_ids = np.repeat(np.arange(1, n_users + 1), counts)
+    popularity = 1 / (np.arange(n_movies) + 10) ** 0.9
+    movies = rng.choice(movie_ids, size=len(user_ids), p=popularity / popularity.sum())
+    pairs = np.unique(user_ids.astype(np.int64) * (n_movies + 1) + movies)
+    user_ids, movies = pairs // (n_movies + 1), pairs % (n_movies + 1)
+
+    movie_bias = rng.normal(0, 0.5, n_movies + 1)
+    ratings = np.clip(np.round((3.5 + movie_bias[movies] + rng.normal(0, 1, len(pairs))) * 2) / 2, 0.5, 5)
+    timestamps = rng.integers(828_000_000, 1_540_000_000, len(pairs))
+    pd.DataFrame({'userId': user_ids, 'movieId': movies, 'rating': ratings, 'timestamp': timestamps}).to_csv(
+        os.path.join(dataset_dir, 'ratings.csv'), index=False)
+    return len(pairs)
+
+
+def measure(func, repeat=3, setup=None, calls=1, memory=True):
+    """
+    Mide el tiempo y la memoria de una etapa.
+
+    Parameters
+    ----------
+    func : callable
+        La etapa; se llama ``repeat`` veces.
+    repeat : int, optional
+        Cantidad de mediciones de tiempo.
+    setup : callable, optional
+        Se llama antes de cada medición, fuera del tiempo medido.
+    calls : int, optional
+        Cantidad de operaciones que hace ``func``; los tiempos se informan por operación.
+    memory : bool, optional
+        Si es True, se hace una ejecución más con ``tracemalloc`` para medir el pico de memoria
+        (separada de las mediciones de tiempo, porque ``tracemalloc`` las haría más lentas).
+
+    Returns
+    -------
+    dict
+        ``seconds`` (mediana por operación), ``min``, ``runs``, ``calls`` y ``peak_bytes``.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) / calls)
+
+    peak = None
+    if memory:
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {'seconds': statistics.median(times), 'min': min(times), 'runs': repeat, 'calls': calls,
+            'peak_bytes': peak}
+
+
+def run_stages(repeat=3, n_queries=20, seed=0, memory=True):
+    """
+    Mide cada etapa del sistema sobre el dataset de ``dataset/`` en la carpeta actual.
+
+    Las etapas se miden en el orden en que las usa la aplicación; ``rate_movie`` va al final porque
+    agrega calificaciones al diario y cambia el modelo.
+
+    Parameters
+    ----------
+    repeat : int, optional
+        Mediciones de tiempo por etapa.
+    n_queries : int, optional
+        Cantidad de usuarios (elegidos al azar) para las etapas por usuario.
+    seed : int, optional
+        Semilla para elegir usuarios y películas.
+    memory : bool, optional
+        Si es True, también se mide el pico de memoria de cada etapa.
+
+    Returns
+    -------
+    dict
+        Nombre de la etapa -> resultado de ``measure``.
+    """
+    rng = np.random.default_rng(seed)
+    stages = {}
+
+    stages['read_data'] = measure(lambda: read_data('dataset'), repeat, memory=memory)
+    read_data('dataset', compact=True)  # La primera lectura compacta escribe la caché; se mide la lectura desde ella
+    stages['read_data_compact'] = measure(lambda: read_data('dataset', compact=True), repeat, memory=memory)
+    md_genres, ratings, md = read_data('dataset')
+
+    stages['build_matrix'] = measure(lambda: build_matrix(md_genres, ratings, md), repeat, memory=memory)
+    hybrid_matrix, _, _ = build_matrix(md_genres, ratings, md)
+    rating_matrix = RatingMatrix.from_ratings(ratings)
+
+    user_ids = rng.choice(hybrid_matrix.index.to_numpy(), size=min(n_queries, len(hybrid_matrix)), replace=False)
+    user_ids = user_ids.tolist()
+    find_neighbors(hybrid_matrix, user_ids[0])  # Construye el buscador de vecinos fuera de la medición
+    stages['find_neighbors'] = measure(lambda: [find_neighbors(hybrid_matrix, user_id) for user_id in user_ids],
+                                       repeat, calls=len(user_ids), memory=memory)
+
+    neighbors = {user_id: find_neighbors(hybrid_matrix, user_id) for user_id in user_ids}
+    movie_ids = rng.choice(rating_matrix.movie_ids, size=len(user_ids)).tolist()
+    stages['predict_user_rating'] = measure(
+        lambda: [Recommender(user_id).predict_user_rating(rating_matrix, movie_id, neighbors[user_id])
+                 for user_id, movie_id in zip(user_ids, movie_ids)],
+        repeat, calls=len(user_ids), memory=memory)
+
+    # Desde acá se usan los datos compartidos y el artefacto del modelo, como en la aplicación.
+    stages['load_model'] = measure(lambda: get_shared_data().model(), repeat=1, memory=False)
+    data = get_shared_data()
+
+    stages['recommend_movies'] = measure(
+        lambda: [Recommender(user_id, model_dir=data.model_dir).recommend_movies(data.md_genres, data.ratings,
+                                                                                 data.md, top_n=10)
+                 for user_id in user_ids],
+        repeat, calls=len(user_ids), memory=memory)
+
+    sessions = [UserInteraction(user_id) for user_id in user_ids]
+    stages['get_recommendation_cold'] = measure(lambda: [session.get_recommendation() for session in sessions],
+                                                repeat, setup=data.recommendations.invalidate,
+                                                calls=len(sessions), memory=memory)
+    stages['get_recommendation_warm'] = measure(lambda: [session.get_recommendation() for session in sessions],
+                                                repeat, calls=len(sessions), memory=memory)
+
+    rated = rng.choice(md['movieId'].to_numpy(), size=len(sessions)).tolist()
+    stages['rate_movie'] = measure(
+        lambda: [session.rate_movie(movie_id, 4.0) for session, movie_id in zip(sessions, rated)],
+        repeat, calls=len(sessions), memory=memory)
+    return stages
+
+
+def run_benchmark(scale='bundled', workdir=None, repeat=3, n_queries=20, seed=0, memory=True):
+    """
+    Prepara el dataset de la escala pedida en una carpeta de trabajo y mide todas las etapas.
+
+    Las mediciones se hacen sobre una copia del dataset, así que ``rate_movie`` nunca modifica el
+    dataset incluido.
+
+    Parameters
+    ----------
+    scale : {'bundled', '1m', '10m'}, optional
+        El dataset incluido o uno sintético con esa cantidad de calificaciones.
+    workdir : str, optional
+        Carpeta de trabajo. Si se indica, se conserva y el dataset sintético se reutiliza en las
+        próximas ejecuciones; si no, se usa una carpeta temporal que se borra al final.
+
+    Returns
+    -------
+    dict
+        ``meta`` (entorno y dataset) y ``stages`` (ver ``run_stages``).
+    """
+    keep = workdir is not None
+    workdir = workdir or tempfile.mkdtemp(prefix='movie-benchmark-')
+    dataset_dir = os.path.join(workdir, 'dataset')
+    try:
+        if os.path.isdir(dataset_dir):
+            # Se conservan los CSV; el diario, la caché y los artefactos de una ejecución anterior se borran.
+            for name in set(os.listdir(dataset_dir)) - set(DATASET_FILES):
+                path = os.path.join(dataset_dir, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        if not all(os.path.exists(os.path.join(dataset_dir, name)) for name in DATASET_FILES):
+            os.makedirs(dataset_dir, exist_ok=True)
+            if SCALES[scale] is None:
+                for name in DATASET_FILES:
+                    shutil.copy(os.path.join(BUNDLED_DATASET_DIR, name), dataset_dir)
+            else:
+                write_synthetic_dataset(dataset_dir, SCALES[scale], seed)
+
+        previous_dir = os.getcwd()
+        os.chdir(workdir)
+        try:
+            stages = run_stages(repeat, n_queries, seed, memory)
+            ratings = pd.read_csv(os.path.join('dataset', 'ratings.csv'), usecols=['userId', 'movieId'])
+        finally:
+            os.chdir(previous_dir)
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    meta = {
+        'scale': scale,
+        'ratings': len(ratings),
+        'users': int(ratings['userId'].nunique()),
+        'movies': int(ratings['movieId'].nunique()),
+        'repeat': repeat,
+        'queries': n_queries,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    return {'meta': meta, 'stages': stages}
+
+
+def compare(results, baseline, tolerance=0.2, min_seconds=1e-4, min_bytes=1 << 20):
+    """
+    Compara los resultados con una línea base y devuelve las regresiones.
+
+    Una etapa empeora si su tiempo (o su pico de memoria) supera al de la línea base en más de
+    ``tolerance`` y la diferencia absoluta es mayor que ``min_seconds`` (o ``min_bytes``), para no
+    marcar el ruido de las etapas muy rápidas.
+
+    Returns
+    -------
+    list of str
+        Una descripción por cada regresión; vacía si no hay ninguna.
+    """
+    regressions = []
+    for name, stage in results['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if base is None:
+            continue
+        if (stage['seconds'] > base['seconds'] * (1 + tolerance)
+                and stage['seconds'] - base['seconds'] > min_seconds):
+            regressions.append(f"{name}: {stage['seconds'] * 1000:.3f} ms vs {base['seconds'] * 1000:.3f} ms")
+        if (stage['peak_bytes'] is not None and base.get('peak_bytes') is not None
+                and stage['peak_bytes'] > base['peak_bytes'] * (1 + tolerance)
+                and stage['peak_bytes'] - base['peak_bytes'] > min_bytes):
+            regressions.append(f"{name}: peak {stage['peak_bytes'] / 2**20:.1f} MiB "
+                               f"vs {base['peak_bytes'] / 2**20:.1f} MiB")
+    return regressions
+
+
+def main():
+    """
+    Punto de entrada de línea de comandos para medir el sistema.
+
+    Ejemplos: ``python benchmark.py --output bench.json --save-baseline`` y luego
+    ``python benchmark.py --baseline bench.json``, que termina con código 1 si alguna etapa empeoró.
+    """
+    parser = argparse.ArgumentParser(description="Mide el tiempo y la memoria de cada etapa del recomendador.")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='bundled')
+    parser.add_argument('--workdir', default=None, help="Carpeta de trabajo a conservar (reutiliza el dataset sintético).")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=20, help="Usuarios por etapa de consulta.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="No mide el pico de memoria de cada etapa.")
+    parser.add_argument('--output', default=None, help="Archivo JSON con los resultados.")
+    parser.add_argument('--baseline', default=None, help="Resultados anteriores con los que comparar.")
+    parser.add_argument('--save-baseline', action='store_true', help="Escribe los resultados también en --baseline.")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    if args.save_baseline and not args.baseline:
+        parser.error("--save-baseline requires --baseline")
+
+    results = run_benchmark(args.scale, args.workdir, args.repeat, args.queries, args.seed, not args.no_memory)
+    meta = results['meta']
+    print(f"{meta['scale']}: {meta['ratings']} ratings, {meta['users']} users, {meta['movies']} movies")
+    for name, stage in results['stages'].items():
+        peak = '' if stage['peak_bytes'] is None else f"  peak {stage['peak_bytes'] / 2**20:8.1f} MiB"
+        print(f"  {name:<24} {stage['seconds'] * 1000:10.3f} ms{peak}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('scale') != meta['scale']:
+            parser.error(f"baseline was measured on {baseline['meta'].get('scale')!r}, not {meta['scale']!r}")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
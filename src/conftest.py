@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+GENRES = ['Action', 'Comedy', 'Drama', 'Horror', 'Romance']
+
+
+@pytest.fixture
+def dataset_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    dataset_dir = tmp_path / 'dataset'
+    dataset_dir.mkdir()
+    movies = pd.DataFrame({
+        'movieId': np.arange(1, 41),
+        'title': [f'Movie {i} ({1980 + i % 30})' for i in range(1, 41)],
+        'genres': ['|'.join(rng.choice(GENRES, rng.integers(1, 3), replace=False)) for _ in range(40)],
+    })
+    movies.to_csv(dataset_dir / 'movies.csv', index=False)
+    pairs = {(int(u), int(m)) for u, m in zip(rng.integers(1, 31, 400), rng.integers(1, 41, 400))}
+    ratings = pd.DataFrame(sorted(pairs), columns=['userId', 'movieId'])
+    ratings['rating'] = rng.choice(np.arange(1, 11) / 2, len(ratings))
+    ratings['timestamp'] = rng.integers(1_500_000_000, 1_600_000_000, len(ratings))
+    ratings.to_csv(dataset_dir / 'ratings.csv', index=False)
+    return str(dataset_dir)
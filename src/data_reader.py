@@ -1,22 +1,251 @@
+import hashlib
+import os
+
+import numpy as np
 import pandas as pd
 
-def read_data():
+from artifact_store import read_arrays, read_meta, resolve, write_arrays
+from instrumentation import timed
+from rating_log import apply_log, read_log, snapshot_lock
+
+DATASET_FILES = ('movies.csv', 'ratings.csv')
+CACHE_VERSION = 1
+CACHE_DIRNAME = 'cache'
+
+@timed('read_data')
+def read_data(dataset_dir='dataset', compact=False):
     """
     Lee los datos de películas y calificaciones desde archivos CSV y los preprocesa.
 
+    Parameters
+    ----------
+    dataset_dir : str, optional
+        Carpeta que contiene ``movies.csv`` y ``ratings.csv``.
+    compact : bool, optional
+        Si es True, los datos se cargan con ``read_compact_data`` (tipos angostos y caché en disco)
+        y se devuelven con la misma forma que el modo normal.
+
     Returns
     -------
     md_genres : DataFrame
         Un DataFrame con las películas y sus géneros, donde cada género es una fila separada.
     ratings : DataFrame
-        Un DataFrame con las calificaciones de los usuarios para las películas.
+        Un DataFrame con las calificaciones de los usuarios para las películas, con el diario de
+        calificaciones (``rating_log``) ya aplicado. ``ratings.attrs['log_offset']`` indica hasta qué
+        posición del diario se leyó y ``ratings.attrs['log_generation']``, de qué generación del diario.
     md : DataFrame
         Un DataFrame con las películas y sus géneros, donde los géneros están en una sola columna.
     """
-    md = pd.read_csv('dataset/movies.csv')
+    if compact:
+        data = read_compact_data(dataset_dir)
+        return data.md_genres, data.ratings, data.md
+
+    md = pd.read_csv(os.path.join(dataset_dir, 'movies.csv'))
     md[['title', 'year']] = md['title'].str.extract(r'(.*)\s\((\d{4})\)', expand=True)
     md['genres'] = md['genres'].str.split('|')
-    ratings = pd.read_csv('dataset/ratings.csv')
+    # ``ratings.csv`` y el diario se leen sin que ``compact`` los cambie en el medio
+    with snapshot_lock(dataset_dir):
+        ratings = pd.read_csv(os.path.join(dataset_dir, 'ratings.csv'))
+        log_entries, log_offset, log_generation = read_log(dataset_dir)
+    ratings = apply_log(ratings, log_entries)
+    ratings.attrs['log_offset'] = log_offset
+    ratings.attrs['log_generation'] = log_generation
     md_genres = md.explode('genres')
 
     return md_genres, ratings, md
+
+
+class CompactData:
+    """
+    El dataset en formato compacto: IDs int32, calificaciones float32 y géneros como una matriz
+    multi-hot uint8 en lugar de listas y filas repetidas.
+
+    ``md`` y ``md_genres`` (con la misma forma que los de ``read_data``) se arman a partir de la
+    matriz de géneros solo la primera vez que se piden.
+
+    Attributes
+    ----------
+    movies : DataFrame
+        ``movieId`` (int32), ``title`` y ``year`` (categórico), una fila por película.
+    genre_names : list of str
+        Los géneros, en el orden de las columnas de ``genres``.
+    genres : ndarray of uint8
+        Matriz (películas x géneros): 1 si la película tiene el género.
+    ratings : DataFrame
+        ``userId`` y ``movieId`` (int32), ``rating`` (float32) y ``timestamp`` (int64).
+    """
+
+    def __init__(self, movies, genre_names, genres, ratings):
+        self.movies = movies
+        self.genre_names = list(genre_names)
+        self.genres = genres
+        self.ratings = ratings
+        self._md = None
+        self._md_genres = None
+
+    @classmethod
+    def from_csv(cls, dataset_dir='dataset'):
+        """Lee y convierte los CSV del dataset (sin aplicar el diario de calificaciones)."""
+        movies = pd.read_csv(os.path.join(dataset_dir, 'movies.csv'), dtype={'movieId': np.int32})
+        movies[['title', 'year']] = movies['title'].str.extract(r'(.*)\s\((\d{4})\)', expand=True)
+        movies['year'] = movies['year'].astype('category')
+
+        genre_lists = movies.pop('genres').str.split('|')
+        codes, genre_names = pd.factorize(genre_lists.explode(), sort=True)
+        genres = np.zeros((len(movies), len(genre_names)), dtype=np.uint8)
+        genres[np.repeat(np.arange(len(movies)), genre_lists.str.len()), codes] = 1
+
+        ratings = pd.read_csv(os.path.join(dataset_dir, 'ratings.csv'),
+                              dtype={'userId': np.int32, 'movieId': np.int32, 'rating': np.float32,
+                                     'timestamp': np.int64})
+        return cls(movies, genre_names.tolist(), genres, ratings)
+
+    @property
+    def md(self):
+        """Las películas con la columna ``genres`` como lista de géneros, igual que en ``read_data``."""
+        if self._md is None:
+            names = np.array(self.genre_names, dtype=object)
+            genre_lists = [names[np.flatnonzero(row)].tolist() for row in self.genres]
+            self._md = self.movies.assign(genres=genre_lists)[['movieId', 'title', 'genres', 'year']]
+        return self._md
+
+    @property
+    def md_genres(self):
+        """Las películas con un género por fila (``genres`` categórico), igual que en ``read_data``."""
+        if self._md_genres is None:
+            rows, codes = np.nonzero(self.genres)
+            md_genres = self.movies.iloc[rows]
+            md_genres.insert(2, 'genres', pd.Categorical.from_codes(codes, categories=self.genre_names))
+            self._md_genres = md_genres
+        return self._md_genres
+
+    def to_arrays(self):
+        """Devuelve los arreglos que definen el dataset, para guardarlo en disco."""
+        year = self.movies['year'].cat
+        return {
+            'movie_ids': self.movies['movieId'].to_numpy(),
+            'titles': self.movies['title'].fillna('').to_numpy(dtype=str),
+            'has_title': self.movies['title'].notna().to_numpy(),
+            'year_codes': year.codes.to_numpy(),
+            'year_categories': year.categories.to_numpy(dtype=str),
+            'genres': self.genres,
+            'genre_names': np.array(self.genre_names, dtype=str),
+            'user_ids': self.ratings['userId'].to_numpy(),
+            'rating_movie_ids': self.ratings['movieId'].to_numpy(),
+            'ratings': self.ratings['rating'].to_numpy(),
+            'timestamps': self.ratings['timestamp'].to_numpy(),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Reconstruye el dataset a partir de ``to_arrays``."""
+        titles = pd.Series(arrays['titles']).where(arrays['has_title'])
+        movies = pd.DataFrame({
+            'movieId': arrays['movie_ids'],
+            'title': titles,
+            'year': pd.Categorical.from_codes(arrays['year_codes'], categories=arrays['year_categories'].tolist()),
+        })
+        ratings = pd.DataFrame({
+            'userId': arrays['user_ids'],
+            'movieId': arrays['rating_movie_ids'],
+            'rating': arrays['ratings'],
+            'timestamp': arrays['timestamps'],
+        })
+        return cls(movies, arrays['genre_names'].tolist(), arrays['genres'], ratings)
+
+
+@timed('read_compact_data')
+def read_compact_data(dataset_dir='dataset', cache_dir=None):
+    """
+    Lee el dataset en formato compacto, reutilizando una copia ya convertida guardada en disco.
+
+    La copia (un ``.npy`` por arreglo y ``meta.json``) se guarda en ``cache_dir`` junto con la huella
+    de los CSV y se vuelve a generar cuando los CSV cambian. El diario de calificaciones se aplica
+    después de cargarla, así que calificar películas no la invalida.
+
+    Parameters
+    ----------
+    dataset_dir : str, optional
+        Carpeta que contiene ``movies.csv`` y ``ratings.csv``.
+    cache_dir : str, optional
+        Carpeta de la copia convertida. Por defecto, ``<dataset_dir>/cache``.
+
+    Returns
+    -------
+    CompactData
+        El dataset, con el diario aplicado a ``ratings`` y ``ratings.attrs['log_offset']`` y
+        ``ratings.attrs['log_generation']`` como en ``read_data``.
+    """
+    cache_dir = os.path.join(dataset_dir, CACHE_DIRNAME) if cache_dir is None else cache_dir
+    # ``ratings.csv`` y el diario se leen sin que ``compact`` los cambie en el medio
+    with snapshot_lock(dataset_dir):
+        directory = resolve(cache_dir)
+        meta = read_meta(directory)
+        previous = meta['fingerprint'] if meta else None
+        fingerprint = dataset_fingerprint(dataset_dir, previous=previous)
+
+        if meta and meta.get('version') == CACHE_VERSION and same_content(previous, fingerprint):
+            data = CompactData.from_arrays(read_arrays(directory, meta['arrays'], mmap=False))
+        else:
+            data = CompactData.from_csv(dataset_dir)
+            _write_cache(data, cache_dir, fingerprint)
+
+        log_entries, log_offset, log_generation = read_log(dataset_dir)
+    data.ratings = apply_log(data.ratings, log_entries)
+    data.ratings.attrs['log_offset'] = log_offset
+    data.ratings.attrs['log_generation'] = log_generation
+    return data
+
+
+def _write_cache(data, cache_dir, fingerprint):
+    arrays = data.to_arrays()
+    write_arrays(cache_dir, arrays, {'version': CACHE_VERSION, 'fingerprint': fingerprint, 'arrays': sorted(arrays)})
+
+
+def dataset_fingerprint(dataset_dir='dataset', previous=None):
+    """
+    Calcula la huella de los CSV del dataset para saber si una copia derivada sigue siendo válida.
+
+    El hash del contenido solo se recalcula cuando el tamaño o la fecha de modificación de un
+    archivo no coinciden con la huella anterior.
+
+    Parameters
+    ----------
+    dataset_dir : str, optional
+        Carpeta que contiene ``movies.csv`` y ``ratings.csv``.
+    previous : dict, optional
+        Una huella calculada antes, de la cual se reutilizan los hashes todavía válidos.
+
+    Returns
+    -------
+    dict
+        Para cada archivo, su tamaño, fecha de modificación (ns) y hash SHA-256.
+    """
+    previous = previous or {}
+    fingerprint = {}
+    for name in DATASET_FILES:
+        path = os.path.join(dataset_dir, name)
+        stat = os.stat(path)
+        old = previous.get(name, {})
+        if old.get('size') == stat.st_size and old.get('mtime_ns') == stat.st_mtime_ns:
+            sha256 = old['sha256']
+        else:
+            sha256 = _file_sha256(path)
+        fingerprint[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+    return fingerprint
+
+
+def same_content(fingerprint, other):
+    """Indica si dos huellas corresponden al mismo contenido de los CSV."""
+    if not fingerprint or not other:
+        return False
+    return {name: entry['sha256'] for name, entry in fingerprint.items()} == \
+        {name: entry['sha256'] for name, entry in other.items()}
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from batch_recommender import BatchScorer
+from data_reader import read_data
+from model_store import DEFAULT_DATASET_DIR, load_model, save_model
+from recommender_model import RecommenderModel
+
+SPLITS = ('random', 'temporal')
+
+_worker = {}  # BatchScorer de cada proceso del pool
+
+
+def split_ratings(ratings, method='random', test_size=0.3, seed=42):
+    """
+    Separa las calificaciones en entrenamiento y prueba.
+
+    Parameters
+    ----------
+    ratings : DataFrame
+        Las calificaciones, con las columnas ``userId``, ``movieId``, ``rating`` y ``timestamp``.
+    method : {'random', 'temporal'}, optional
+        ``'random'`` toma una muestra al azar de todas las calificaciones (como ``metrics.ipynb``);
+        ``'temporal'`` toma las calificaciones más recientes de cada usuario, de modo que el modelo
+        se evalúa prediciendo el futuro de cada usuario a partir de su pasado.
+    test_size : float, optional
+        Fracción de las calificaciones (de cada usuario, si es temporal) que va a prueba.
+    seed : int, optional
+        Semilla de la muestra aleatoria.
+
+    Returns
+    -------
+    train, test : DataFrame
+        Las calificaciones de entrenamiento y de prueba.
+    """
+    if method == 'random':
+        test_mask = np.zeros(len(ratings), dtype=bool)
+        test_mask[np.random.default_rng(seed).permutation(len(ratings))[:int(round(test_size * len(ratings)))]] = True
+    elif method == 'temporal':
+        # Posición de cada calificación en la historia de su usuario (0 = la más antigua)
+        order = ratings.groupby('userId', sort=False)['timestamp'].rank(method='first', ascending=True)
+        counts = ratings.groupby('userId', sort=False)['userId'].transform('size')
+        test_mask = (order > np.floor(counts * (1 - test_size))).to_numpy()
+    else:
+        raise ValueError(f"Unknown split method: {method!r} (expected one of {list(SPLITS)})")
+    return ratings[~test_mask], ratings[test_mask]
+
+
+def _init_worker(model_dir):
+    model, _ = load_model(model_dir)
+    _worker['scorer'] = BatchScorer(model)
+
+
+def _predict_chunk(args):
+    user_ids, movie_ids, batch_size = args
+    return predict_pairs(_worker['scorer'], user_ids, movie_ids, batch_size)
+
+
+def predict_pairs(scorer, user_ids, movie_ids, batch_size=256):
+    """
+    Predice la calificación de pares usuario-película, por bloques de usuarios.
+
+    Parameters
+    ----------
+    scorer : BatchScorer
+        El modelo con el que se predice.
+    user_ids, movie_ids : ndarray of int
+        Los pares, agrupados por usuario (todas las filas de un usuario contiguas).
+    batch_size : int, optional
+        Cantidad de usuarios por producto de matrices.
+
+    Returns
+    -------
+    ndarray of float64
+        La predicción de cada par, redondeada a un decimal; 0 si no se puede predecir (la película
+        no está en el entrenamiento o ningún vecino la calificó).
+    """
+    predictions = np.zeros(len(user_ids))
+    model_movies = scorer.ratings.movie_ids
+    cols = np.minimum(np.searchsorted(model_movies, movie_ids), len(model_movies) - 1)
+    known = model_movies[cols] == movie_ids
+
+    starts = np.flatnonzero(np.r_[True, user_ids[1:] != user_ids[:-1]])
+    bounds = np.r_[starts, len(user_ids)]
+    for block in range(0, len(starts), batch_size):
+        lo, hi = bounds[block], bounds[min(block + batch_size, len(starts))]
+        block_users = user_ids[starts[block:block + batch_size]]
+        rows = np.repeat(np.arange(len(block_users)), np.diff(bounds[block:block + len(block_users) + 1]))
+        block_predictions = scorer.predict(block_users)
+        predictions[lo:hi] = np.where(known[lo:hi], block_predictions[rows, cols[lo:hi]], 0)
+    return np.round(predictions, 1)
+
+
+def predict_test_ratings(model, test, workers=None, chunk_size=2048, batch_size=256):
+    """
+    Predice las calificaciones de prueba, repartiendo los usuarios entre procesos.
+
+    Reemplaza a ``Recommender.recommend_movies_for_test``: en lugar de predecir usuario por usuario,
+    cada proceso predice bloques de usuarios con ``BatchScorer.predict``. Con más de un proceso, el
+    modelo se guarda en un artefacto temporal que cada proceso carga con mmap (ver ``batch_recommender``).
+
+    Parameters
+    ----------
+    model : RecommenderModel
+        El modelo entrenado con las calificaciones de entrenamiento.
+    test : DataFrame
+        Las calificaciones de prueba.
+    workers : int, optional
+        Cantidad de procesos (por defecto, uno por CPU). Con 1 se calcula en el proceso actual.
+    chunk_size : int, optional
+        Cantidad de usuarios que se envían juntos a un proceso.
+    batch_size : int, optional
+        Cantidad de usuarios por producto de matrices.
+
+    Returns
+    -------
+    DataFrame
+        Columnas ``userId``, ``movieId``, ``rating`` (la real) y ``prediction``, solo para los usuarios
+        que están en el modelo y los pares con predicción distinta de 0.
+    """
+    scorer = BatchScorer(model)
+    test = test[test['userId'].isin(scorer.user_ids())].sort_values('userId', kind='stable')
+    user_ids = test['userId'].to_numpy()
+    movie_ids = test['movieId'].to_numpy()
+
+    starts = np.flatnonzero(np.r_[True, user_ids[1:] != user_ids[:-1]])
+    bounds = np.r_[starts[::chunk_size], len(user_ids)]
+    chunks = [(user_ids[lo:hi], movie_ids[lo:hi], batch_size) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1 or len(chunks) <= 1:
+        predictions = [predict_pairs(scorer, *chunk) for chunk in chunks]
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix='evaluation-model-')
+        model_dir = os.path.join(tmp_dir, 'model')
+        try:
+            save_model(model, model_dir)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_dir,)) as pool:
+                predictions = list(pool.map(_predict_chunk, chunks))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    result = test[['userId', 'movieId', 'rating']].assign(
+        prediction=np.concatenate(predictions) if predictions else np.zeros(0))
+    return result[result['prediction'] != 0].reset_index(drop=True)
+
+
+def evaluate(predictions, test, threshold=3):
+    """
+    Calcula las métricas de ``metrics.ipynb`` con operaciones por grupos en lugar de un ciclo por usuario.
+
+    Una película se recomienda si su predicción supera ``threshold`` y es un acierto si además su
+    calificación real lo supera. Por usuario: precisión = aciertos / recomendadas y recall =
+    aciertos / calificaciones de prueba. Como en el notebook, los promedios macro y las sumas micro
+    son sobre los usuarios con al menos un acierto. MAP ordena las recomendaciones de cada usuario
+    por predicción.
+
+    Parameters
+    ----------
+    predictions : DataFrame
+        El resultado de ``predict_test_ratings``.
+    test : DataFrame
+        Todas las calificaciones de prueba.
+    threshold : float, optional
+        Calificación a partir de la cual una película se considera recomendada o relevante.
+
+    Returns
+    -------
+    dict
+        ``precision``, ``recall`` y ``f1`` (macro y micro), ``map``, ``rmse``, ``mae`` y los tamaños.
+    """
+    recommended = predictions[predictions['prediction'] > threshold]
+    hit = (recommended['rating'] > threshold).to_numpy()
+
+    per_user = pd.DataFrame({
+        'hits': pd.Series(hit, index=recommended.index).groupby(recommended['userId']).sum(),
+        'recommended': recommended.groupby('userId').size(),
+    })
+    per_user['tested'] = test.groupby('userId').size().reindex(per_user.index)
+    valid = per_user[per_user['hits'] > 0]
+    precision = valid['hits'] / valid['recommended']
+    recall = valid['hits'] / valid['tested']
+    f1 = 2 * precision * recall / (precision + recall)
+
+    total_hits = int(valid['hits'].sum())
+    total_recommended = int(valid['recommended'].sum())
+    total_tested = int(valid['tested'].sum())
+    micro_precision = total_hits / total_recommended if total_recommended else 0.0
+    micro_recall = total_hits / total_tested if total_tested else 0.0
+
+    # MAP: precisión acumulada en cada acierto, dentro del ranking de cada usuario
+    ranked = recommended.assign(hit=hit).sort_values(['userId', 'prediction'], ascending=[True, False], kind='stable')
+    rank = ranked.groupby('userId').cumcount().to_numpy() + 1
+    ranked_hits = ranked['hit'].to_numpy()
+    hits_so_far = ranked.groupby('userId')['hit'].cumsum().to_numpy()
+    precision_at_hit = pd.Series(np.where(ranked_hits, hits_so_far / rank, 0.0)).groupby(ranked['userId'].to_numpy())
+    ap = precision_at_hit.sum() / pd.Series(ranked_hits).groupby(ranked['userId'].to_numpy()).sum().replace(0, np.nan)
+
+    errors = (predictions['prediction'] - predictions['rating']).to_numpy()
+    return {
+        'precision_macro': float(precision.mean()) if len(valid) else 0.0,
+        'recall_macro': float(recall.mean()) if len(valid) else 0.0,
+        'f1_macro': float(f1.mean()) if len(valid) else 0.0,
+        'precision_micro': micro_precision,
+        'recall_micro': micro_recall,
+        'f1_micro': _harmonic_mean(micro_precision, micro_recall),
+        'map': float(ap.fillna(0).mean()) if len(ap) else 0.0,
+        'rmse': float(np.sqrt(np.mean(errors ** 2))) if len(errors) else 0.0,
+        'mae': float(np.mean(np.abs(errors))) if len(errors) else 0.0,
+        'users': int(len(per_user)),
+        'predictions': int(len(predictions)),
+        'test_ratings': int(len(test)),
+    }
+
+
+def _harmonic_mean(precision, recall):
+    return 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+
+
+def run_evaluation(dataset_dir=DEFAULT_DATASET_DIR, method='random', test_size=0.3, seed=42, workers=None,
+                   chunk_size=2048, batch_size=256, threshold=3):
+    """
+    Separa el dataset, entrena el modelo con la parte de entrenamiento y evalúa con la de prueba.
+
+    Returns
+    -------
+    dict
+        Las métricas de ``evaluate``.
+    """
+    md_genres, ratings, md = read_data(dataset_dir, compact=True)
+    ratings = ratings.loc[ratings['rating'] != 0]
+    train, test = split_ratings(ratings, method, test_size, seed)
+    model = RecommenderModel.build(md_genres, train, md)
+    predictions = predict_test_ratings(model, test, workers, chunk_size, batch_size)
+    return evaluate(predictions, test, threshold)
+
+
+def main():
+    """
+    Punto de entrada de línea de comandos para evaluar el recomendador.
+
+    Ejemplo: ``python evaluation.py --split temporal --test-size 0.2 --workers 8 --output metrics.json``
+    """
+    parser = argparse.ArgumentParser(description="Evalúa las recomendaciones con una partición de prueba.")
+    parser.add_argument('--split', choices=SPLITS, default='random')
+    parser.add_argument('--test-size', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--threshold', type=float, default=3)
+    parser.add_argument('--workers', type=int, default=None, help="Procesos (por defecto, uno por CPU).")
+    parser.add_argument('--chunk-size', type=int, default=2048)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR)
+    parser.add_argument('--output', default=None, help="Archivo JSON con las métricas.")
+    args = parser.parse_args()
+    if not 0 < args.test_size < 1:
+        parser.error("--test-size must be between 0 and 1")
+
+    metrics = run_evaluation(args.dataset_dir, args.split, args.test_size, args.seed, args.workers,
+                             args.chunk_size, args.batch_size, args.threshold)
+    for name, value in metrics.items():
+        print(f"{name:<16} {value:.4f}" if isinstance(value, float) else f"{name:<16} {value}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'split': args.split, 'test_size': args.test_size, 'seed': args.seed, **metrics}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
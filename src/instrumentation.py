@@ -0,0 +1,272 @@
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+ENABLE_ENV_VAR = 'RECOMMENDER_INSTRUMENT'
+PROFILE_ENV_VAR = 'RECOMMENDER_PROFILE'
+PROFILERS = ('cprofile', 'tracemalloc')
+
+logger = logging.getLogger('recommender')
+
+_settings = {
+    'enabled': os.environ.get(ENABLE_ENV_VAR, '').lower() not in ('', '0', 'false', 'no'),
+    'profile': frozenset(p for p in os.environ.get(PROFILE_ENV_VAR, '').lower().split(',') if p in PROFILERS),
+}
+_local = threading.local()  # La traza de la solicitud activa en cada hilo
+_recent = deque(maxlen=50)  # Las últimas trazas terminadas, para el panel de depuración
+_totals = {}  # Etapa -> [llamadas, segundos] acumulados en el proceso
+_counters = {}  # Contador -> valor acumulado en el proceso
+_lock = threading.Lock()
+# cProfile solo admite un perfilador activo por proceso (desde Python 3.12, otro lanza ValueError)
+_profiler_lock = threading.Lock()
+_disabled = contextlib.nullcontext()
+
+
+def configure(enabled=None, profile=None, history=None):
+    """
+    Cambia la configuración leída de las variables de entorno al importar el módulo.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Activa los temporizadores, contadores y la línea de log por solicitud
+        (variable ``RECOMMENDER_INSTRUMENT``).
+    profile : iterable of str, optional
+        Perfiladores por solicitud: ``'cprofile'`` y/o ``'tracemalloc'`` (variable
+        ``RECOMMENDER_PROFILE``, separados por comas). Solo se usan si la instrumentación está activa.
+        cProfile perfila una solicitud a la vez: las que empiezan mientras otra se perfila se miden
+        sin perfil y lo indican en ``profile_skipped``.
+    history : int, optional
+        Cantidad de trazas recientes que se conservan.
+    """
+    global _recent
+    if enabled is not None:
+        _settings['enabled'] = bool(enabled)
+    if profile is not None:
+        unknown = set(profile) - set(PROFILERS)
+        if unknown:
+            raise ValueError(f"Unknown profilers: {sorted(unknown)} (expected {list(PROFILERS)})")
+        _settings['profile'] = frozenset(profile)
+    if history is not None:
+        with _lock:
+            _recent = deque(_recent, maxlen=history)
+
+
+def enabled():
+    """Indica si la instrumentación está activa."""
+    return _settings['enabled']
+
+
+class Trace:
+    """
+    Las mediciones de una solicitud (una recomendación, una calificación).
+
+    Attributes
+    ----------
+    name : str
+        El tipo de solicitud.
+    attrs : dict
+        Datos de la solicitud, por ejemplo el usuario.
+    stages : dict
+        Etapa -> segundos acumulados durante la solicitud.
+    counters : dict
+        Contador -> valor acumulado durante la solicitud.
+    seconds : float
+        Duración total.
+    peak_bytes : int or None
+        Pico de memoria, si se usó ``tracemalloc``.
+    profile : str or None
+        Las funciones más costosas según ``cProfile``, si se usó.
+    """
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.stages = {}
+        self.counters = {}
+        self.seconds = None
+        self.peak_bytes = None
+        self.profile = None
+
+    def to_dict(self):
+        """Devuelve la traza como un dict serializable a JSON (sin la salida de ``cProfile``)."""
+        result = {'request': self.name, **self.attrs, 'ms': round(self.seconds * 1000, 3),
+                  'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+                  'counters': self.counters}
+        if self.peak_bytes is not None:
+            result['peak_bytes'] = self.peak_bytes
+        return result
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def _record(name, seconds):
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.stages[name] = trace.stages.get(name, 0.0) + seconds
+    with _lock:
+        total = _totals.setdefault(name, [0, 0.0])
+        total[0] += 1
+        total[1] += seconds
+
+
+def stage(name):
+    """
+    Mide una etapa: ``with stage('find_neighbors'): ...``.
+
+    Con la instrumentación desactivada devuelve un contexto vacío compartido, sin medir nada.
+    """
+    if not _settings['enabled']:
+        return _disabled
+    return _Stage(name)
+
+
+def timed(name):
+    """Decorador que mide cada llamada a la función como la etapa ``name`` (ver ``stage``)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _settings['enabled']:
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """Suma ``n`` al contador ``name`` del proceso y de la solicitud activa, si la hay."""
+    if not _settings['enabled']:
+        return
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.counters[name] = trace.counters.get(name, 0) + n
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def annotate(**attrs):
+    """Agrega datos a la solicitud activa, por ejemplo de dónde salió la respuesta."""
+    if not _settings['enabled']:
+        return
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def request(name, **attrs):
+    """
+    Mide una solicitud completa y escribe una línea de log JSON al terminar.
+
+    Las etapas y contadores registrados en el mismo hilo mientras dura la solicitud se agregan a su
+    traza. Si ya hay una solicitud activa en el hilo, esta se mide como una etapa más.
+
+    Parameters
+    ----------
+    name : str
+        El tipo de solicitud.
+    **attrs
+        Datos de la solicitud que se incluyen en la traza.
+    """
+    if not _settings['enabled']:
+        return _disabled
+    if getattr(_local, 'trace', None) is not None:
+        return _Stage(name)
+    return _request(name, attrs)
+
+
+@contextlib.contextmanager
+def _request(name, attrs):
+    trace = Trace(name, attrs)
+    profile = _settings['profile']
+    profiler = None
+    if 'cprofile' in profile:
+        if _profiler_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+        else:
+            # Otra solicitud (de otro hilo) ya se está perfilando: esta se mide sin perfil
+            trace.attrs['profile_skipped'] = 'cprofile'
+            logger.info("Not profiling %s: another request is already being profiled", name)
+    started_tracing = False
+    if 'tracemalloc' in profile:
+        # tracemalloc es global al proceso: con solicitudes concurrentes el pico es el de todas juntas.
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+    _local.trace = trace
+    start = time.perf_counter()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        yield trace
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _profiler_lock.release()
+        trace.seconds = time.perf_counter() - start
+        _local.trace = None
+        if 'tracemalloc' in profile:
+            trace.peak_bytes = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+        if profiler is not None:
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(20)
+            trace.profile = output.getvalue()
+
+        _record(name, trace.seconds)
+        with _lock:
+            _recent.append(trace)
+        logger.info(json.dumps(trace.to_dict(), default=str))
+
+
+def recent_traces():
+    """Devuelve las últimas solicitudes medidas, de la más antigua a la más reciente."""
+    with _lock:
+        return list(_recent)
+
+
+def totals():
+    """
+    Devuelve lo acumulado en todo el proceso desde el inicio (o desde ``reset``).
+
+    Returns
+    -------
+    dict
+        ``stages`` (etapa -> ``{'calls': int, 'seconds': float}``) y ``counters`` (contador -> valor).
+    """
+    with _lock:
+        return {'stages': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in _totals.items()},
+                'counters': dict(_counters)}
+
+
+def reset():
+    """Borra las trazas recientes y los totales acumulados."""
+    with _lock:
+        _recent.clear()
+        _totals.clear()
+        _counters.clear()
@@ -0,0 +1,316 @@
+import argparse
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+from artifact_store import read_arrays, resolve, write_arrays
+from data_reader import dataset_fingerprint, read_data, same_content
+from instrumentation import count, stage, timed
+from model_store import DEFAULT_DATASET_DIR, read_model_meta
+from neighbor_finder import top_k_indices
+from rating_matrix import RatingMatrix
+from recommender import Recommender, recommendation_frame
+
+ITEM_MODEL_VERSION = 1
+DEFAULT_ITEM_MODEL_DIR = os.path.join('dataset', 'item_model')
+DEFAULT_ITEM_PARAMS = {'k': 50, 'shrinkage': 100.0}
+DEFAULT_DAMPING = 1.0  # Similitud total que se suma al denominador de las predicciones (ver ``ItemSimilarity.predict``)
+
+_loaded_similarities = {}  # Similitudes ya cargadas en este proceso, por carpeta
+
+
+class ItemSimilarity:
+    """
+    Listas precalculadas de las ``k`` películas más parecidas a cada película.
+
+    La similitud entre dos películas es el coseno de sus calificaciones centradas en la media de
+    cada usuario (coseno ajustado), multiplicado por ``n / (n + shrinkage)``, donde ``n`` es la
+    cantidad de usuarios que calificaron ambas: así las similitudes basadas en pocos usuarios en
+    común pesan menos. Solo se guardan similitudes positivas.
+
+    Attributes
+    ----------
+    movie_ids : ndarray of int
+        IDs de película ordenados; la posición es la fila de ``neighbors``.
+    neighbors : ndarray of int32
+        Matriz (películas x k) con las posiciones de las películas parecidas, o -1 si hay menos de k.
+    similarities : ndarray of float32
+        La similitud correspondiente a cada entrada de ``neighbors``.
+    params : dict
+        ``k`` y ``shrinkage``.
+    """
+
+    def __init__(self, movie_ids, neighbors, similarities, params=None):
+        self.movie_ids = movie_ids
+        self.neighbors = neighbors
+        self.similarities = similarities
+        self.params = {**DEFAULT_ITEM_PARAMS, **(params or {})}
+
+    @classmethod
+    def build(cls, ratings, k=50, shrinkage=100.0, batch_size=512):
+        """
+        Calcula las listas de películas parecidas a partir de la matriz de calificaciones.
+
+        Las similitudes de un bloque de ``batch_size`` películas contra todas las demás salen de un
+        producto de matrices dispersas, así que la memoria usada es O(batch_size x películas).
+
+        Parameters
+        ----------
+        ratings : RatingMatrix
+            Las calificaciones de los usuarios.
+        k : int, optional
+            Cantidad de películas parecidas por película.
+        shrinkage : float, optional
+            Cuánto se reducen las similitudes con pocos usuarios en común.
+        batch_size : int, optional
+            Películas por producto de matrices.
+
+        Returns
+        -------
+        ItemSimilarity
+            Las listas calculadas.
+        """
+        matrix = ratings.compacted()
+        csr = matrix.csr
+        n_movies = csr.shape[1]
+        counts = np.diff(csr.indptr)
+        rows = np.repeat(np.arange(csr.shape[0]), counts)
+        sums = np.bincount(rows, weights=csr.data, minlength=csr.shape[0])
+        means = sums / np.maximum(counts, 1)
+
+        centered = sp.csr_matrix((csr.data - means[rows], csr.indices, csr.indptr), shape=csr.shape)
+        rated = sp.csr_matrix((np.ones(csr.nnz), csr.indices, csr.indptr), shape=csr.shape)
+        centered_t = centered.T.tocsr()
+        rated_t = rated.T.tocsr()
+        norms = np.sqrt(np.asarray(centered_t.multiply(centered_t).sum(axis=1)).ravel())
+
+        width = min(k, max(n_movies - 1, 0))
+        neighbors = np.full((n_movies, width), -1, dtype=np.int32)
+        similarities = np.zeros((n_movies, width), dtype=np.float32)
+        for start in range(0, n_movies, batch_size):
+            block = np.arange(start, min(start + batch_size, n_movies))
+            dots = (centered_t[block] @ centered).toarray()
+            common = (rated_t[block] @ rated).toarray()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sims = dots / (norms[block, None] * norms[None, :]) * (common / (common + shrinkage))
+            sims[~(sims > 0)] = -np.inf
+            sims[np.arange(len(block)), block] = -np.inf
+
+            top = top_k_indices(sims, width)
+            top_sims = np.take_along_axis(sims, top, axis=1)
+            found = np.isfinite(top_sims)
+            neighbors[block] = np.where(found, top, -1)
+            similarities[block] = np.where(found, top_sims, 0)
+
+        return cls(matrix.movie_ids, neighbors, similarities, {'k': k, 'shrinkage': shrinkage})
+
+    def predict(self, movie_ids, ratings, damping=DEFAULT_DAMPING, return_support=False):
+        """
+        Predice la calificación de un usuario para todas las películas a partir de las que calificó.
+
+        La predicción es la media del usuario más el promedio de sus desvíos en las películas
+        parecidas, ponderado por la similitud; ``damping`` se suma al total de similitudes del
+        denominador, así que una película respaldada por una sola película parecida (o por pocas y
+        poco parecidas) queda cerca de la media del usuario en lugar de copiar ese único desvío.
+
+        Para cada película calificada se recorren solo sus ``k`` películas parecidas, así que el
+        costo es O(calificadas x k).
+
+        Parameters
+        ----------
+        movie_ids : array_like of int
+            Las películas que calificó el usuario.
+        ratings : array_like of float
+            Sus calificaciones.
+        damping : float, optional
+            Cuánto se acercan a la media del usuario las predicciones con poco respaldo.
+        return_support : bool, optional
+            Si es True, también devuelve el respaldo de cada predicción.
+
+        Returns
+        -------
+        predictions : ndarray of float64
+            La calificación predicha para cada película de ``movie_ids`` del índice, o 0 si ninguna
+            película calificada es parecida a ella.
+        support : ndarray of float64
+            La suma de las similitudes con las películas calificadas; solo si ``return_support``.
+        """
+        n_movies = len(self.movie_ids)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        if len(ratings) == 0:
+            return (np.zeros(n_movies), np.zeros(n_movies)) if return_support else np.zeros(n_movies)
+
+        pos = np.searchsorted(self.movie_ids, movie_ids)
+        known = pos < n_movies
+        known[known] = self.movie_ids[pos[known]] == np.asarray(movie_ids)[known]
+        user_mean = ratings.mean()
+
+        neighbors = self.neighbors[pos[known]]
+        sims = self.similarities[pos[known]].astype(np.float64)
+        deviations = np.broadcast_to((ratings[known] - user_mean)[:, None], neighbors.shape)
+        valid = neighbors >= 0
+        numerator = np.bincount(neighbors[valid], weights=sims[valid] * deviations[valid], minlength=n_movies)
+        denominator = np.bincount(neighbors[valid], weights=sims[valid], minlength=n_movies)
+
+        predictions = np.where(denominator > 0, user_mean + numerator / (denominator + damping), 0)
+        return (predictions, denominator) if return_support else predictions
+
+    def to_arrays(self):
+        """Devuelve los arreglos que definen las listas, para guardarlas en disco."""
+        return {'movie_ids': self.movie_ids, 'neighbors': self.neighbors, 'similarities': self.similarities}
+
+    @classmethod
+    def from_arrays(cls, arrays, params=None):
+        """Reconstruye las listas a partir de ``to_arrays``."""
+        return cls(arrays['movie_ids'], arrays['neighbors'], arrays['similarities'], params)
+
+
+def save_item_similarity(similarity, item_model_dir=DEFAULT_ITEM_MODEL_DIR, fingerprint=None):
+    """Guarda las listas de películas parecidas como un artefacto versionado (ver ``model_store``)."""
+    arrays = similarity.to_arrays()
+    meta = {'version': ITEM_MODEL_VERSION, 'fingerprint': fingerprint, 'params': similarity.params,
+            'arrays': sorted(arrays)}
+    write_arrays(item_model_dir, arrays, meta)
+
+
+@timed('load_item_similarity')
+def load_or_build_item_similarity(ratings, item_model_dir=DEFAULT_ITEM_MODEL_DIR, dataset_dir=DEFAULT_DATASET_DIR,
+                                  **params):
+    """
+    Devuelve las listas de películas parecidas, cargándolas del artefacto si siguen siendo válidas.
+
+    Las similitudes entre películas cambian poco, así que el artefacto solo se reconstruye cuando
+    cambian los CSV del dataset (por ejemplo, al compactar el diario) o los parámetros; las
+    calificaciones nuevas del diario no lo invalidan.
+
+    Parameters
+    ----------
+    ratings : RatingMatrix
+        Las calificaciones con las que se construyen las listas si hace falta.
+    item_model_dir : str, optional
+        Carpeta del artefacto. Si es None, las listas se construyen sin guardarse.
+    dataset_dir : str, optional
+        Carpeta del dataset que invalida el artefacto.
+    **params
+        ``k`` y ``shrinkage``.
+
+    Returns
+    -------
+    ItemSimilarity
+        Las listas de películas parecidas.
+    """
+    params = {**DEFAULT_ITEM_PARAMS, **params}
+    if item_model_dir is None:
+        return ItemSimilarity.build(ratings, **params)
+
+    cached = _loaded_similarities.get(item_model_dir)
+    fingerprint = dataset_fingerprint(dataset_dir, previous=cached['fingerprint'] if cached else None)
+    if cached and same_content(cached['fingerprint'], fingerprint) and cached['params'] == params:
+        return cached['similarity']
+
+    directory = resolve(item_model_dir)
+    meta = read_model_meta(directory)
+    if (meta is not None and meta.get('version') == ITEM_MODEL_VERSION
+            and same_content(meta.get('fingerprint'), fingerprint) and meta.get('params') == params):
+        similarity = ItemSimilarity.from_arrays(read_arrays(directory, meta['arrays']), meta['params'])
+    else:
+        similarity = ItemSimilarity.build(ratings, **params)
+        save_item_similarity(similarity, item_model_dir, fingerprint)
+
+    _loaded_similarities[item_model_dir] = {'fingerprint': fingerprint, 'params': params, 'similarity': similarity}
+    return similarity
+
+
+class ItemRecommender(Recommender):
+    """
+    Recomendador basado en películas parecidas (filtrado colaborativo ítem-ítem).
+
+    Tiene la misma interfaz que ``Recommender``: las predicciones salen de las listas precalculadas
+    de ``ItemSimilarity`` y de las calificaciones del usuario en el modelo, en lugar de sus vecinos.
+
+    Attributes
+    ----------
+    item_model_dir : str or None
+        Carpeta del artefacto de ``ItemSimilarity``. Si es None, las listas se calculan en cada llamada.
+    item_params : dict
+        ``k`` y ``shrinkage``.
+    """
+
+    def __init__(self, user_id, model_dir=None, item_model_dir=DEFAULT_ITEM_MODEL_DIR, dataset_dir=DEFAULT_DATASET_DIR,
+                 **item_params):
+        """
+        Parameters
+        ----------
+        user_id : int
+            El ID del usuario para el cual se generarán recomendaciones.
+        model_dir : str, optional
+            Carpeta del artefacto del modelo (ver ``Recommender``).
+        item_model_dir : str, optional
+            Carpeta del artefacto de las listas de películas parecidas.
+        dataset_dir : str, optional
+            Carpeta del dataset que invalida el artefacto.
+        **item_params
+            ``k`` y ``shrinkage``.
+        """
+        super().__init__(user_id, model_dir, dataset_dir)
+        self.item_model_dir = item_model_dir
+        self.item_params = item_params
+
+    def recommend_movies(self, md_genres, rates, md, top_n=None):
+        """
+        Genera una lista de películas recomendadas para el usuario objetivo.
+
+        Parameters
+        ----------
+        top_n : int, optional
+            Si se indica, solo se devuelven las ``top_n`` mejores recomendaciones.
+
+        Returns
+        -------
+        DataFrame
+            Un DataFrame que contiene las películas recomendadas, con el mismo formato que ``Recommender``.
+        """
+        model = self.load_model(md_genres, rates, md)
+        similarity = load_or_build_item_similarity(model.ratings, self.item_model_dir, self.dataset_dir,
+                                                   **self.item_params)
+
+        rated_cols, rated_values = model.ratings.user_row(self.user_id)
+        rated_ids = model.ratings.movie_ids[rated_cols]
+        with stage('predict_ratings'):
+            predictions, support = similarity.predict(rated_ids, rated_values, return_support=True)
+            predictions = np.round(predictions, 2)
+
+        candidates = (predictions > 3) & ~np.isin(similarity.movie_ids, rated_ids)
+        cols = np.flatnonzero(candidates)
+        count('candidates_scored', len(cols))
+
+        # Los empates de la predicción (redondeada) se desempatan por respaldo y después por movieId
+        order = np.lexsort((similarity.movie_ids[cols], -support[cols], -predictions[cols]))
+        if top_n is not None:
+            order = order[:top_n]
+        return recommendation_frame(md, similarity.movie_ids[cols[order]])
+
+
+def main():
+    """
+    Punto de entrada de línea de comandos para precalcular las listas de películas parecidas.
+
+    Ejemplo: ``python item_recommender.py --k 50 --shrinkage 100``
+    """
+    parser = argparse.ArgumentParser(description="Precalcula las películas más parecidas a cada película.")
+    parser.add_argument('--k', type=int, default=DEFAULT_ITEM_PARAMS['k'])
+    parser.add_argument('--shrinkage', type=float, default=DEFAULT_ITEM_PARAMS['shrinkage'])
+    parser.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR)
+    parser.add_argument('--item-model-dir', default=DEFAULT_ITEM_MODEL_DIR)
+    args = parser.parse_args()
+
+    _, ratings, _ = read_data(args.dataset_dir, compact=True)
+    similarity = ItemSimilarity.build(RatingMatrix.from_ratings(ratings), k=args.k, shrinkage=args.shrinkage)
+    save_item_similarity(similarity, args.item_model_dir, dataset_fingerprint(args.dataset_dir))
+    print(f"Item similarities written to {args.item_model_dir}: {len(similarity.movie_ids)} movies, "
+          f"{int((similarity.neighbors >= 0).sum())} neighbor entries")
+
+
+if __name__ == "__main__":
+    main()
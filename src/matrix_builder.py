@@ -1,73 +1,159 @@
 import pandas as pd
 import numpy as np
 from data_reader import *
+from instrumentation import timed
+from rating_matrix import RatingMatrix
 import time
 
 
 
-def build_matrix(md_genres, ratings, md):
+@timed('build_matrix')
+def build_matrix(md_genres, ratings, md, decay='linear', half_life_days=365.0, now=None):
     """
     Crea la matriz híbrida utilizada para calcular las similitudes entre los usuarios y sus preferencias de películas.
 
+    Parameters
+    ----------
+    decay : {'linear', 'exponential', None}, optional
+        Tipo de decaimiento temporal aplicado a cada calificación antes de sumarla por género.
+    half_life_days : float, optional
+        Vida media en días cuando ``decay='exponential'``.
+    now : int, optional
+        Marca de tiempo de referencia para el decaimiento. Por defecto, el instante actual.
+
     Returns
     -------
     hybrid_matrix : DataFrame
         Un DataFrame que representa las preferencias de los usuarios por diferentes géneros.
-    user_movie_matrix : DataFrame
-        Un DataFrame que representa las calificaciones de los usuarios para diferentes películas.
+    user_movie_matrix : RatingMatrix
+        Una matriz dispersa con las calificaciones de los usuarios para diferentes películas.
     md : DataFrame
         Un DataFrame con las películas y sus géneros, donde los géneros están en una sola columna.
     """
+    pivot_table = genre_preferences(md_genres, ratings, decay=decay, half_life_days=half_life_days, now=now)
+    total_ratings = pivot_table.sum(axis=1)
+    proportions = pivot_table.div(total_ratings, axis=0)
+
+    hybrid_matrix = build_hybrid_matrix(proportions)
+
+    user_movie_matrix = RatingMatrix.from_ratings(ratings)
+
+    return hybrid_matrix, user_movie_matrix, md
+
+
+def genre_preferences(md_genres, ratings, decay='linear', half_life_days=365.0, now=None):
+    """
+    Suma, por usuario y género, las películas gustadas (calificación > 3) ponderadas por su antigüedad.
+
+    Returns
+    -------
+    pivot_table : DataFrame
+        Un DataFrame usuarios x géneros con la suma ponderada de películas gustadas.
+    """
     merged = pd.merge(ratings, md_genres, on='movieId')
-    merged['rating>3'] = (merged['rating'] > 3).astype(int)
-    pondValTimestamp(merged['timestamp'], merged['rating>3'])
+    weights = time_decay_weights(merged['timestamp'].to_numpy(), decay=decay, half_life_days=half_life_days, now=now)
+    merged['rating>3'] = (merged['rating'].to_numpy() > 3) * weights
 
-    grouped = merged.groupby(['userId', 'genres'])['rating>3'].sum().reset_index()
+    grouped = merged.groupby(['userId', 'genres'], observed=True)['rating>3'].sum().reset_index()
     grouped = grouped[grouped['genres'] != '(no genres listed)']
+    # Con géneros categóricos (``read_data(compact=True)``) las columnas quedarían en el orden de
+    # las categorías; como texto quedan siempre en orden alfabético.
+    grouped['genres'] = grouped['genres'].astype(str)
 
-    pivot_table = grouped.pivot(index='userId', columns='genres', values='rating>3').fillna(0)
-    total_ratings = pivot_table.sum(axis=1)
-    proportions = pivot_table.div(total_ratings, axis=0)
+    return grouped.pivot(index='userId', columns='genres', values='rating>3').fillna(0)
 
-    likes_many_X_movies = pd.DataFrame(0, index=proportions.index, columns=proportions.columns)
-    likes_some_X_movies = pd.DataFrame(0, index=proportions.index, columns=proportions.columns)
 
-    for user in proportions.index:
-        sorted_genres = proportions.loc[user].sort_values(ascending=False)
-        n_genres = len(sorted_genres)
-        if n_genres == 0:
-            continue
-        first_third = int(n_genres / 3)
-        second_third = int(2 * n_genres / 3)
-        likes_many_X_movies.loc[user, sorted_genres.index[:first_third]] = 1
-        likes_some_X_movies.loc[user, sorted_genres.index[first_third:second_third]] = 1
-
-    likes_many_X_movies_prefixed = likes_many_X_movies.add_prefix('likes_many_')
-    likes_some_X_movies_prefixed = likes_some_X_movies.add_prefix('likes_some_')
-    interleaved_columns = np.array(list(zip(likes_many_X_movies_prefixed.columns, likes_some_X_movies_prefixed.columns))).flatten()
-    likes_many_X_movies_prefixed = likes_many_X_movies_prefixed.reindex(columns=interleaved_columns)
-    likes_some_X_movies_prefixed = likes_some_X_movies_prefixed.reindex(columns=interleaved_columns)
+def build_hybrid_matrix(proportions):
+    """
+    Construye la matriz híbrida a partir de las proporciones de películas gustadas por género.
 
-    hybrid_matrix = pd.DataFrame()
+    Para cada usuario se ordenan los géneros de mayor a menor proporción y se marcan con
+    ``likes_many_`` el primer tercio y con ``likes_some_`` el segundo tercio. Todo el cálculo
+    se hace sobre un arreglo denso usuarios x géneros y la salida se reserva de una sola vez.
 
-    for col_many, col_some in zip(likes_many_X_movies_prefixed.columns, likes_some_X_movies_prefixed.columns):
-        if not likes_many_X_movies_prefixed[col_many].isna().all():
-            hybrid_matrix = pd.concat([hybrid_matrix, likes_many_X_movies_prefixed[col_many]], axis=1)
-        if not likes_some_X_movies_prefixed[col_some].isna().all():
-            hybrid_matrix = pd.concat([hybrid_matrix, likes_some_X_movies_prefixed[col_some]], axis=1)
+    Parameters
+    ----------
+    proportions : DataFrame
+        Un DataFrame usuarios x géneros con la proporción de películas gustadas de cada género.
 
-    user_movie_matrix = ratings.pivot(index='userId', columns='movieId', values='rating').fillna(0)
+    Returns
+    -------
+    hybrid_matrix : DataFrame
+        Un DataFrame con las columnas ``likes_many_<género>`` y ``likes_some_<género>`` intercaladas.
+    """
+    hybrid = hybrid_rows(proportions.to_numpy(dtype=np.float64))
+    columns = [f'{prefix}{genre}' for genre in proportions.columns for prefix in ('likes_many_', 'likes_some_')]
+    return pd.DataFrame(hybrid, index=proportions.index.rename(None), columns=columns)
 
-    return hybrid_matrix, user_movie_matrix, md
 
+def hybrid_rows(values):
+    """
+    Calcula las filas de la matriz híbrida a partir de un arreglo usuarios x géneros.
 
-def pondValTimestamp(timestampArray, ratingsArray):
-    actualTimestamp = int(time.time())
+    Parameters
+    ----------
+    values : ndarray
+        Un arreglo (n_users, n_genres) con la proporción de películas gustadas de cada género
+        (NaN para los usuarios sin películas gustadas).
 
-    # Convertir ratingsArray a tipo float si no lo es
-    if not np.issubdtype(ratingsArray.dtype, np.floating):
-        ratingsArray = ratingsArray.astype(np.float64)
+    Returns
+    -------
+    ndarray of int64
+        Un arreglo (n_users, 2 * n_genres) con las columnas ``likes_many_`` y ``likes_some_`` intercaladas.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_users, n_genres = values.shape
+    first_third = int(n_genres / 3)
+    second_third = int(2 * n_genres / 3)
+
+    # Mismo criterio de orden que sort_values(ascending=False): se ordena el arreglo invertido y
+    # se invierte el resultado, de modo que los empates se resuelven igual que antes. Los usuarios
+    # sin películas gustadas (fila NaN) conservan el orden original de las columnas.
+    reversed_order = np.argsort(values[:, ::-1], axis=1, kind='quicksort')
+    order = (n_genres - 1 - reversed_order)[:, ::-1]
+    empty_rows = np.isnan(values).all(axis=1)
+    order[empty_rows] = np.arange(n_genres)
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(n_genres), axis=1)
+
+    hybrid = np.empty((n_users, 2 * n_genres), dtype=np.int64)
+    hybrid[:, 0::2] = ranks < first_third
+    hybrid[:, 1::2] = (ranks >= first_third) & (ranks < second_third)
+    return hybrid
+
+
+def time_decay_weights(timestamps, decay='linear', half_life_days=365.0, now=None):
+    """
+    Calcula el peso de cada calificación según su antigüedad.
+
+    Parameters
+    ----------
+    timestamps : array_like
+        Marcas de tiempo (segundos desde epoch) de las calificaciones.
+    decay : {'linear', 'exponential', None}, optional
+        ``'linear'`` pondera por ``timestamp / now``; ``'exponential'`` divide el peso a la mitad
+        cada ``half_life_days`` días de antigüedad; ``None`` no aplica decaimiento.
+    half_life_days : float, optional
+        Vida media en días para el decaimiento exponencial.
+    now : int, optional
+        Marca de tiempo de referencia. Por defecto, el instante actual.
 
-    for i in range(len(ratingsArray)):
-        adjusted_value = ratingsArray[i] * (timestampArray[i] / actualTimestamp)
-        ratingsArray[i] = adjusted_value
\ No newline at end of file
+    Returns
+    -------
+    ndarray
+        Un arreglo float64 con el peso de cada calificación.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if now is None:
+        now = int(time.time())
+
+    if decay is None:
+        return np.ones_like(timestamps)
+    if decay == 'linear':
+        return timestamps / now
+    if decay == 'exponential':
+        if half_life_days <= 0:
+            raise ValueError("half_life_days must be positive")
+        age_days = np.maximum(now - timestamps, 0) / 86400.0
+        return np.exp2(-age_days / half_life_days)
+    raise ValueError(f"Unknown decay: {decay}")
@@ -0,0 +1,479 @@
+import argparse
+import contextlib
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+from artifact_store import read_arrays, resolve, write_arrays
+from data_reader import dataset_fingerprint, read_data, same_content
+from instrumentation import count, stage, timed
+from model_store import DEFAULT_DATASET_DIR, model_position, read_model_meta
+from neighbor_finder import top_k_indices
+from rating_log import LogRotated, read_log
+from recommender import Recommender, recommendation_frame
+from recommender_model import RecommenderModel
+
+FACTOR_MODEL_VERSION = 1
+DEFAULT_FACTOR_MODEL_DIR = os.path.join('dataset', 'factor_model')
+DEFAULT_FACTOR_PARAMS = {'factors': 32, 'reg': 0.1, 'iterations': 10}
+
+_loaded_factor_models = {}  # Modelos de factores ya cargados en este proceso, por carpeta
+
+
+class FactorModel:
+    """
+    Modelo de factores latentes entrenado con mínimos cuadrados alternados (ALS).
+
+    La calificación predicha de un usuario ``u`` para una película ``i`` es
+    ``global_mean + user_factors[u] @ item_factors[i]``. Cada paso de ALS fija los factores de un
+    lado y resuelve, para cada usuario (o película), un problema de mínimos cuadrados regularizado
+    de ``factors`` x ``factors``; los sistemas se arman y resuelven por bloques con operaciones
+    vectorizadas de NumPy (``einsum`` y ``linalg.solve`` sobre lotes), que usan BLAS/LAPACK.
+
+    Attributes
+    ----------
+    user_ids, movie_ids : ndarray of int
+        IDs ordenados; la posición es la fila de ``user_factors`` / ``item_factors``.
+    user_factors, item_factors : ndarray of float64
+        Los factores latentes.
+    global_mean : float
+        Promedio de todas las calificaciones de entrenamiento.
+    params : dict
+        ``factors``, ``reg`` e ``iterations``.
+    """
+
+    def __init__(self, user_ids, movie_ids, user_factors, item_factors, global_mean, params=None):
+        self.user_ids = np.asarray(user_ids)
+        self.movie_ids = np.asarray(movie_ids)
+        # Puede tener filas de más al final, donde ``fold_in`` agrega usuarios (ver ``user_factors``)
+        self._user_factors = np.asarray(user_factors, dtype=np.float64)
+        self._n_user_rows = len(self._user_factors)
+        self.item_factors = np.asarray(item_factors, dtype=np.float64)
+        self.global_mean = float(global_mean)
+        self.params = {**DEFAULT_FACTOR_PARAMS, **(params or {})}
+        self._extra_users = {}  # userId -> fila, para usuarios agregados con ``fold_in``
+
+    @classmethod
+    def train(cls, ratings, factors=32, reg=0.1, iterations=10, seed=0, warm_start=None, threads=None,
+              block_entries=2048):
+        """
+        Entrena el modelo con ALS sobre las calificaciones dispersas.
+
+        Parameters
+        ----------
+        ratings : RatingMatrix
+            Las calificaciones de los usuarios.
+        factors : int, optional
+            Cantidad de factores latentes.
+        reg : float, optional
+            Regularización, escalada por la cantidad de calificaciones de cada usuario o película.
+        iterations : int, optional
+            Pasos de ALS (cada paso actualiza usuarios y películas).
+        seed : int, optional
+            Semilla de la inicialización aleatoria.
+        warm_start : FactorModel, optional
+            Un modelo anterior cuyos factores se usan como punto de partida para los IDs que ya
+            conocía, de modo que bastan pocas iteraciones para incorporar calificaciones nuevas.
+        threads : int, optional
+            Hilos de BLAS durante el entrenamiento (requiere ``threadpoolctl``; si no está
+            instalado se usa la configuración de BLAS del proceso).
+        block_entries : int, optional
+            Calificaciones por bloque al armar los sistemas, para acotar la memoria.
+
+        Returns
+        -------
+        FactorModel
+            El modelo entrenado.
+        """
+        matrix = ratings.compacted()
+        csr = matrix.csr
+        csc = csr.tocsc()
+        csc.sort_indices()
+        global_mean = float(csr.data.mean()) if csr.nnz else 0.0
+
+        rng = np.random.default_rng(seed)
+        user_factors = rng.normal(0, 0.1, (csr.shape[0], factors))
+        item_factors = rng.normal(0, 0.1, (csr.shape[1], factors))
+        if warm_start is not None and warm_start.user_factors.shape[1] == factors:
+            _copy_known(user_factors, matrix.user_ids, warm_start.user_ids, warm_start.user_factors)
+            _copy_known(item_factors, matrix.movie_ids, warm_start.movie_ids, warm_start.item_factors)
+
+        user_residuals = csr.data.astype(np.float64) - global_mean
+        item_residuals = csc.data.astype(np.float64) - global_mean
+        with _blas_threads(threads):
+            for _ in range(iterations):
+                user_factors = _solve_rows(csr.indptr, csr.indices, user_residuals, item_factors, reg,
+                                           block_entries)
+                item_factors = _solve_rows(csc.indptr, csc.indices, item_residuals, user_factors, reg,
+                                           block_entries)
+
+        return cls(matrix.user_ids, matrix.movie_ids, user_factors, item_factors, global_mean,
+                   {'factors': factors, 'reg': reg, 'iterations': iterations})
+
+    @property
+    def user_factors(self):
+        """Los factores de los usuarios: los de ``user_ids`` y después los agregados con ``fold_in``."""
+        return self._user_factors[:self._n_user_rows]
+
+    def __contains__(self, user_id):
+        return self._user_row(user_id) >= 0
+
+    def fold_in(self, user_id, movie_ids, ratings):
+        """
+        Calcula (o recalcula) los factores de un usuario sin reentrenar el modelo.
+
+        Resuelve el mismo problema regularizado que un paso de ALS, solo para este usuario y con los
+        factores de las películas fijos: O(calificaciones x factores² + factores³).
+
+        Parameters
+        ----------
+        user_id : int
+            El ID del usuario; si es nuevo se agrega al modelo.
+        movie_ids : array_like of int
+            Las películas que calificó.
+        ratings : array_like of float
+            Sus calificaciones.
+
+        Returns
+        -------
+        bool
+            False si ninguna de las películas está en el modelo: los factores del usuario no cambian
+            (y un usuario nuevo no se agrega).
+        """
+        movie_ids = np.asarray(movie_ids, dtype=self.movie_ids.dtype)
+        pos = np.searchsorted(self.movie_ids, movie_ids)
+        pos = np.minimum(pos, len(self.movie_ids) - 1)
+        known = self.movie_ids[pos] == movie_ids if len(self.movie_ids) else np.zeros(len(movie_ids), dtype=bool)
+        if not known.any():
+            return False
+        residuals = np.asarray(ratings, dtype=np.float64)[known] - self.global_mean
+        item_factors = self.item_factors[pos[known]]
+
+        factors = self.item_factors.shape[1]
+        gram = item_factors.T @ item_factors + self.params['reg'] * max(len(residuals), 1) * np.eye(factors)
+        vector = np.linalg.solve(gram, item_factors.T @ residuals)
+
+        row = self._user_row(user_id)
+        if row < 0:
+            row = self._n_user_rows
+            if row >= len(self._user_factors):
+                # Crece al doble para que agregar usuarios de a uno no copie la matriz cada vez
+                self._user_factors = np.resize(self._user_factors, (max(2 * row, 16), factors))
+            self._n_user_rows += 1
+            self._extra_users[user_id] = row
+        self._user_factors[row] = vector
+        return True
+
+    def predict(self, user_id):
+        """
+        Predice la calificación de un usuario para todas las películas: un solo ``U[u] @ V.T``.
+
+        Returns
+        -------
+        ndarray of float64
+            La calificación predicha para cada película de ``movie_ids``.
+
+        Raises
+        ------
+        KeyError
+            Si el usuario no está en el modelo (ver ``fold_in``).
+        """
+        row = self._user_row(user_id)
+        if row < 0:
+            raise KeyError(user_id)
+        return self.global_mean + self.item_factors @ self.user_factors[row]
+
+    def to_arrays(self):
+        """Devuelve los arreglos que definen el modelo, para guardarlo en disco."""
+        return {
+            'user_ids': self.user_ids,
+            'movie_ids': self.movie_ids,
+            'user_factors': self.user_factors[:len(self.user_ids)],
+            'item_factors': self.item_factors,
+            'global_mean': np.array([self.global_mean]),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, params=None):
+        """Reconstruye el modelo a partir de ``to_arrays``."""
+        return cls(arrays['user_ids'], arrays['movie_ids'], arrays['user_factors'], arrays['item_factors'],
+                   arrays['global_mean'][0], params)
+
+    def _user_row(self, user_id):
+        pos = np.searchsorted(self.user_ids, user_id)
+        if pos < len(self.user_ids) and self.user_ids[pos] == user_id:
+            return int(pos)
+        return self._extra_users.get(user_id, -1)
+
+
+def _solve_rows(indptr, indices, residuals, fixed, reg, block_entries):
+    """Un paso de ALS: resuelve los factores de todas las filas con los de las columnas fijos."""
+    n_rows, factors = len(indptr) - 1, fixed.shape[1]
+    counts = np.diff(indptr)
+    result = np.zeros((n_rows, factors))
+    rows = np.flatnonzero(counts)  # Las filas sin calificaciones quedan en cero
+    start = 0
+    while start < len(rows):
+        # Se agrupan filas hasta juntar ``block_entries`` calificaciones (al menos una fila por bloque).
+        limit = indptr[rows[start]] + block_entries
+        end = max(int(np.searchsorted(indptr[rows + 1], limit, side='right')), start + 1)
+        block = rows[start:end]
+        lo, hi = indptr[block[0]], indptr[block[-1] + 1]
+        vectors = fixed[indices[lo:hi]]
+
+        # Las calificaciones de cada fila son contiguas: las sumas por fila son un producto con una
+        # matriz dispersa de pertenencia (filas del bloque x calificaciones del bloque).
+        owner = sp.csr_matrix((np.ones(hi - lo), np.arange(hi - lo), np.append(indptr[block] - lo, hi - lo)),
+                              shape=(len(block), hi - lo))
+        outer = (vectors[:, :, None] * vectors[:, None, :]).reshape(hi - lo, factors * factors)
+        grams = (owner @ outer).reshape(len(block), factors, factors)
+        rhs = owner @ (vectors * residuals[lo:hi, None])
+        grams += reg * counts[block][:, None, None] * np.eye(factors)
+        result[block] = np.linalg.solve(grams, rhs[:, :, None])[:, :, 0]
+        start = end
+    return result
+
+
+def _copy_known(target, ids, known_ids, known_factors):
+    pos = np.searchsorted(known_ids, ids)
+    pos = np.minimum(pos, max(len(known_ids) - 1, 0))
+    if len(known_ids) == 0:
+        return
+    found = known_ids[pos] == ids
+    target[found] = known_factors[pos[found]]
+
+
+def _blas_threads(threads):
+    if threads is None:
+        return contextlib.nullcontext()
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return contextlib.nullcontext()
+    return threadpool_limits(limits=threads, user_api='blas')
+
+
+def save_factor_model(factor_model, factor_model_dir=DEFAULT_FACTOR_MODEL_DIR, fingerprint=None, log_offset=None,
+                      log_generation=None):
+    """
+    Guarda el modelo de factores como un artefacto versionado (ver ``model_store``).
+
+    ``log_offset`` y ``log_generation`` indican hasta dónde del diario llegan las calificaciones con
+    las que se entrenó; si no se conocen, al cargarlo se recorre el diario completo.
+    """
+    arrays = factor_model.to_arrays()
+    meta = {'version': FACTOR_MODEL_VERSION, 'fingerprint': fingerprint, 'params': factor_model.params,
+            'log_offset': log_offset, 'log_generation': log_generation, 'arrays': sorted(arrays)}
+    write_arrays(factor_model_dir, arrays, meta)
+
+
+def load_factor_model(factor_model_dir=DEFAULT_FACTOR_MODEL_DIR):
+    """Carga un artefacto guardado con ``save_factor_model``, o devuelve None si no hay uno válido."""
+    directory = resolve(factor_model_dir)
+    meta = read_model_meta(directory)
+    if meta is None or meta.get('version') != FACTOR_MODEL_VERSION:
+        return None, None
+    arrays = read_arrays(directory, meta['arrays'], mmap=False)
+    return FactorModel.from_arrays(arrays, meta['params']), meta
+
+
+@timed('load_factor_model')
+def load_or_train_factor_model(ratings, factor_model_dir=DEFAULT_FACTOR_MODEL_DIR, dataset_dir=DEFAULT_DATASET_DIR,
+                               position=None, **params):
+    """
+    Devuelve el modelo de factores, cargándolo del artefacto si sigue siendo válido.
+
+    Si los CSV del dataset cambiaron, el modelo se reentrena partiendo del anterior (warm start) y se
+    vuelve a guardar. Las calificaciones nuevas del diario no lo invalidan: igual que
+    ``model_store.sync_loaded_model`` con el modelo de vecinos, cada vez que se pide el modelo se leen
+    las calificaciones del diario que todavía no incluye (de esta sesión, de otras o de otros
+    procesos) y sus usuarios se actualizan con ``FactorModel.fold_in``.
+
+    Parameters
+    ----------
+    ratings : RatingMatrix
+        Las calificaciones con las que se entrena el modelo si hace falta.
+    factor_model_dir : str, optional
+        Carpeta del artefacto. Si es None, el modelo se entrena sin guardarse.
+    dataset_dir : str, optional
+        Carpeta del dataset que invalida el artefacto.
+    position : dict, optional
+        Hasta dónde del diario llega ``ratings`` (``model_store.model_position``); se guarda con el
+        modelo si se entrena.
+    **params
+        ``factors``, ``reg`` e ``iterations``.
+
+    Returns
+    -------
+    FactorModel
+        El modelo de factores.
+    """
+    params = {**DEFAULT_FACTOR_PARAMS, **params}
+    if factor_model_dir is None:
+        return FactorModel.train(ratings, **params)
+
+    cached = _loaded_factor_models.get(factor_model_dir)
+    fingerprint = dataset_fingerprint(dataset_dir, previous=cached['fingerprint'] if cached else None)
+    if cached and same_content(cached['fingerprint'], fingerprint) and cached['params'] == params:
+        _fold_in_log(cached, ratings, dataset_dir)
+        return cached['factor_model']
+
+    factor_model, meta = load_factor_model(factor_model_dir)
+    if factor_model is None or not same_content(meta.get('fingerprint'), fingerprint) or meta['params'] != params:
+        warm_start = factor_model if factor_model is not None and meta['params'] == params else None
+        factor_model = FactorModel.train(ratings, warm_start=warm_start, **params)
+        log_offset, log_generation = (position['log_offset'], position['log_generation']) if position else (None, None)
+        save_factor_model(factor_model, factor_model_dir, fingerprint, log_offset, log_generation)
+    else:
+        log_offset, log_generation = meta.get('log_offset'), meta.get('log_generation')
+
+    cached = {'fingerprint': fingerprint, 'params': params, 'factor_model': factor_model,
+              'log_offset': log_offset, 'log_generation': log_generation}
+    _loaded_factor_models[factor_model_dir] = cached
+    _fold_in_log(cached, ratings, dataset_dir)
+    return factor_model
+
+
+def _fold_in_log(cached, ratings, dataset_dir):
+    # Recalcula los factores de los usuarios con calificaciones en el diario desde la última lectura,
+    # a partir de todas sus calificaciones actuales en ``ratings``.
+    try:
+        entries, end, generation = read_log(dataset_dir, cached['log_offset'] or 0, cached['log_generation'])
+    except LogRotated:
+        # Con la misma huella del dataset, la compactación no agregó calificaciones que falten
+        entries, end, generation = read_log(dataset_dir)
+    factor_model = cached['factor_model']
+    for user_id in np.unique(entries['userId'].to_numpy()).tolist():
+        if user_id in ratings:
+            cols, values = ratings.user_row(user_id)
+            factor_model.fold_in(user_id, ratings.movie_ids[cols], values)
+    cached['log_offset'], cached['log_generation'] = end, generation
+
+
+def fold_in_user(user_id, user_ratings, factor_model_dir=DEFAULT_FACTOR_MODEL_DIR):
+    """
+    Actualiza los factores de un usuario en el modelo ya cargado en este proceso, si lo hay.
+
+    Parameters
+    ----------
+    user_id : int
+        El ID del usuario.
+    user_ratings : dict
+        movieId -> calificación, todas las calificaciones actuales del usuario.
+    """
+    cached = _loaded_factor_models.get(factor_model_dir)
+    if cached is not None and user_ratings:
+        cached['factor_model'].fold_in(user_id, list(user_ratings), list(user_ratings.values()))
+
+
+class FactorRecommender(Recommender):
+    """
+    Recomendador basado en factores latentes (ver ``FactorModel``).
+
+    Tiene la misma interfaz que ``Recommender``; calcular las predicciones de un usuario es un solo
+    producto matriz-vector, sin buscar vecinos.
+
+    Attributes
+    ----------
+    factor_model_dir : str or None
+        Carpeta del artefacto del modelo de factores.
+    factor_params : dict
+        ``factors``, ``reg`` e ``iterations``.
+    """
+
+    def __init__(self, user_id, model_dir=None, factor_model_dir=DEFAULT_FACTOR_MODEL_DIR,
+                 dataset_dir=DEFAULT_DATASET_DIR, **factor_params):
+        """
+        Parameters
+        ----------
+        user_id : int
+            El ID del usuario para el cual se generarán recomendaciones.
+        model_dir : str, optional
+            Carpeta del artefacto del modelo (ver ``Recommender``).
+        factor_model_dir : str, optional
+            Carpeta del artefacto del modelo de factores.
+        dataset_dir : str, optional
+            Carpeta del dataset que invalida el artefacto.
+        **factor_params
+            ``factors``, ``reg`` e ``iterations``.
+        """
+        super().__init__(user_id, model_dir, dataset_dir)
+        self.factor_model_dir = factor_model_dir
+        self.factor_params = factor_params
+
+    def recommend_movies(self, md_genres, rates, md, top_n=None):
+        """
+        Genera una lista de películas recomendadas para el usuario objetivo.
+
+        Parameters
+        ----------
+        top_n : int, optional
+            Si se indica, solo se devuelven las ``top_n`` mejores recomendaciones.
+
+        Returns
+        -------
+        DataFrame
+            Un DataFrame que contiene las películas recomendadas, con el mismo formato que ``Recommender``.
+        """
+        model = self.load_model(md_genres, rates, md)
+        position = model_position(self.model_dir) if self.model_dir is not None else None
+        factor_model = load_or_train_factor_model(model.ratings, self.factor_model_dir, self.dataset_dir,
+                                                  position, **self.factor_params)
+
+        rated_cols, rated_values = model.ratings.user_row(self.user_id)
+        rated_ids = model.ratings.movie_ids[rated_cols]
+        if self.user_id not in factor_model and not factor_model.fold_in(self.user_id, rated_ids, rated_values):
+            # Ninguna de sus películas está en el modelo de factores: no hay con qué recomendar
+            return recommendation_frame(md, [])
+
+        with stage('predict_ratings'):
+            predictions = np.round(factor_model.predict(self.user_id), 2)
+        candidates = (predictions > 3) & ~np.isin(factor_model.movie_ids, rated_ids)
+        cols = np.flatnonzero(candidates)
+        count('candidates_scored', len(cols))
+
+        scores = predictions[cols]
+        if top_n is None:
+            order = np.argsort(-scores, kind='stable')
+        else:
+            order = top_k_indices(scores[None, :], top_n)[0]
+        return recommendation_frame(md, factor_model.movie_ids[cols[order]])
+
+
+def main():
+    """
+    Punto de entrada de línea de comandos para entrenar el modelo de factores.
+
+    Ejemplo: ``python mf_recommender.py --factors 64 --iterations 15 --warm-start``
+    """
+    parser = argparse.ArgumentParser(description="Entrena el modelo de factores latentes (ALS).")
+    parser.add_argument('--factors', type=int, default=DEFAULT_FACTOR_PARAMS['factors'])
+    parser.add_argument('--reg', type=float, default=DEFAULT_FACTOR_PARAMS['reg'])
+    parser.add_argument('--iterations', type=int, default=DEFAULT_FACTOR_PARAMS['iterations'])
+    parser.add_argument('--warm-start', action='store_true', help="Parte del modelo guardado en lugar de uno aleatorio.")
+    parser.add_argument('--threads', type=int, default=None, help="Hilos de BLAS (requiere threadpoolctl).")
+    parser.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR)
+    parser.add_argument('--factor-model-dir', default=DEFAULT_FACTOR_MODEL_DIR)
+    args = parser.parse_args()
+
+    md_genres, ratings, md = read_data(args.dataset_dir, compact=True)
+    model = RecommenderModel.build(md_genres, ratings, md)
+    warm_start = load_factor_model(args.factor_model_dir)[0] if args.warm_start else None
+    factor_model = FactorModel.train(model.ratings, factors=args.factors, reg=args.reg, iterations=args.iterations,
+                                     warm_start=warm_start, threads=args.threads)
+    # Hasta dónde del diario llegan las calificaciones leídas, para que al cargarlo solo se apliquen las posteriores
+    save_factor_model(factor_model, args.factor_model_dir, dataset_fingerprint(args.dataset_dir),
+                      ratings.attrs.get('log_offset'), ratings.attrs.get('log_generation'))
+
+    matrix = model.ratings.compacted()
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.csr.indptr))
+    predicted = factor_model.global_mean + np.einsum(
+        'ij,ij->i', factor_model.user_factors[rows], factor_model.item_factors[matrix.csr.indices])
+    rmse = np.sqrt(np.mean((predicted - matrix.csr.data) ** 2))
+    print(f"Factor model written to {args.factor_model_dir}: {len(factor_model.user_ids)} users, "
+          f"{len(factor_model.movie_ids)} movies, train RMSE {rmse:.4f}")
+
+
+if __name__ == "__main__":
+    main()
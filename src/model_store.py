@@ -0,0 +1,293 @@
+import argparse
+import os
+
+from artifact_store import read_arrays, read_meta, resolve, write_arrays
+from data_reader import dataset_fingerprint, read_data, same_content
+from rating_log import LogRotated, read_log
+from recommender_model import RecommenderModel, model_params
+
+MODEL_VERSION = 2
+DEFAULT_DATASET_DIR = 'dataset'
+DEFAULT_MODEL_DIR = os.path.join('dataset', 'model')
+
+_loaded_models = {}  # Modelos ya cargados en este proceso, por carpeta
+
+
+def save_model(model, model_dir=DEFAULT_MODEL_DIR, fingerprint=None, log_offset=0, log_generation=None):
+    """
+    Guarda el modelo como un artefacto versionado en disco.
+
+    Cada arreglo (matriz híbrida, matriz de calificaciones, medias, mapas de IDs, ...) se escribe
+    como un ``.npy`` independiente para poder cargarlo con ``mmap``, y ``meta.json`` guarda la
+    versión del formato, la huella del dataset y los parámetros usados. El artefacto se publica
+    completo de una vez (ver ``artifact_store.write_arrays``).
+
+    Parameters
+    ----------
+    model : RecommenderModel
+        El modelo a guardar.
+    model_dir : str, optional
+        Carpeta donde se guarda el artefacto.
+    fingerprint : dict, optional
+        Huella del dataset a partir del cual se construyó el modelo.
+    log_offset : int, optional
+        Posición del diario de calificaciones hasta la cual el modelo ya lo incluye.
+    log_generation : str, optional
+        Generación del diario a la que pertenece ``log_offset`` (ver ``rating_log.read_log``).
+    """
+    arrays = model.to_arrays()
+    meta = {
+        'version': MODEL_VERSION,
+        'fingerprint': fingerprint,
+        'log_offset': log_offset,
+        'log_generation': log_generation,
+        'arrays': sorted(arrays),
+        **model.to_meta(),
+    }
+
+    write_arrays(model_dir, arrays, meta)
+
+
+def read_model_meta(model_dir=DEFAULT_MODEL_DIR):
+    """Devuelve el contenido de ``meta.json`` del artefacto, o None si no existe o no se puede leer."""
+    return read_meta(model_dir)
+
+
+def load_model(model_dir=DEFAULT_MODEL_DIR, mmap=True):
+    """
+    Carga un artefacto guardado con ``save_model``.
+
+    Parameters
+    ----------
+    model_dir : str, optional
+        Carpeta del artefacto.
+    mmap : bool, optional
+        Si es True, los arreglos se mapean en memoria (copy-on-write) en lugar de leerse completos.
+        Las actualizaciones incrementales del modelo nunca modifican los archivos.
+
+    Returns
+    -------
+    model : RecommenderModel
+        El modelo cargado.
+    meta : dict
+        Los metadatos del artefacto.
+
+    Raises
+    ------
+    ValueError
+        Si el artefacto no existe o fue escrito con otra versión del formato.
+    """
+    directory = resolve(model_dir)
+    meta = read_model_meta(directory)
+    if meta is None or meta.get('version') != MODEL_VERSION:
+        raise ValueError(f"No valid model artifact in {model_dir}")
+
+    arrays = read_arrays(directory, meta['arrays'], mmap)
+    return RecommenderModel.from_arrays(arrays, meta), meta
+
+
+def is_model_fresh(meta, fingerprint, params=None):
+    """Indica si un artefacto corresponde al dataset y a los parámetros dados."""
+    return (meta is not None
+            and meta.get('version') == MODEL_VERSION
+            and meta.get('fingerprint') is not None
+            and same_content(meta['fingerprint'], fingerprint)
+            and meta.get('params') == model_params(**(params or {})))
+
+
+def load_or_build_model(md_genres, ratings, md, model_dir=DEFAULT_MODEL_DIR, dataset_dir=DEFAULT_DATASET_DIR,
+                        **params):
+    """
+    Devuelve el modelo del dataset, cargándolo del artefacto si sigue siendo válido.
+
+    Si el artefacto no existe, es de otra versión o los CSV de ``dataset_dir`` cambiaron, el modelo
+    se reconstruye a partir de los DataFrames recibidos (que deben ser los leídos de
+    ``dataset_dir``) y se vuelve a guardar. Dentro de un mismo proceso el modelo cargado se
+    reutiliza mientras los CSV no cambien. En todos los casos, antes de devolverlo se le aplican
+    de forma incremental las calificaciones del diario (``rating_log``) que todavía no incluye.
+
+    Si desde que se cargó el modelo los CSV cambiaron o el diario se compactó (``rating_log.compact``),
+    los DataFrames recibidos pueden ser de antes del cambio, así que el dataset se vuelve a leer.
+
+    Parameters
+    ----------
+    md_genres, ratings, md : DataFrame
+        Los DataFrames devueltos por ``read_data(dataset_dir)``.
+    model_dir : str, optional
+        Carpeta del artefacto.
+    dataset_dir : str, optional
+        Carpeta del dataset que invalida el artefacto.
+    **params
+        Parámetros de construcción (``decay``, ``half_life_days``).
+
+    Returns
+    -------
+    RecommenderModel
+        El modelo del dataset.
+    """
+    params = model_params(**params)
+    cached = _loaded_models.get(model_dir)
+    fingerprint = dataset_fingerprint(dataset_dir, previous=cached['fingerprint'] if cached else None)
+    if cached and same_content(cached['fingerprint'], fingerprint) and cached['model'].params == params:
+        cached['fingerprint'] = fingerprint
+        try:
+            return _replay_log(cached, dataset_dir)
+        except LogRotated:
+            pass
+    if cached is not None:
+        md_genres, ratings, md = read_data(dataset_dir, compact=True)
+        fingerprint = dataset_fingerprint(dataset_dir)
+
+    meta = read_model_meta(model_dir)
+    if is_model_fresh(meta, fingerprint, params):
+        model, meta = load_model(model_dir)
+        cached = {'fingerprint': fingerprint, 'model': model, 'log_offset': meta.get('log_offset', 0),
+                  'log_generation': meta.get('log_generation')}
+        try:
+            _loaded_models[model_dir] = cached
+            return _replay_log(cached, dataset_dir)
+        except LogRotated:
+            pass  # El artefacto es de un diario anterior: se reconstruye con el dataset leído
+
+    model = RecommenderModel.build(md_genres, ratings, md, **params)
+    log_offset = ratings.attrs.get('log_offset', 0)
+    log_generation = ratings.attrs.get('log_generation')
+    save_model(model, model_dir, fingerprint, log_offset, log_generation)
+
+    cached = {'fingerprint': fingerprint, 'model': model, 'log_offset': log_offset, 'log_generation': log_generation}
+    _loaded_models[model_dir] = cached
+    return _replay_log(cached, dataset_dir)
+
+
+def _replay_log(cached, dataset_dir):
+    # Volver a aplicar una calificación que el modelo ya tiene no cambia nada, así que releer
+    # parte del diario (por ejemplo, desde 0 si no se conoce la posición) es seguro. Si el diario se
+    # compactó, ``read_log`` lanza ``LogRotated``: lo que falta ya está en ``ratings.csv``.
+    entries, end, generation = read_log(dataset_dir, cached['log_offset'], cached.get('log_generation'))
+    model = cached['model']
+    for user_id, movie_id, rating, timestamp in entries.itertuples(index=False):
+        model.update_rating(user_id, movie_id, rating, timestamp)
+    cached['log_offset'] = end
+    cached['log_generation'] = generation
+    return model
+
+
+def model_position(model_dir=DEFAULT_MODEL_DIR):
+    """
+    Devuelve qué datos incluye el modelo cargado en este proceso.
+
+    Returns
+    -------
+    dict or None
+        ``fingerprint``, ``log_offset``, ``log_generation`` y ``params``, o None si todavía no se
+        cargó ningún modelo.
+    """
+    cached = _loaded_models.get(model_dir)
+    if cached is None:
+        return None
+    return {'fingerprint': cached['fingerprint'], 'log_offset': cached['log_offset'],
+            'log_generation': cached['log_generation'], 'params': cached['model'].params}
+
+
+def extends_position(position, later):
+    """
+    Indica si ``later`` es el modelo de ``position`` con, a lo sumo, más calificaciones del diario.
+
+    Ambos resultados de ``model_position`` deben ser de los mismos CSV, la misma generación del
+    diario (o ``position`` de antes de que existiera el diario) y los mismos parámetros, y ``later``
+    debe haber leído el diario al menos hasta donde llegaba ``position``.
+    """
+    if position is None or later is None:
+        return False
+    before_log = not position.get('log_generation') and position.get('log_offset') == 0
+    return (same_content(position.get('fingerprint'), later.get('fingerprint'))
+            and (before_log or position.get('log_generation') == later.get('log_generation'))
+            and position.get('params') == later.get('params')
+            and position.get('log_offset') is not None and later.get('log_offset') is not None
+            and later['log_offset'] >= position['log_offset'])
+
+
+def sync_loaded_model(model_dir=DEFAULT_MODEL_DIR, dataset_dir=DEFAULT_DATASET_DIR):
+    """
+    Aplica al modelo ya cargado en este proceso las calificaciones nuevas del diario.
+
+    Solo se leen los bytes agregados al diario desde la última sincronización y cada calificación
+    se aplica con ``RecommenderModel.update_rating``, sin reconstruir el modelo. Si el diario se
+    compactó desde la última sincronización, el modelo se vuelve a cargar (ver ``load_or_build_model``).
+
+    Returns
+    -------
+    RecommenderModel or None
+        El modelo actualizado, o None si todavía no se había cargado ninguno.
+    """
+    cached = _loaded_models.get(model_dir)
+    if cached is None:
+        return None
+    try:
+        return _replay_log(cached, dataset_dir)
+    except LogRotated:
+        return load_or_build_model(None, None, None, model_dir, dataset_dir, **cached['model'].params)
+
+
+def checkpoint_model(model_dir=DEFAULT_MODEL_DIR, dataset_dir=DEFAULT_DATASET_DIR):
+    """
+    Vuelve a guardar el modelo cargado si incluye calificaciones del diario que el artefacto no tiene.
+
+    Sirve para que otros procesos que cargan el artefacto (por ejemplo, los de ``batch_recommender``)
+    vean el mismo modelo que este proceso.
+
+    Returns
+    -------
+    bool
+        True si el artefacto se reescribió.
+    """
+    cached = _loaded_models.get(model_dir)
+    if cached is None:
+        return False
+    sync_loaded_model(model_dir, dataset_dir)
+    cached = _loaded_models[model_dir]
+    meta = read_model_meta(model_dir)
+    if (is_model_fresh(meta, cached['fingerprint'], cached['model'].params)
+            and meta.get('log_offset') == cached['log_offset']
+            and meta.get('log_generation') == cached['log_generation']):
+        return False
+    save_model(cached['model'], model_dir, cached['fingerprint'], cached['log_offset'], cached['log_generation'])
+    return True
+
+
+def main():
+    """
+    Punto de entrada de línea de comandos para construir el artefacto del modelo.
+
+    Ejemplo: ``python model_store.py build --decay exponential --half-life-days 180``
+    """
+    parser = argparse.ArgumentParser(description="Construye el artefacto precalculado del recomendador.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Construye y guarda el modelo a partir del dataset.")
+    build.add_argument('--decay', choices=['linear', 'exponential', 'none'], default='linear')
+    build.add_argument('--half-life-days', type=float, default=None)
+    check = subparsers.add_parser('check', help="Indica si el artefacto guardado sigue siendo válido.")
+    for subparser in (build, check):
+        subparser.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR)
+        subparser.add_argument('--model-dir', default=DEFAULT_MODEL_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        params = {'decay': None if args.decay == 'none' else args.decay}
+        if args.half_life_days is not None:
+            params['half_life_days'] = args.half_life_days
+        md_genres, ratings, md = read_data(args.dataset_dir)
+        model = RecommenderModel.build(md_genres, ratings, md, **params)
+        save_model(model, args.model_dir, dataset_fingerprint(args.dataset_dir), ratings.attrs['log_offset'],
+                   ratings.attrs['log_generation'])
+        print(f"Model written to {args.model_dir}: {model.finder.n} users, "
+              f"{model.ratings.shape[1]} movies, {model.ratings.csr.nnz} ratings")
+    else:
+        meta = read_model_meta(args.model_dir)
+        fresh = meta is not None and is_model_fresh(meta, dataset_fingerprint(args.dataset_dir), meta.get('params'))
+        print("fresh" if fresh else "stale")
+
+
+if __name__ == "__main__":
+    main()
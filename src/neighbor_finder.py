@@ -1,5 +1,307 @@
+import weakref
+
 import numpy as np
 
+from instrumentation import count, timed
+from neighbor_index import make_index
+
+
+class NeighborFinder:
+    """
+    Motor de búsqueda de vecinos por similitud coseno sobre la matriz híbrida.
+
+    Convierte la matriz híbrida a un arreglo denso y precalcula las normas de todos los usuarios
+    una sola vez. Cada consulta calcula las similitudes de un usuario (o de un lote de usuarios)
+    contra todos los demás con un único producto matriz-vector (o matriz-matriz) y selecciona los
+    k mejores con ``argpartition``.
+
+    Con un índice aproximado (``'lsh'`` o ``'ivf'``, ver ``neighbor_index``) cada consulta solo se
+    compara contra los candidatos que devuelve el índice; la similitud de los candidatos se calcula
+    igual que en la búsqueda exacta.
+
+    Attributes
+    ----------
+    user_ids : ndarray
+        IDs de usuario en el orden de las filas de la matriz híbrida.
+    values : ndarray of float64
+        La matriz híbrida como arreglo denso.
+    norms : ndarray of float64
+        La norma de cada fila de ``values``.
+    index : object
+        El índice de vecinos (``ExactIndex``, ``LSHIndex`` o ``IVFIndex``).
+    """
+
+    def __init__(self, hybrid_matrix, index=None, **index_params):
+        """
+        Parameters
+        ----------
+        hybrid_matrix : DataFrame
+            Un DataFrame que representa las preferencias de los usuarios por diferentes géneros.
+        index : str or object, optional
+            ``'exact'`` (por defecto), ``'lsh'``, ``'ivf'`` o un índice ya creado.
+        **index_params
+            Parámetros del índice, por ejemplo ``n_probe`` para ``'ivf'``.
+        """
+        # Copias propias: con copy-on-write, ``to_numpy`` devuelve vistas de solo lectura y ``update_row`` las modifica
+        self._user_ids = np.array(hybrid_matrix.index)
+        self._values = np.array(hybrid_matrix.to_numpy(dtype=np.float64))
+        self._norms = np.sqrt(np.einsum('ij,ij->i', self._values, self._values))
+        self._positions = {user_id: pos for pos, user_id in enumerate(self._user_ids.tolist())}
+        self.n = len(self._user_ids)
+        self.set_index(index, **index_params)
+
+    def set_index(self, index=None, **index_params):
+        """Reemplaza el índice de vecinos y lo construye sobre las filas actuales."""
+        self.index = make_index(index, **index_params)
+        self.index.fit(self.values)
+
+    @property
+    def user_ids(self):
+        return self._user_ids[:self.n]
+
+    @property
+    def values(self):
+        return self._values[:self.n]
+
+    @property
+    def norms(self):
+        return self._norms[:self.n]
+
+    @property
+    def k(self):
+        num_rows = self.n - 1
+        k = min(20, int(num_rows * 0.15))  # Ajustar '20' según sea necesario
+        if k < 1: k = 20
+        return k
+
+    def __contains__(self, user_id):
+        return user_id in self._positions
+
+    def position(self, user_id):
+        """Devuelve la fila de un usuario; lanza ValueError si no está en la matriz híbrida."""
+        if user_id not in self._positions:
+            raise ValueError("UserID not found in the hybrid matrix")
+        return self._positions[user_id]
+
+    def update_row(self, user_id, vector):
+        """
+        Reemplaza (o agrega, si el usuario es nuevo) la fila de un usuario y su norma.
+
+        Los arreglos crecen duplicando su capacidad, así que agregar un usuario es O(géneros)
+        amortizado.
+
+        Parameters
+        ----------
+        user_id : int
+            El ID del usuario.
+        vector : array_like
+            La nueva fila de la matriz híbrida.
+
+        Returns
+        -------
+        bool
+            True si la fila cambió (o es nueva), False si quedó igual.
+        """
+        vector = np.asarray(vector, dtype=np.float64)
+        pos = self._positions.get(user_id)
+        if pos is not None:
+            if np.array_equal(self._values[pos], vector):
+                return False
+        else:
+            pos = self.n
+            if pos >= len(self._values):
+                capacity = max(2 * len(self._values), 16)
+                self._values = np.resize(self._values, (capacity, self._values.shape[1]))
+                self._norms = np.resize(self._norms, capacity)
+                self._user_ids = np.resize(self._user_ids, capacity)
+            self._user_ids[pos] = user_id
+            self._positions[user_id] = pos
+            self.n += 1
+        self._values[pos] = vector
+        self._norms[pos] = np.sqrt(vector @ vector)
+        self.index.update(pos, vector)
+        return True
+
+    def find(self, user_id, k=None):
+        """
+        Encuentra los vecinos más cercanos de un usuario.
+
+        Parameters
+        ----------
+        user_id : int
+            El ID del usuario para el cual se quieren encontrar vecinos.
+        k : int, optional
+            Cantidad de vecinos. Por defecto se usa el mismo criterio que ``find_neighbors``.
+
+        Returns
+        -------
+        list of tuples
+            Una lista de tuplas (usuario, similitud) ordenada de mayor a menor similitud.
+        """
+        neighbors = self.find_batch([user_id], k)[0]
+        count('neighbors_found', len(neighbors))
+        return neighbors
+
+    @timed('find_neighbors')
+    def find_batch(self, user_ids, k=None, batch_size=1024):
+        """
+        Encuentra los vecinos más cercanos de varios usuarios a la vez.
+
+        Parameters
+        ----------
+        user_ids : iterable of int
+            Los IDs de los usuarios para los cuales se quieren encontrar vecinos.
+        k : int, optional
+            Cantidad de vecinos por usuario.
+        batch_size : int, optional
+            Cantidad de usuarios cuyas similitudes se calculan en un mismo producto de matrices.
+
+        Returns
+        -------
+        list of list of tuples
+            Para cada usuario, la lista de sus vecinos como en ``find``.
+        """
+        k = self.k if k is None else k
+        positions = np.asarray([self.position(user_id) for user_id in user_ids], dtype=np.int64)
+
+        if not self.index.exact:
+            return [self._find_candidates(pos, k) for pos in positions.tolist()]
+
+        results = []
+        for start in range(0, len(positions), batch_size):
+            block = positions[start:start + batch_size]
+            scores = self.similarities(block)
+            top_cols = top_k_indices(scores, k)
+            for row, cols in enumerate(top_cols):
+                cols = cols[np.isfinite(scores[row, cols])]
+                results.append(list(zip(self.user_ids[cols].tolist(), scores[row, cols].tolist())))
+        return results
+
+    def _find_candidates(self, pos, k):
+        candidates = self.index.candidates(self.values[pos])
+        candidates = candidates[candidates != pos]
+        query_norm = self.norms[pos]
+        norms = self.norms[candidates]
+        dots = self.values[candidates] @ self.values[pos]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = dots / (query_norm * norms)
+        scores[norms == 0] = -np.inf
+        if query_norm == 0:
+            scores[:] = -np.inf
+
+        cols = top_k_indices(scores[None, :], k)[0]
+        cols = cols[np.isfinite(scores[cols])]
+        return list(zip(self.user_ids[candidates[cols]].tolist(), scores[cols].tolist()))
+
+    def similarities(self, positions):
+        """
+        Calcula la similitud coseno de un bloque de usuarios contra todos los usuarios.
+
+        Parameters
+        ----------
+        positions : ndarray of int
+            Filas de la matriz híbrida de los usuarios consultados.
+
+        Returns
+        -------
+        ndarray of float64
+            Una matriz (len(positions), n_users). El propio usuario y los usuarios sin preferencias
+            quedan en ``-inf`` para que nunca se elijan como vecinos.
+        """
+        query_norms = self.norms[positions]
+        dots = self.values[positions] @ self.values.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = dots / (query_norms[:, None] * self.norms[None, :])
+        scores[:, self.norms == 0] = -np.inf
+        scores[query_norms == 0, :] = -np.inf
+        scores[np.arange(len(positions)), positions] = -np.inf
+        return scores
+
+
+def top_k_indices(scores, k):
+    """
+    Selecciona por fila las columnas de los k mayores puntajes, ordenadas de mayor a menor.
+
+    Los empates se resuelven a favor de la columna de menor posición, igual que un ordenamiento
+    estable, de modo que el resultado no depende de cómo ``argpartition`` reparta los empates.
+
+    Parameters
+    ----------
+    scores : ndarray
+        Una matriz de puntajes (n_rows, n_cols).
+    k : int
+        Cantidad de columnas a seleccionar por fila.
+
+    Returns
+    -------
+    ndarray of int
+        Una matriz (n_rows, min(k, n_cols)) con las columnas elegidas de cada fila.
+    """
+    n_rows, n_cols = scores.shape
+    k = min(k, n_cols)
+    if k == 0:
+        return np.empty((n_rows, 0), dtype=np.int64)
+
+    if k < n_cols:
+        kth = -np.partition(-scores, k - 1, axis=1)[:, k - 1]
+        above = scores > kth[:, None]
+        ties = scores == kth[:, None]
+        needed = k - above.sum(axis=1)
+        selected = above | (ties & (np.cumsum(ties, axis=1) <= needed[:, None]))
+        cols = np.nonzero(selected)[1].reshape(n_rows, k)
+    else:
+        cols = np.broadcast_to(np.arange(n_cols), (n_rows, n_cols))
+
+    chosen = np.take_along_axis(scores, cols, axis=1)
+    order = np.lexsort((cols, -chosen), axis=1) if n_rows else cols
+    return np.take_along_axis(cols, order, axis=1)
+
+
+# (weakref a la matriz, su NeighborFinder): se reemplazan juntos en una sola asignación, así que
+# un hilo nunca ve la matriz de un par con el buscador de otro
+_finder_cache = {'entry': None}
+_default_index = {'index': 'exact', 'params': {}}
+
+
+def set_default_index(index='exact', **params):
+    """
+    Elige el índice de vecinos que usan ``get_neighbor_finder`` y ``find_neighbors``.
+
+    Parameters
+    ----------
+    index : str, optional
+        ``'exact'``, ``'lsh'`` o ``'ivf'``.
+    **params
+        Parámetros del índice (ver ``neighbor_index``).
+    """
+    make_index(index, **params)  # Valida el nombre y los parámetros
+    _default_index['index'] = index
+    _default_index['params'] = params
+    _finder_cache['entry'] = None
+
+
+def get_neighbor_finder(hybrid_matrix):
+    """
+    Devuelve el NeighborFinder de una matriz híbrida, construyéndolo solo la primera vez.
+
+    Parameters
+    ----------
+    hybrid_matrix : DataFrame
+        Un DataFrame que representa las preferencias de los usuarios por diferentes géneros.
+
+    Returns
+    -------
+    NeighborFinder
+        El motor de búsqueda asociado a la matriz, con el índice elegido en ``set_default_index``.
+    """
+    entry = _finder_cache['entry']
+    if entry is None or entry[0]() is not hybrid_matrix:
+        entry = (weakref.ref(hybrid_matrix),
+                 NeighborFinder(hybrid_matrix, _default_index['index'], **_default_index['params']))
+        _finder_cache['entry'] = entry
+    return entry[1]
+
+
 def find_neighbors(hybrid_matrix, user_id):
     """
     Encuentra los vecinos más cercanos (usuarios similares) para el usuario objetivo.
@@ -19,24 +321,4 @@ def find_neighbors(hybrid_matrix, user_id):
     if user_id not in hybrid_matrix.index:
         raise ValueError("UserID not found in the hybrid matrix")
 
-    num_rows = hybrid_matrix.shape[0] - 1
-    k = min(20, int(num_rows * 0.15))  # Ajustar '20' según sea necesario
-    if k < 1: k = 20
-
-    similitudes = {}
-    user_vector = hybrid_matrix.loc[user_id]
-    for other_user in hybrid_matrix.index:
-        if other_user == user_id:
-            continue
-        other_user_vector = hybrid_matrix.loc[other_user]
-        if np.any(user_vector) and np.any(other_user_vector):
-            sim = np.dot(user_vector, other_user_vector)
-            norm_product = np.linalg.norm(user_vector) * np.linalg.norm(other_user_vector)
-            if norm_product > 0:
-                sim /= norm_product
-            else:
-                sim = 0
-            similitudes[other_user] = sim
-
-    sorted_neighbors = sorted(similitudes.items(), key=lambda x: x[1], reverse=True)
-    return sorted_neighbors[:k]
+    return get_neighbor_finder(hybrid_matrix).find(user_id)
@@ -0,0 +1,355 @@
+import argparse
+import time
+
+import numpy as np
+
+
+class ExactIndex:
+    """
+    Índice exacto: todos los usuarios son candidatos. ``NeighborFinder`` compara la consulta contra
+    la matriz completa con un único producto de matrices.
+    """
+
+    name = 'exact'
+    exact = True
+
+    def fit(self, values):
+        """Prepara el índice para las filas de ``values``."""
+
+    def update(self, pos, vector):
+        """Registra que la fila ``pos`` es nueva o cambió."""
+
+    def candidates(self, vector):
+        """Devuelve las filas candidatas para una consulta, o None si son todas."""
+        return None
+
+
+class LSHIndex:
+    """
+    Índice aproximado por hashing sensible a la localidad con hiperplanos aleatorios (coseno).
+
+    Cada tabla asigna a cada usuario un código de ``n_bits`` bits: el signo de su proyección sobre
+    ``n_bits`` hiperplanos aleatorios. Los candidatos de una consulta son los usuarios que comparten
+    el código en alguna de las ``n_tables`` tablas. Más tablas aumentan el recall; más bits reducen
+    la cantidad de candidatos (y la latencia).
+    """
+
+    name = 'lsh'
+    exact = False
+
+    def __init__(self, n_tables=8, n_bits=10, seed=0):
+        """
+        Parameters
+        ----------
+        n_tables : int, optional
+            Cantidad de tablas de hash.
+        n_bits : int, optional
+            Bits (hiperplanos) por tabla.
+        seed : int, optional
+            Semilla de los hiperplanos.
+        """
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.seed = seed
+        self._planes = None
+        self._codes = None
+        self._buckets = None
+
+    def fit(self, values):
+        """Calcula los códigos de todas las filas y arma las tablas."""
+        rng = np.random.default_rng(self.seed)
+        self._planes = rng.standard_normal((values.shape[1], self.n_tables * self.n_bits))
+        self._codes = self._hash(values)
+        self._buckets = []
+        for table in range(self.n_tables):
+            codes = self._codes[:, table]
+            order = np.argsort(codes, kind='stable')
+            unique, starts = np.unique(codes[order], return_index=True)
+            members = np.split(order, starts[1:])
+            self._buckets.append({code: list(rows) for code, rows in zip(unique.tolist(), members)})
+
+    def update(self, pos, vector):
+        """Mueve la fila ``pos`` a los baldes de su nuevo código (o la agrega si es nueva)."""
+        codes = self._hash(np.asarray(vector, dtype=np.float64)[None, :])[0]
+        if pos < len(self._codes):
+            for table, buckets in enumerate(self._buckets):
+                buckets[self._codes[pos, table]].remove(pos)
+            self._codes[pos] = codes
+        else:
+            self._codes = np.vstack([self._codes, codes])
+        for table, buckets in enumerate(self._buckets):
+            buckets.setdefault(int(codes[table]), []).append(pos)
+
+    def candidates(self, vector):
+        """Devuelve las filas que comparten algún balde con la consulta."""
+        codes = self._hash(np.asarray(vector, dtype=np.float64)[None, :])[0]
+        found = [buckets.get(int(code), ()) for code, buckets in zip(codes.tolist(), self._buckets)]
+        return np.unique(np.fromiter((row for rows in found for row in rows), dtype=np.int64))
+
+    def _hash(self, values):
+        bits = (values @ self._planes > 0).reshape(len(values), self.n_tables, self.n_bits)
+        return bits @ (1 << np.arange(self.n_bits, dtype=np.int64))
+
+
+class IVFIndex:
+    """
+    Índice aproximado por listas invertidas (IVF): los usuarios se agrupan con k-means esférico y
+    una consulta solo se compara contra los usuarios de las ``n_probe`` listas de centroides más
+    parecidos. Más listas exploradas aumentan el recall y la latencia.
+    """
+
+    name = 'ivf'
+    exact = False
+
+    def __init__(self, n_lists=None, n_probe=4, n_iter=10, seed=0, batch_size=8192):
+        """
+        Parameters
+        ----------
+        n_lists : int, optional
+            Cantidad de listas (centroides). Por defecto, la raíz cuadrada de la cantidad de usuarios.
+        n_probe : int, optional
+            Listas que se exploran por consulta.
+        n_iter : int, optional
+            Iteraciones de k-means.
+        seed : int, optional
+            Semilla de la inicialización.
+        batch_size : int, optional
+            Filas por producto de matrices al asignar usuarios a las listas.
+        """
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.batch_size = batch_size
+        self.centroids = None
+        self._assignment = None
+        self._lists = None
+        self._arrays = None
+
+    def fit(self, values):
+        """Agrupa las filas con k-means esférico y arma las listas."""
+        unit = _normalize(values)
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(values))))
+        n_lists = min(n_lists, max(len(values), 1))
+        rng = np.random.default_rng(self.seed)
+        self.centroids = unit[rng.choice(len(values), n_lists, replace=False)] if len(values) else \
+            np.zeros((1, values.shape[1]))
+
+        for _ in range(self.n_iter):
+            assignment = self._assign(unit)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignment, unit)
+            empty = ~sums.any(axis=1)
+            sums[empty] = self.centroids[empty]
+            self.centroids = _normalize(sums)
+
+        self._assignment = self._assign(unit)
+        order = np.argsort(self._assignment, kind='stable')
+        starts = np.searchsorted(self._assignment[order], np.arange(len(self.centroids)))
+        self._lists = [list(rows) for rows in np.split(order, starts[1:])]
+        self._arrays = [None] * len(self._lists)
+
+    def update(self, pos, vector):
+        """Asigna la fila ``pos`` a la lista de su centroide más parecido."""
+        target = int(self._assign(_normalize(np.asarray(vector, dtype=np.float64)[None, :]))[0])
+        if pos < len(self._assignment):
+            current = int(self._assignment[pos])
+            if current == target:
+                return
+            self._lists[current].remove(pos)
+            self._arrays[current] = None
+            self._assignment[pos] = target
+        else:
+            self._assignment = np.append(self._assignment, target)
+        self._lists[target].append(pos)
+        self._arrays[target] = None
+
+    def candidates(self, vector):
+        """Devuelve las filas de las ``n_probe`` listas más parecidas a la consulta."""
+        unit = _normalize(np.asarray(vector, dtype=np.float64)[None, :])[0]
+        scores = self.centroids @ unit
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = np.argpartition(-scores, n_probe - 1)[:n_probe]
+        for probe in probes:
+            if self._arrays[probe] is None:
+                self._arrays[probe] = np.array(self._lists[probe], dtype=np.int64)
+        return np.sort(np.concatenate([self._arrays[probe] for probe in probes]))
+
+    def _assign(self, unit):
+        assignment = np.empty(len(unit), dtype=np.int64)
+        for start in range(0, len(unit), self.batch_size):
+            assignment[start:start + self.batch_size] = np.argmax(
+                unit[start:start + self.batch_size] @ self.centroids.T, axis=1)
+        return assignment
+
+
+INDEXES = {index.name: index for index in (ExactIndex, LSHIndex, IVFIndex)}
+
+
+def make_index(index=None, **params):
+    """
+    Crea un índice de vecinos.
+
+    Parameters
+    ----------
+    index : str or object, optional
+        ``'exact'`` (por defecto), ``'lsh'``, ``'ivf'`` o un índice ya creado.
+    **params
+        Parámetros del índice (ver cada clase).
+
+    Returns
+    -------
+    object
+        El índice, todavía sin ``fit``.
+    """
+    if index is None:
+        index = 'exact'
+    if not isinstance(index, str):
+        return index
+    if index not in INDEXES:
+        raise ValueError(f"Unknown neighbor index: {index!r} (expected one of {sorted(INDEXES)})")
+    return INDEXES[index](**params)
+
+
+def _normalize(values):
+    norms = np.sqrt(np.einsum('ij,ij->i', values, values))
+    return values / np.where(norms == 0, 1, norms)[:, None]
+
+
+def recall_at_k(exact, approx):
+    """
+    Calcula el recall@k de una búsqueda aproximada respecto de la exacta.
+
+    Como la similitud tiene muchos empates, un vecino aproximado cuenta como acierto si su similitud
+    es al menos la del k-ésimo vecino exacto.
+
+    Parameters
+    ----------
+    exact, approx : list of list of tuples
+        Para cada consulta, los vecinos ``(usuario, similitud)`` de cada búsqueda.
+
+    Returns
+    -------
+    float
+        El recall promedio sobre las consultas con vecinos.
+    """
+    recalls = []
+    for exact_neighbors, approx_neighbors in zip(exact, approx):
+        if not exact_neighbors:
+            continue
+        threshold = exact_neighbors[-1][1]
+        hits = sum(1 for _, sim in approx_neighbors if sim >= threshold - 1e-12)
+        recalls.append(min(hits, len(exact_neighbors)) / len(exact_neighbors))
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+def synthetic_hybrid_matrix(n_users, n_genres=19, seed=0):
+    """
+    Genera una matriz híbrida sintética con preferencias aleatorias, para medir a gran escala.
+
+    Returns
+    -------
+    DataFrame
+        Una matriz con la misma forma de columnas que la de ``build_hybrid_matrix``.
+    """
+    import pandas as pd
+
+    from matrix_builder import build_hybrid_matrix
+
+    rng = np.random.default_rng(seed)
+    proportions = rng.dirichlet(np.full(n_genres, 0.5), size=n_users)
+    genres = pd.Index([f'genre_{i}' for i in range(n_genres)])
+    return build_hybrid_matrix(pd.DataFrame(proportions, index=np.arange(1, n_users + 1), columns=genres))
+
+
+def benchmark(hybrid_matrix, indexes, n_queries=200, k=None, seed=0):
+    """
+    Compara índices aproximados contra la búsqueda exacta.
+
+    Parameters
+    ----------
+    hybrid_matrix : DataFrame
+        La matriz híbrida.
+    indexes : dict
+        Nombre -> índice (o nombre de índice) a evaluar.
+    n_queries : int, optional
+        Cantidad de usuarios consultados, elegidos al azar.
+    k : int, optional
+        Cantidad de vecinos. Por defecto, la de ``NeighborFinder``.
+
+    Returns
+    -------
+    list of dict
+        Para cada índice: ``index``, ``build_s``, ``query_ms``, ``recall`` y ``candidates`` promedio.
+    """
+    from neighbor_finder import NeighborFinder
+
+    rng = np.random.default_rng(seed)
+    user_ids = rng.choice(hybrid_matrix.index.to_numpy(), min(n_queries, len(hybrid_matrix)), replace=False).tolist()
+
+    exact_finder = NeighborFinder(hybrid_matrix)
+    start = time.perf_counter()
+    exact = [exact_finder.find(user_id, k) for user_id in user_ids]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(user_ids)
+
+    results = [{'index': 'exact', 'build_s': 0.0, 'query_ms': exact_ms, 'recall': 1.0,
+                'candidates': float(len(hybrid_matrix))}]
+    for name, index in indexes.items():
+        start = time.perf_counter()
+        finder = NeighborFinder(hybrid_matrix, index=index)
+        build_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        approx = [finder.find(user_id, k) for user_id in user_ids]
+        query_ms = (time.perf_counter() - start) * 1000 / len(user_ids)
+        candidates = np.mean([_candidate_count(finder, user_id) for user_id in user_ids])
+        results.append({'index': name, 'build_s': build_s, 'query_ms': query_ms,
+                        'recall': recall_at_k(exact, approx), 'candidates': float(candidates)})
+    return results
+
+
+def _candidate_count(finder, user_id):
+    candidates = finder.index.candidates(finder.values[finder.position(user_id)])
+    return finder.n if candidates is None else len(candidates)
+
+
+def main():
+    """
+    Punto de entrada de línea de comandos para medir recall@k y latencia de los índices de vecinos.
+
+    Ejemplo: ``python neighbor_index.py --synthetic-users 100000 --lsh-tables 8 --ivf-probe 8``
+    """
+    parser = argparse.ArgumentParser(description="Compara los índices de vecinos aproximados con la búsqueda exacta.")
+    parser.add_argument('--synthetic-users', type=int, default=None,
+                        help="Usa una matriz híbrida aleatoria con esta cantidad de usuarios en lugar del dataset.")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=None)
+    parser.add_argument('--lsh-tables', type=int, default=8)
+    parser.add_argument('--lsh-bits', type=int, default=10)
+    parser.add_argument('--ivf-lists', type=int, default=None)
+    parser.add_argument('--ivf-probe', type=int, default=4)
+    parser.add_argument('--dataset-dir', default='dataset')
+    args = parser.parse_args()
+
+    if args.synthetic_users:
+        hybrid_matrix = synthetic_hybrid_matrix(args.synthetic_users)
+    else:
+        from data_reader import read_data
+        from recommender_model import RecommenderModel
+
+        md_genres, ratings, md = read_data(args.dataset_dir, compact=True)
+        hybrid_matrix = RecommenderModel.build(md_genres, ratings, md).hybrid_matrix
+
+    indexes = {
+        'lsh': LSHIndex(n_tables=args.lsh_tables, n_bits=args.lsh_bits),
+        'ivf': IVFIndex(n_lists=args.ivf_lists, n_probe=args.ivf_probe),
+    }
+    print(f"{len(hybrid_matrix)} users")
+    print(f"{'index':<8}{'build s':>10}{'query ms':>10}{'recall@k':>10}{'candidates':>12}")
+    for row in benchmark(hybrid_matrix, indexes, n_queries=args.queries, k=args.k):
+        print(f"{row['index']:<8}{row['build_s']:>10.3f}{row['query_ms']:>10.3f}{row['recall']:>10.3f}"
+              f"{row['candidates']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
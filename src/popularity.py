@@ -0,0 +1,320 @@
+import argparse
+import threading
+
+import numpy as np
+
+from data_reader import read_compact_data
+from instrumentation import timed
+from model_store import DEFAULT_DATASET_DIR
+
+KINDS = ('popular', 'trending')
+DEFAULT_POPULARITY_PARAMS = {'prior_count': 10.0, 'half_life_days': 90.0, 'list_size': 100, 'refresh_every': 1000}
+
+_MAX_EXPONENT = 512  # Por encima, los pesos de tendencia se vuelven a escalar para no desbordar float64
+
+
+class PopularityStore:
+    """
+    Listas precalculadas de películas populares para los usuarios sin calificaciones.
+
+    Guarda por película la cantidad y la suma de sus calificaciones y un puntaje de tendencia, y a
+    partir de ellos las listas ordenadas de cada balde: todas las películas, cada género, cada década
+    y cada combinación de género y década pedida. Pedir una lista es buscarla en un dict. Una
+    calificación nueva solo actualiza los acumulados de su película y la vuelve a ubicar en las
+    listas de sus baldes (O(``list_size``) por lista), sin volver a ordenar el catálogo.
+
+    Cada lista guarda las ``list_size`` mejores películas de su balde. Si una película de la lista
+    baja de puntaje y la lista no tiene todo el balde, la película sale de la lista (la que la
+    reemplazaría podría estar fuera); solo cuando una lista queda con menos de la mitad de
+    ``list_size`` se vuelve a ordenar su balde completo.
+
+    El puntaje de popularidad es el promedio bayesiano
+    ``(prior_count * media_global + suma) / (prior_count + cantidad)``, que acerca a la media global
+    las películas con pocas calificaciones: una sola calificación de 5 ya no alcanza para encabezar
+    la lista. La media global usada en el puntaje se actualiza cada ``refresh_every`` calificaciones
+    nuevas (ver ``refresh``).
+
+    El puntaje de tendencia suma por cada calificación nueva (no por las que cambian una anterior)
+    un peso que se duplica cada ``half_life_days`` días, es decir, la cantidad de calificaciones con
+    decaimiento exponencial hacia el pasado. Como todos los puntajes decaen igual con el tiempo, solo
+    hace falta sumar el peso de cada calificación nueva.
+
+    Attributes
+    ----------
+    movie_ids : ndarray of int
+        Las películas del catálogo, ordenadas.
+    counts : ndarray of int64
+        Cantidad de calificaciones de cada película.
+    sums : ndarray of float64
+        Suma de las calificaciones de cada película.
+    trend : ndarray of float64
+        Puntaje de tendencia de cada película, relativo a ``reference_time``.
+    genre_names : list of str
+        Los géneros, en el orden de las columnas de ``genres``.
+    genres : ndarray of uint8
+        Matriz (películas x géneros): 1 si la película tiene el género.
+    decades : ndarray of int
+        La década de cada película (1990, 2000, ...), o -1 si no tiene año.
+    params : dict
+        ``prior_count``, ``half_life_days``, ``list_size`` y ``refresh_every``.
+    """
+
+    def __init__(self, movie_ids, counts, sums, trend, reference_time, genre_names, genres, decades, params=None):
+        self.movie_ids = movie_ids
+        self.counts = counts
+        self.sums = sums
+        self.trend = trend
+        self.reference_time = reference_time
+        self.genre_names = list(genre_names)
+        self.genres = genres
+        self.decades = decades
+        self.params = {**DEFAULT_POPULARITY_PARAMS, **(params or {})}
+        self._genre_columns = {name: column for column, name in enumerate(self.genre_names)}
+        # (tipo, género, década) -> [posiciones en ``movie_ids`` de más a menos puntaje, si tiene todo el balde]
+        self._lists = {}
+        self._since_refresh = 0
+        self._lock = threading.Lock()
+        self.global_mean = self._global_mean()
+
+    @classmethod
+    @timed('build_popularity')
+    def build(cls, data, **params):
+        """
+        Calcula los acumulados de todas las películas con una sola pasada sobre las calificaciones.
+
+        Parameters
+        ----------
+        data : CompactData
+            El dataset, con el diario de calificaciones ya aplicado.
+        **params
+            ``prior_count``, ``half_life_days``, ``list_size`` y ``refresh_every``.
+
+        Returns
+        -------
+        PopularityStore
+            Las listas de todos los géneros y décadas, ya ordenadas.
+        """
+        params = {**DEFAULT_POPULARITY_PARAMS, **params}
+        order = np.argsort(data.movies['movieId'].to_numpy(), kind='stable')
+        movie_ids = data.movies['movieId'].to_numpy()[order]
+        genres = data.genres[order]
+        years = data.movies['year'].astype('float64').to_numpy()[order]
+        decades = np.where(np.isnan(years), -1, np.floor(np.nan_to_num(years) / 10) * 10).astype(np.int64)
+
+        ratings = data.ratings
+        positions = np.searchsorted(movie_ids, ratings['movieId'].to_numpy())
+        positions = np.minimum(positions, len(movie_ids) - 1)
+        known = movie_ids[positions] == ratings['movieId'].to_numpy()
+        positions = positions[known]
+        timestamps = ratings['timestamp'].to_numpy()[known]
+
+        counts = np.bincount(positions, minlength=len(movie_ids)).astype(np.int64)
+        sums = np.bincount(positions, weights=ratings['rating'].to_numpy()[known].astype(np.float64),
+                           minlength=len(movie_ids))
+        reference_time = int(timestamps.max()) if len(timestamps) else 0
+        half_life = params['half_life_days'] * 86400
+        trend = np.bincount(positions, weights=np.exp2((timestamps - reference_time) / half_life),
+                            minlength=len(movie_ids))
+
+        store = cls(movie_ids, counts, sums, trend, reference_time, data.genre_names, genres, decades, params)
+        store.warm()
+        return store
+
+    def _global_mean(self):
+        total = self.counts.sum()
+        return float(self.sums.sum() / total) if total else 0.0
+
+    def refresh(self):
+        """Recalcula la media global del puntaje bayesiano y vuelve a ordenar todas las listas."""
+        with self._lock:
+            self.global_mean = self._global_mean()
+            self._since_refresh = 0
+            self._lists.clear()
+        self.warm()
+
+    def warm(self):
+        """Ordena de una vez las listas de todas las películas, de cada género y de cada década."""
+        for kind in KINDS:
+            self.ranked(kind=kind)
+            for genre in self.genre_names:
+                self.ranked(kind=kind, genre=genre)
+            for decade in np.unique(self.decades[self.decades >= 0]).tolist():
+                self.ranked(kind=kind, decade=decade)
+
+    def scores(self, kind='popular'):
+        """
+        Devuelve el puntaje de cada película.
+
+        Parameters
+        ----------
+        kind : {'popular', 'trending'}, optional
+            El promedio bayesiano o el puntaje de tendencia.
+
+        Returns
+        -------
+        ndarray of float64
+            Un puntaje por película de ``movie_ids``.
+        """
+        return self._scores_at(kind, slice(None))
+
+    def _scores_at(self, kind, positions):
+        if kind == 'popular':
+            prior = self.params['prior_count']
+            return (prior * self.global_mean + self.sums[positions]) / (prior + self.counts[positions])
+        if kind == 'trending':
+            return self.trend[positions]
+        raise ValueError(f"Unknown ranking kind: {kind!r} (expected one of {list(KINDS)})")
+
+    def ranked(self, n=10, kind='popular', genre=None, decade=None):
+        """
+        Devuelve las películas con más puntaje de un balde.
+
+        Parameters
+        ----------
+        n : int, optional
+            Cantidad de películas (a lo sumo ``list_size``).
+        kind : {'popular', 'trending'}, optional
+            Ordena por promedio bayesiano o por tendencia.
+        genre : str, optional
+            Solo las películas de ese género.
+        decade : int, optional
+            Solo las películas de esa década (por ejemplo, 1990).
+
+        Returns
+        -------
+        ndarray of int
+            Los IDs de las películas, de más a menos puntaje; solo películas con alguna calificación.
+        """
+        if genre is not None and genre not in self._genre_columns:
+            raise ValueError(f"Unknown genre: {genre!r}")
+        key = (kind, genre, None if decade is None else int(decade))
+        with self._lock:
+            entry = self._lists.get(key)
+            if entry is None:
+                entry = self._lists[key] = self._rank(*key)
+            return self.movie_ids[entry[0][:n]]
+
+    def _rank(self, kind, genre, decade):
+        mask = self.counts > 0
+        if genre is not None:
+            mask &= self.genres[:, self._genre_columns[genre]].astype(bool)
+        if decade is not None:
+            mask &= self.decades == decade
+        candidates = np.flatnonzero(mask)
+        scores = self.scores(kind)[candidates]
+        size = min(self.params['list_size'], len(candidates))
+        top = np.arange(len(candidates))
+        if size < len(candidates):
+            # Todas las empatadas con la última entran al desempate, no una cualquiera
+            top = np.flatnonzero(scores >= np.partition(scores, len(candidates) - size)[len(candidates) - size])
+        # Desempata por movieId para que las listas no dependan del orden de las calificaciones
+        top = top[np.lexsort((self.movie_ids[candidates[top]], -scores[top]))][:size]
+        return [candidates[top], size == len(candidates)]
+
+    def _rerank(self, key, position, score, old_score):
+        # Vuelve a ubicar una película en una lista ya ordenada, cuyo balde la contiene
+        entry = self._lists[key]
+        ranked, complete = entry
+        member = ranked == position
+        was_member = bool(member.any())
+        ranked = ranked[~member]
+        scores = self._scores_at(key[0], ranked)
+        # Cantidad de películas que quedan delante: más puntaje, o el mismo y menor movieId
+        before = int(np.count_nonzero((scores > score)
+                                      | ((scores == score) & (self.movie_ids[ranked] < self.movie_ids[position]))))
+        # Si era de la lista y bajó por debajo de la última, queda afuera: la siguiente del balde
+        # podría no estar en la lista
+        if complete or (was_member and score >= old_score) or before < len(ranked):
+            ranked = np.insert(ranked, before, position)
+        if len(ranked) > self.params['list_size']:
+            ranked, complete = ranked[:self.params['list_size']], False
+        if not complete and len(ranked) < self.params['list_size'] // 2:
+            del self._lists[key]  # Se vuelve a ordenar el balde la próxima vez que se pida
+        else:
+            entry[0], entry[1] = ranked, complete
+
+    def add_rating(self, movie_id, rating, timestamp, previous=None):
+        """
+        Suma una calificación nueva a los acumulados de su película.
+
+        Parameters
+        ----------
+        movie_id : int
+            La película calificada.
+        rating : float
+            La calificación.
+        timestamp : int
+            Cuándo se calificó, en segundos.
+        previous : float, optional
+            La calificación anterior del mismo usuario a la misma película, si la reemplaza: la
+            cantidad no cambia y la suma cambia en la diferencia.
+        """
+        position = np.searchsorted(self.movie_ids, movie_id)
+        if position == len(self.movie_ids) or self.movie_ids[position] != movie_id:
+            return  # Película fuera del catálogo: no aparece en ninguna lista
+
+        with self._lock:
+            old_scores = {kind: float(self._scores_at(kind, position)) for kind in KINDS}
+            if previous is None:
+                self.counts[position] += 1
+                self.sums[position] += rating
+                self.trend[position] += self._trend_weight(timestamp)
+            else:
+                self.sums[position] += rating - previous
+
+            # Solo cambian las listas de los baldes de la película, y en ellas solo su lugar
+            movie_genres = {self.genre_names[column] for column in np.flatnonzero(self.genres[position])}
+            decade = int(self.decades[position])
+            for key in [key for key in self._lists
+                        if (key[1] is None or key[1] in movie_genres) and (key[2] is None or key[2] == decade)]:
+                score = float(self._scores_at(key[0], position))
+                if score != old_scores[key[0]]:
+                    self._rerank(key, position, score, old_scores[key[0]])
+            self._since_refresh += 1
+            needs_refresh = self._since_refresh >= self.params['refresh_every']
+        if needs_refresh:
+            self.refresh()
+
+    def _trend_weight(self, timestamp):
+        half_life = self.params['half_life_days'] * 86400
+        exponent = (timestamp - self.reference_time) / half_life
+        if exponent > _MAX_EXPONENT:
+            # Mueve la referencia a ``timestamp``: todos los puntajes se escalan igual, el orden no cambia
+            self.trend *= np.exp2(-exponent)
+            self.reference_time = timestamp
+            exponent = 0.0
+        return float(np.exp2(exponent))
+
+
+def main():
+    """
+    Punto de entrada de línea de comandos para ver las listas de películas populares.
+
+    Ejemplo: ``python popularity.py --kind trending --genre Comedy --decade 1990 --n 20``
+    """
+    parser = argparse.ArgumentParser(description="Muestra las películas más populares o en tendencia.")
+    parser.add_argument('--kind', choices=KINDS, default='popular')
+    parser.add_argument('--genre', default=None)
+    parser.add_argument('--decade', type=int, default=None)
+    parser.add_argument('--n', type=int, default=10)
+    parser.add_argument('--prior-count', type=float, default=DEFAULT_POPULARITY_PARAMS['prior_count'])
+    parser.add_argument('--half-life-days', type=float, default=DEFAULT_POPULARITY_PARAMS['half_life_days'])
+    parser.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR)
+    args = parser.parse_args()
+
+    data = read_compact_data(args.dataset_dir)
+    store = PopularityStore.build(data, prior_count=args.prior_count, half_life_days=args.half_life_days,
+                                  list_size=max(args.n, DEFAULT_POPULARITY_PARAMS['list_size']))
+    try:
+        movie_ids = store.ranked(args.n, args.kind, args.genre, args.decade)
+    except ValueError as error:
+        parser.error(str(error))
+    titles = data.movies.set_index('movieId')['title']
+    scores = dict(zip(store.movie_ids.tolist(), store.scores(args.kind).tolist()))
+    counts = dict(zip(store.movie_ids.tolist(), store.counts.tolist()))
+    for rank, movie_id in enumerate(movie_ids.tolist(), start=1):
+        print(f"{rank:>3}. {titles[movie_id]}  (score {scores[movie_id]:.3f}, {counts[movie_id]} ratings)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import argparse
+import atexit
+import contextlib
+import fcntl
+import io
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+LOG_FILENAME = 'ratings.log.csv'
+LOG_COLUMNS = ['userId', 'movieId', 'rating', 'timestamp']
+LOG_DTYPES = {'userId': 'int64', 'movieId': 'int64', 'rating': 'float64', 'timestamp': 'int64'}
+GENERATION_PREFIX = b'#generation,'
+
+_logs = {}  # Un RatingLog por archivo, compartido por todas las sesiones del proceso
+_logs_lock = threading.Lock()
+
+
+class LogRotated(Exception):
+    """La posición pedida es de un diario que ya se compactó (o que se truncó): hay que volver a leer el dataset."""
+
+
+class RatingLog:
+    """
+    Diario de calificaciones de solo agregado, guardado como CSV junto al dataset.
+
+    Cada calificación se escribe como una línea con una sola llamada a ``os.write`` sobre un
+    descriptor abierto con ``O_APPEND``, así que las escrituras de varias sesiones (o procesos) no se
+    pisan. ``fsync`` se agrupa: se hace cada ``sync_every`` calificaciones o cuando pasaron
+    ``sync_interval`` segundos desde el último, y siempre al cerrar el diario.
+
+    La primera línea del archivo identifica su generación (``#generation,<id>,<id anterior>``).
+    ``compact`` no vacía el diario: integra sus calificaciones en ``ratings.csv`` y lo reemplaza por
+    uno nuevo de otra generación, de modo que una posición leída antes de compactar nunca se
+    confunde con una posición del diario nuevo (ver ``read_log``). Si el diario se reemplazó, la
+    próxima escritura reabre el archivo nuevo.
+
+    ``read_data`` vuelve a aplicar el diario sobre ``ratings.csv`` y ``compact`` lo integra en una
+    nueva versión de ``ratings.csv``.
+    """
+
+    def __init__(self, path, sync_every=32, sync_interval=1.0):
+        """
+        Parameters
+        ----------
+        path : str
+            Ruta del archivo del diario.
+        sync_every : int, optional
+            Cantidad máxima de calificaciones escritas entre dos ``fsync``.
+        sync_interval : float, optional
+            Tiempo máximo en segundos entre dos ``fsync``.
+        """
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._fd = _open_journal(path, os.O_WRONLY | os.O_APPEND)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, user_id, movie_id, rating, timestamp):
+        """
+        Agrega una calificación al diario en O(1).
+
+        Parameters
+        ----------
+        user_id : int
+            El ID del usuario.
+        movie_id : int
+            El ID de la película.
+        rating : float
+            La calificación.
+        timestamp : int
+            La marca de tiempo de la calificación.
+        """
+        line = f'{int(user_id)},{int(movie_id)},{float(rating)},{int(timestamp)}\n'.encode()
+        with self._lock:
+            # El bloqueo compartido solo excluye a ``compact``, no a otros escritores.
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            while not _is_current(self._fd, self.path):
+                # ``compact`` reemplazó el diario: se escribe en el nuevo
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                os.close(self._fd)
+                self._fd = _open_journal(self.path, os.O_WRONLY | os.O_APPEND)
+                fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                os.write(self._fd, line)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._pending += 1
+            if self._pending >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+                self._sync()
+
+    def flush(self):
+        """Fuerza el ``fsync`` de las calificaciones pendientes."""
+        with self._lock:
+            if self._pending:
+                self._sync()
+
+    def close(self):
+        """Hace ``fsync`` de lo pendiente y cierra el diario."""
+        with self._lock:
+            if self._fd is None:
+                return
+            if self._pending:
+                self._sync()
+            os.close(self._fd)
+            self._fd = None
+
+    def _sync(self):
+        os.fsync(self._fd)
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+
+def log_path(dataset_dir='dataset'):
+    """Devuelve la ruta del diario de calificaciones de un dataset."""
+    return os.path.join(dataset_dir, LOG_FILENAME)
+
+
+def _generation_header(parent=''):
+    return GENERATION_PREFIX + f'{uuid.uuid4().hex},{parent}\n'.encode()
+
+
+def _parse_header(line):
+    # Devuelve (generación, generación anterior); un diario sin encabezado (de versiones anteriores)
+    # o inexistente es la generación ''.
+    if not line.startswith(GENERATION_PREFIX) or not line.endswith(b'\n'):
+        return '', ''
+    generation, _, parent = line[len(GENERATION_PREFIX):].decode().strip().partition(',')
+    return generation, parent
+
+
+def _write_journal(path, header):
+    # Escribe un diario vacío con su encabezado en un archivo temporal, listo para ponerlo en ``path``
+    tmp_path = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+
+def _open_journal(path, flags):
+    # Crea el diario si no existe, con el encabezado ya escrito: ``os.link`` falla si otro proceso
+    # lo creó antes, así que nunca queda un diario sin encabezado ni con dos.
+    if not os.path.exists(path):
+        tmp_path = _write_journal(path, _generation_header())
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+    return os.open(path, flags)
+
+
+def _is_current(fd, path):
+    # Indica si el descriptor sigue apuntando al diario de ``path`` (``compact`` no lo reemplazó)
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(fd)
+    return (opened.st_dev, opened.st_ino) == (current.st_dev, current.st_ino)
+
+
+def _lock_journal(path, mode, flags=os.O_RDONLY):
+    # Bloquea el diario actual: si se reemplazó mientras se esperaba el bloqueo, bloquea el nuevo
+    while True:
+        fd = _open_journal(path, flags)
+        fcntl.flock(fd, mode)
+        if _is_current(fd, path):
+            return fd
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def snapshot_lock(dataset_dir='dataset'):
+    """
+    Impide que ``compact`` cambie ``ratings.csv`` y el diario mientras se leen juntos.
+
+    Si el diario todavía no existe no bloquea nada (ni lo crea): hasta que alguien califique una
+    película no hay nada que compactar.
+    """
+    path = log_path(dataset_dir)
+    if not os.path.exists(path):
+        yield
+        return
+    fd = _lock_journal(path, fcntl.LOCK_SH)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def get_rating_log(dataset_dir='dataset'):
+    """
+    Devuelve el diario de calificaciones del dataset, compartido por todo el proceso.
+
+    El diario se cierra (con ``fsync``) automáticamente al terminar el proceso.
+    """
+    path = os.path.abspath(log_path(dataset_dir))
+    with _logs_lock:
+        if path not in _logs:
+            _logs[path] = RatingLog(path)
+            atexit.register(_logs[path].close)
+        return _logs[path]
+
+
+def read_log(dataset_dir='dataset', offset=0, generation=None):
+    """
+    Lee las calificaciones del diario a partir de una posición en bytes.
+
+    Solo se leen líneas completas, así que una línea a medio escribir se ignora hasta que termine.
+
+    Parameters
+    ----------
+    dataset_dir : str, optional
+        Carpeta del dataset.
+    offset : int, optional
+        Posición en bytes desde la cual leer.
+    generation : str, optional
+        La generación del diario a la que pertenece ``offset`` (la devuelta por una lectura
+        anterior). Por defecto no se verifica.
+
+    Returns
+    -------
+    entries : DataFrame
+        Las calificaciones leídas, en el orden en que se escribieron.
+    end : int
+        La posición en bytes hasta la cual se leyó.
+    generation : str
+        La generación del diario leído ('' si no existe).
+
+    Raises
+    ------
+    LogRotated
+        Si el diario ya no es el de ``generation`` (se compactó) o es más corto que ``offset``: las
+        calificaciones que faltan desde esa posición ya no están en el diario sino en ``ratings.csv``.
+    """
+    path = log_path(dataset_dir)
+    try:
+        with open(path, 'rb') as f:
+            header = f.readline()
+            current, parent = _parse_header(header)
+            size = os.fstat(f.fileno()).st_size
+            start = max(offset, len(header) if current else 0)
+            f.seek(start)
+            data = f.read()
+    except FileNotFoundError:
+        current, parent, size, start, data = '', '', 0, offset, b''
+
+    # Un diario creado (no compactado) después de leer sin diario sigue a la lectura anterior
+    created_after = generation == '' and parent == '' and offset == 0
+    if offset > size or (generation is not None and generation != current and not created_after):
+        raise LogRotated(f"Journal {path} was rotated or truncated (generation {generation!r}, offset {offset})")
+
+    data = data[:data.rfind(b'\n') + 1]
+    end = start + len(data)
+    if not data:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in LOG_DTYPES.items()}), end, current
+
+    entries = pd.read_csv(io.BytesIO(data), names=LOG_COLUMNS, header=None, on_bad_lines='skip')
+    entries = entries.apply(pd.to_numeric, errors='coerce').dropna()
+    entries = entries.astype(LOG_DTYPES)
+    return entries.reset_index(drop=True), end, current
+
+
+def apply_log(ratings, entries):
+    """
+    Aplica calificaciones del diario sobre un DataFrame de calificaciones.
+
+    Si un usuario calificó varias veces la misma película se conserva la última calificación.
+
+    Returns
+    -------
+    DataFrame
+        Las calificaciones con el diario aplicado.
+    """
+    if entries.empty:
+        return ratings
+    combined = pd.concat([ratings, entries.astype(ratings.dtypes.to_dict())], ignore_index=True)
+    return combined.drop_duplicates(subset=['userId', 'movieId'], keep='last').reset_index(drop=True)
+
+
+def compact(dataset_dir='dataset'):
+    """
+    Integra el diario en una nueva versión de ``ratings.csv`` y lo reemplaza por uno vacío.
+
+    Mientras dura la compactación el diario queda bloqueado en exclusiva, así que ninguna
+    calificación escrita en paralelo se pierde: las escrituras esperan y después van al diario
+    nuevo. ``ratings.csv`` y el diario se reemplazan de forma atómica y el diario nuevo es de otra
+    generación, así que los procesos en marcha (que guardan su posición en el diario anterior)
+    detectan el cambio en ``read_log`` y vuelven a leer el dataset (ver ``model_store``).
+
+    Returns
+    -------
+    int
+        La cantidad de calificaciones del diario que se integraron.
+    """
+    path = log_path(dataset_dir)
+    ratings_path = os.path.join(dataset_dir, 'ratings.csv')
+    fd = _lock_journal(path, fcntl.LOCK_EX)
+    try:
+        entries, _, generation = read_log(dataset_dir)
+        if not entries.empty:
+            ratings = apply_log(pd.read_csv(ratings_path), entries)
+            tmp_path = f'{ratings_path}.tmp-{os.getpid()}'
+            ratings.to_csv(tmp_path, index=False)
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, ratings_path)
+
+        # Con el bloqueo exclusivo no hay escrituras en curso: cualquier resto sin salto de línea
+        # después de ``end`` es de un proceso que murió a mitad de una escritura y se descarta.
+        os.replace(_write_journal(path, _generation_header(generation or 'legacy')), path)
+        return len(entries)
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def main():
+    """
+    Punto de entrada de línea de comandos para compactar el diario de calificaciones.
+
+    Ejemplo: ``python rating_log.py compact``
+    """
+    parser = argparse.ArgumentParser(description="Administra el diario de calificaciones.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compact_parser = subparsers.add_parser('compact', help="Integra el diario en ratings.csv.")
+    compact_parser.add_argument('--dataset-dir', default='dataset')
+    args = parser.parse_args()
+
+    if args.command == 'compact':
+        count = compact(args.dataset_dir)
+        print(f"Compacted {count} ratings into {os.path.join(args.dataset_dir, 'ratings.csv')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+class RatingMatrix:
+    """
+    Matriz dispersa usuarios x películas con las calificaciones de los usuarios.
+
+    Guarda las calificaciones en formato CSR (acceso por usuario) y CSC (acceso por película),
+    junto con mapas compactos int32 entre los IDs originales y las filas/columnas de la matriz.
+    La memoria crece con el número de calificaciones y no con usuarios x películas.
+
+    La matriz admite actualizaciones puntuales con ``set``: si la calificación ya existe se
+    modifica en su lugar, y si es nueva (incluso de un usuario o una película nuevos) se guarda en
+    una capa adicional en memoria que se consulta junto con la parte dispersa. ``compacted``
+    devuelve una matriz nueva con todo integrado.
+
+    Attributes
+    ----------
+    csr : scipy.sparse.csr_matrix
+        Calificaciones indexadas por fila de usuario.
+    csc : scipy.sparse.csc_matrix
+        Las mismas calificaciones indexadas por columna de película.
+    times : ndarray of int64
+        Marca de tiempo de cada calificación, en el mismo orden que ``csr.data``.
+    """
+
+    def __init__(self, csr, user_ids, movie_ids, csc=None, times=None, row_sums=None):
+        self.csr = sp.csr_matrix(csr, dtype=np.float32)
+        self.csr.sort_indices()
+        if csc is None:
+            csc = self.csr.tocsc()
+            csc.sort_indices()
+        self.csc = csc
+        self.times = np.zeros(self.csr.nnz, dtype=np.int64) if times is None else times
+        self._base_user_ids = np.asarray(user_ids, dtype=np.int32)
+        self._base_movie_ids = np.asarray(movie_ids, dtype=np.int32)
+
+        if row_sums is None:
+            rows = np.repeat(np.arange(self.csr.shape[0]), np.diff(self.csr.indptr))
+            row_sums = np.bincount(rows, weights=self.csr.data, minlength=self.csr.shape[0])
+        self._row_sums = np.array(row_sums, dtype=np.float64)
+        self._n_users = len(self._base_user_ids)
+
+        self._extra_users = {}   # userId -> fila, para usuarios nuevos
+        self._extra_movies = {}  # movieId -> columna, para películas nuevas
+        self._overlay = {}       # fila -> {columna: (calificación, timestamp)} para calificaciones nuevas
+        self._user_ids = self._base_user_ids
+        self._movie_ids = self._base_movie_ids
+
+    @classmethod
+    def from_ratings(cls, ratings):
+        """
+        Construye la matriz a partir del DataFrame de calificaciones.
+
+        Parameters
+        ----------
+        ratings : DataFrame
+            Un DataFrame con las columnas ``userId``, ``movieId``, ``rating`` y opcionalmente
+            ``timestamp``. Si un usuario calificó varias veces la misma película se conserva la
+            última calificación.
+
+        Returns
+        -------
+        RatingMatrix
+            La matriz dispersa de calificaciones.
+        """
+        ratings = ratings.drop_duplicates(subset=['userId', 'movieId'], keep='last')
+        user_ids, rows = np.unique(ratings['userId'].to_numpy(dtype=np.int64), return_inverse=True)
+        movie_ids, cols = np.unique(ratings['movieId'].to_numpy(dtype=np.int64), return_inverse=True)
+        values = ratings['rating'].to_numpy(dtype=np.float32)
+        if 'timestamp' in ratings:
+            timestamps = ratings['timestamp'].to_numpy(dtype=np.int64)
+        else:
+            timestamps = np.zeros(len(ratings), dtype=np.int64)
+
+        # Se ordena por (fila, columna), que es el orden en que quedan las entradas del CSR.
+        order = np.lexsort((cols, rows))
+        csr = sp.csr_matrix((values[order], (rows[order].astype(np.int32), cols[order].astype(np.int32))),
+                            shape=(len(user_ids), len(movie_ids)))
+        return cls(csr, user_ids, movie_ids, times=timestamps[order])
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Reconstruye la matriz a partir de los arreglos devueltos por ``to_arrays``.
+
+        Los arreglos se usan tal cual, sin copiarlos, de modo que pueden venir de ``np.load``
+        con ``mmap_mode``.
+        """
+        shape = (len(arrays['user_ids']), len(arrays['movie_ids']))
+        csr = sp.csr_matrix((arrays['csr_data'], arrays['csr_indices'], arrays['csr_indptr']),
+                            shape=shape, copy=False)
+        csr.has_sorted_indices = True
+        csc = sp.csc_matrix((arrays['csc_data'], arrays['csc_indices'], arrays['csc_indptr']),
+                            shape=shape, copy=False)
+        csc.has_sorted_indices = True
+        return cls(csr, arrays['user_ids'], arrays['movie_ids'], csc=csc, times=arrays['csr_times'],
+                   row_sums=arrays['row_sums'])
+
+    def to_arrays(self):
+        """Devuelve los arreglos que definen la matriz (ya compactada), para guardarla en disco."""
+        matrix = self.compacted()
+        return {
+            'csr_data': matrix.csr.data,
+            'csr_indices': matrix.csr.indices,
+            'csr_indptr': matrix.csr.indptr,
+            'csr_times': matrix.times,
+            'csc_data': matrix.csc.data,
+            'csc_indices': matrix.csc.indices,
+            'csc_indptr': matrix.csc.indptr,
+            'user_ids': matrix.user_ids,
+            'movie_ids': matrix.movie_ids,
+            'row_sums': matrix._row_sums[:matrix.shape[0]],
+        }
+
+    def compacted(self):
+        """
+        Devuelve una matriz equivalente sin capa adicional, con filas y columnas ordenadas por ID.
+
+        Si la matriz no tiene actualizaciones pendientes se devuelve ella misma.
+        """
+        if not self._overlay and not self._extra_users and not self._extra_movies:
+            return self
+
+        rows = [np.repeat(np.arange(self.csr.shape[0]), np.diff(self.csr.indptr))]
+        cols = [self.csr.indices]
+        values = [self.csr.data]
+        times = [self.times]
+        for row, entries in self._overlay.items():
+            rows.append(np.full(len(entries), row))
+            cols.append(np.fromiter(entries.keys(), dtype=np.int64, count=len(entries)))
+            values.append(np.array([rating for rating, _ in entries.values()], dtype=np.float32))
+            times.append(np.array([ts for _, ts in entries.values()], dtype=np.int64))
+
+        # Se renumeran filas y columnas para que los IDs vuelvan a quedar ordenados.
+        user_order = np.argsort(self.user_ids, kind='stable')
+        movie_order = np.argsort(self.movie_ids, kind='stable')
+        new_row = np.empty_like(user_order)
+        new_row[user_order] = np.arange(len(user_order))
+        new_col = np.empty_like(movie_order)
+        new_col[movie_order] = np.arange(len(movie_order))
+
+        rows = new_row[np.concatenate(rows)]
+        cols = new_col[np.concatenate(cols)]
+        values = np.concatenate(values)
+        times = np.concatenate(times)
+        order = np.lexsort((cols, rows))
+        csr = sp.csr_matrix((values[order], (rows[order], cols[order])), shape=self.shape)
+        return RatingMatrix(csr, self.user_ids[user_order], self.movie_ids[movie_order], times=times[order])
+
+    @property
+    def shape(self):
+        return (self._n_users, len(self._movie_ids))
+
+    @property
+    def user_ids(self):
+        """IDs de usuario; la posición es la fila en la matriz."""
+        return self._user_ids
+
+    @property
+    def movie_ids(self):
+        """IDs de película; la posición es la columna en la matriz."""
+        return self._movie_ids
+
+    @property
+    def columns(self):
+        """IDs de película en el orden de las columnas, como ``DataFrame.columns`` en la matriz densa."""
+        return self._movie_ids
+
+    @property
+    def user_means(self):
+        """
+        Promedio de cada usuario sobre todo el catálogo (las películas sin calificar cuentan como 0),
+        igual que el promedio de una fila de la antigua matriz densa.
+        """
+        return self._row_sums[:self._n_users] / max(len(self._movie_ids), 1)
+
+    def __contains__(self, user_id):
+        try:
+            self.user_index(user_id)
+        except KeyError:
+            return False
+        return True
+
+    def user_index(self, user_id):
+        """
+        Devuelve la fila que corresponde a un usuario.
+
+        Raises
+        ------
+        KeyError
+            Si el usuario no tiene calificaciones en la matriz.
+        """
+        row = self._find(self._base_user_ids, user_id)
+        if row < 0:
+            row = self._extra_users.get(user_id, -1)
+        if row < 0:
+            raise KeyError(user_id)
+        return row
+
+    def movie_index(self, movie_id):
+        """
+        Devuelve la columna que corresponde a una película.
+
+        Raises
+        ------
+        KeyError
+            Si la película no tiene calificaciones en la matriz.
+        """
+        col = self._find(self._base_movie_ids, movie_id)
+        if col < 0:
+            col = self._extra_movies.get(movie_id, -1)
+        if col < 0:
+            raise KeyError(movie_id)
+        return col
+
+    def user_indices(self, user_ids):
+        """Devuelve las filas de varios usuarios; lanza KeyError si alguno no está en la matriz."""
+        if self._extra_users:
+            return np.array([self.user_index(user_id) for user_id in user_ids], dtype=np.int64)
+        return self._find_many(self._base_user_ids, user_ids)
+
+    def movie_indices(self, movie_ids):
+        """Devuelve las columnas de varias películas; lanza KeyError si alguna no está en la matriz."""
+        if self._extra_movies:
+            return np.array([self.movie_index(movie_id) for movie_id in movie_ids], dtype=np.int64)
+        return self._find_many(self._base_movie_ids, movie_ids)
+
+    def user_row(self, user_id):
+        """
+        Devuelve las películas calificadas por un usuario.
+
+        Returns
+        -------
+        cols : ndarray of int
+            Columnas (no IDs) de las películas calificadas.
+        values : ndarray of float32
+            Las calificaciones correspondientes.
+        """
+        _, cols, values = self.rows_entries([self.user_index(user_id)])
+        return cols, values
+
+    def rows_entries(self, rows):
+        """
+        Devuelve todas las calificaciones de un conjunto de filas.
+
+        Parameters
+        ----------
+        rows : array_like of int
+            Filas de usuario a consultar.
+
+        Returns
+        -------
+        owner : ndarray of int
+            Para cada calificación, la posición en ``rows`` de la fila a la que pertenece.
+        cols : ndarray of int
+            Columna de cada calificación.
+        values : ndarray of float32
+            Valor de cada calificación.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        in_base = np.flatnonzero(rows < self.csr.shape[0])
+        sub = self.csr[rows[in_base]]
+        owner = in_base[np.repeat(np.arange(len(in_base)), np.diff(sub.indptr))]
+        if not self._overlay:
+            return owner, sub.indices, sub.data
+
+        owners, cols, values = [owner], [sub.indices], [sub.data]
+        for pos, row in enumerate(rows.tolist()):
+            entries = self._overlay.get(row)
+            if entries:
+                owners.append(np.full(len(entries), pos))
+                cols.append(np.fromiter(entries.keys(), dtype=np.int64, count=len(entries)))
+                values.append(np.array([rating for rating, _ in entries.values()], dtype=np.float32))
+        return np.concatenate(owners), np.concatenate(cols), np.concatenate(values)
+
+    def column_values(self, movie_id, rows):
+        """
+        Devuelve las calificaciones de una película para un conjunto de filas de usuario.
+
+        Parameters
+        ----------
+        movie_id : int
+            El ID de la película.
+        rows : array_like of int
+            Filas de usuario a consultar.
+
+        Returns
+        -------
+        ndarray of float32
+            La calificación de cada fila, o 0 si ese usuario no calificó la película.
+        """
+        col = self.movie_index(movie_id)
+        rows = np.asarray(rows)
+        result = np.zeros(len(rows), dtype=np.float32)
+
+        if col < self.csc.shape[1]:
+            start, end = self.csc.indptr[col], self.csc.indptr[col + 1]
+            col_rows = self.csc.indices[start:end]
+            col_values = self.csc.data[start:end]
+            if len(col_rows):
+                pos = np.minimum(np.searchsorted(col_rows, rows), len(col_rows) - 1)
+                found = col_rows[pos] == rows
+                result[found] = col_values[pos[found]]
+
+        if self._overlay:
+            for i, row in enumerate(rows.tolist()):
+                entry = self._overlay.get(row, {}).get(col)
+                if entry is not None:
+                    result[i] = entry[0]
+        return result
+
+    def get(self, user_id, movie_id):
+        """Devuelve la calificación de un usuario a una película, o 0 si no la calificó."""
+        return float(self.column_values(movie_id, [self.user_index(user_id)])[0])
+
+    def set(self, user_id, movie_id, rating, timestamp):
+        """
+        Agrega o actualiza la calificación de un usuario a una película.
+
+        Una calificación existente se modifica en su lugar en O(log n) y una nueva se agrega a la
+        capa adicional en O(1); solo un usuario nuevo requiere copiar el arreglo de IDs de usuario.
+
+        Parameters
+        ----------
+        user_id : int
+            El ID del usuario; si no está en la matriz se agrega una fila nueva.
+        movie_id : int
+            El ID de la película; si no está en la matriz se agrega una columna nueva.
+        rating : float
+            La calificación.
+        timestamp : int
+            La marca de tiempo de la calificación.
+
+        Returns
+        -------
+        tuple or None
+            ``(calificación, timestamp)`` anteriores, o None si la calificación es nueva.
+        """
+        row = self._row_for(user_id)
+        col = self._col_for(movie_id)
+
+        previous = None
+        if row < self.csr.shape[0] and col < self.csc.shape[1]:
+            start, end = self.csr.indptr[row], self.csr.indptr[row + 1]
+            pos = start + np.searchsorted(self.csr.indices[start:end], col)
+            if pos < end and self.csr.indices[pos] == col:
+                previous = (float(self.csr.data[pos]), int(self.times[pos]))
+                self.csr.data[pos] = rating
+                self.times[pos] = timestamp
+                col_start, col_end = self.csc.indptr[col], self.csc.indptr[col + 1]
+                col_pos = col_start + np.searchsorted(self.csc.indices[col_start:col_end], row)
+                self.csc.data[col_pos] = rating
+
+        if previous is None:
+            entries = self._overlay.setdefault(row, {})
+            previous = entries.get(col)
+            entries[col] = (float(rating), int(timestamp))
+
+        self._row_sums[row] += rating - (previous[0] if previous else 0)
+        return previous
+
+    def _row_for(self, user_id):
+        try:
+            return self.user_index(user_id)
+        except KeyError:
+            pass
+        row = self._n_users
+        if row >= len(self._row_sums):
+            self._row_sums = np.concatenate([self._row_sums, np.zeros(max(len(self._row_sums), 16))])
+        self._extra_users[user_id] = row
+        self._user_ids = np.append(self._user_ids, np.int32(user_id))
+        self._n_users += 1
+        return row
+
+    def _col_for(self, movie_id):
+        try:
+            return self.movie_index(movie_id)
+        except KeyError:
+            pass
+        col = len(self._movie_ids)
+        self._extra_movies[movie_id] = col
+        self._movie_ids = np.append(self._movie_ids, np.int32(movie_id))
+        return col
+
+    @staticmethod
+    def _find_many(ids, values):
+        values = np.asarray(values, dtype=np.int64)
+        if len(ids) == 0:
+            if len(values):
+                raise KeyError(values[0])
+            return np.empty(0, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(ids, values), len(ids) - 1)
+        missing = ids[pos] != values
+        if missing.any():
+            raise KeyError(values[missing][0])
+        return pos
+
+    @staticmethod
+    def _find(ids, value):
+        pos = np.searchsorted(ids, value)
+        if pos < len(ids) and ids[pos] == value:
+            return int(pos)
+        return -1
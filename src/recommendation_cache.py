@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RecommendationCache:
+    """
+    Cache LRU con vencimiento (TTL) para las recomendaciones de los usuarios, compartida por todas
+    las sesiones del proceso.
+
+    Cada entrada se guarda con la versión del modelo con la que se calculó (``stamp``). Una
+    calificación nueva cambia la versión del modelo, y con ella los vecinos y predicciones de
+    cualquier usuario, así que al consultar con otra versión la entrada se descarta en lugar de
+    devolverse. Las claves se normalizan a ``int``, de modo que ``'5'`` y ``5`` son el mismo usuario.
+
+    Attributes
+    ----------
+    max_entries : int
+        Cantidad máxima de usuarios guardados.
+    max_bytes : int or None
+        Memoria máxima aproximada de las recomendaciones guardadas, o None para no limitarla.
+    ttl : float or None
+        Segundos que dura una entrada, o None para que no venzan.
+    hits, misses, evictions, expirations, invalidations : int
+        Contadores de uso, para dimensionar la cache.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=600.0, clock=time.monotonic):
+        """
+        Parameters
+        ----------
+        max_entries : int, optional
+            Cantidad máxima de usuarios guardados.
+        max_bytes : int, optional
+            Memoria máxima aproximada de las recomendaciones guardadas.
+        ttl : float, optional
+            Segundos que dura una entrada. None para que no venzan.
+        clock : callable, optional
+            Función que devuelve el instante actual en segundos.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # userId -> (recomendaciones, stamp, instante, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id, stamp):
+        """
+        Devuelve las recomendaciones guardadas de un usuario si siguen siendo válidas.
+
+        Parameters
+        ----------
+        user_id : int or str
+            El ID del usuario.
+        stamp : hashable
+            La versión actual del modelo.
+
+        Returns
+        -------
+        DataFrame or None
+            Las recomendaciones, o None si no hay una entrada vigente para esa versión del modelo.
+        """
+        key = int(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, entry_stamp, stored_at, _ = entry
+            if entry_stamp != stamp:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            if self.ttl is not None and self._clock() - stored_at > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, user_id, recommendations, stamp):
+        """
+        Guarda las recomendaciones de un usuario, desalojando las menos usadas si hace falta.
+
+        Parameters
+        ----------
+        user_id : int or str
+            El ID del usuario.
+        recommendations : DataFrame
+            Las recomendaciones calculadas.
+        stamp : hashable
+            La versión del modelo con la que se calcularon.
+        """
+        key = int(user_id)
+        size = int(recommendations.memory_usage(deep=True).sum()) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (recommendations, stamp, self._clock(), size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, user_id=None):
+        """Descarta las recomendaciones de un usuario, o de todos si no se indica ninguno."""
+        with self._lock:
+            if user_id is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+            elif int(user_id) in self._entries:
+                self._remove(int(user_id))
+                self.invalidations += 1
+
+    def stats(self):
+        """
+        Devuelve los contadores de uso de la cache.
+
+        Returns
+        -------
+        dict
+            ``entries``, ``bytes``, ``hits``, ``misses``, ``hit_rate``, ``evictions``,
+            ``expirations`` e ``invalidations``.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[3]
@@ -0,0 +1,143 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from shared_data import get_shared_data
+
+_services = {}  # SharedData -> RecommendationService, compartido por todas las sesiones del proceso
+_services_lock = threading.Lock()
+
+
+class RecommendationService:
+    """
+    Calcula recomendaciones en hilos de fondo, para que la interfaz no espere al modelo.
+
+    Cada pedido se atiende con lo que ya está listo (la cache, la lista precalculada o las películas
+    populares); si hay que calcular, el cálculo se lanza en un hilo del pool y la interfaz vuelve a
+    consultar más tarde. Los pedidos repetidos mientras un cálculo está en curso reutilizan ese
+    cálculo en lugar de lanzar otro.
+
+    Attributes
+    ----------
+    data : SharedData
+        Los datos y el modelo compartidos.
+    """
+
+    def __init__(self, data=None, max_workers=2):
+        """
+        Parameters
+        ----------
+        data : SharedData, optional
+            Los datos compartidos. Por defecto, los de ``get_shared_data``.
+        max_workers : int, optional
+            Cantidad de hilos que calculan recomendaciones. Los cálculos sobre el modelo se
+            serializan con ``SharedData.lock``, así que más hilos solo ayudan con los otros pasos.
+        """
+        self.data = get_shared_data() if data is None else data
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='recommendations')
+        self._in_flight = {}  # (userId, modo) -> Future
+        self._lock = threading.Lock()
+        # Carga (o construye) el modelo en segundo plano, antes del primer pedido
+        self._warmup = self._executor.submit(self.data.model)
+
+    def submit(self, user, mode='user'):
+        """
+        Lanza el cálculo de las recomendaciones de un usuario, salvo que ya haya uno en curso.
+
+        Parameters
+        ----------
+        user : UserInteraction
+            La sesión del usuario.
+        mode : {'user', 'item', 'mf'}, optional
+            El recomendador (ver ``UserInteraction.get_recommendation``).
+
+        Returns
+        -------
+        concurrent.futures.Future
+            El cálculo en curso; su resultado es el de ``get_recommendation``.
+        """
+        key = (user.user_id, mode)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._executor.submit(user.get_recommendation, mode)
+                self._in_flight[key] = future
+                future.add_done_callback(lambda done: self._finished(key, done))
+            return future
+
+    def rate_movie(self, user, movie_id, rating, mode='user'):
+        """
+        Guarda una calificación y recalcula las recomendaciones del usuario, sin esperar al modelo.
+
+        En el hilo que llama solo se escribe la calificación en el diario (``UserInteraction.rate_movie``);
+        aplicarla al modelo (``UserInteraction.apply_ratings``) y recalcular se hace en el pool.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            El cálculo de las recomendaciones (ver ``submit``).
+        """
+        user.rate_movie(movie_id, rating)
+        self._executor.submit(user.apply_ratings)
+        return self.submit(user, mode)
+
+    def _finished(self, key, future):
+        # Los cálculos que fallaron se conservan hasta que ``recommendation`` entregue el error
+        if future.exception() is not None:
+            return
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def pending(self, user, mode='user'):
+        """Indica si hay un cálculo en curso (sin terminar) para el usuario."""
+        with self._lock:
+            future = self._in_flight.get((user.user_id, mode))
+        return future is not None and not future.done()
+
+    def recommendation(self, user, mode='user'):
+        """
+        Devuelve las recomendaciones del usuario si están listas, sin esperar a calcularlas.
+
+        Returns
+        -------
+        recommendation : DataFrame or None
+            Las recomendaciones, o None si todavía se están calculando.
+        ready : bool
+            True si ``recommendation`` es el resultado final.
+
+        Raises
+        ------
+        Exception
+            El error del cálculo en segundo plano, si falló.
+        """
+        recommendation = user.ready_recommendation(mode)
+        if recommendation is not None:
+            return recommendation, True
+        future = self.submit(user, mode)
+        if not future.done():
+            return None, False
+        # Entregado el resultado (o el error), el próximo pedido vuelve a calcular si hace falta
+        with self._lock:
+            if self._in_flight.get((user.user_id, mode)) is future:
+                del self._in_flight[(user.user_id, mode)]
+        return future.result(), True
+
+    def shutdown(self, wait=True):
+        """Detiene los hilos del pool (los cálculos en curso terminan si ``wait``)."""
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def get_recommendation_service(data=None):
+    """
+    Devuelve el servicio de recomendaciones de los datos compartidos, creándolo la primera vez.
+
+    Returns
+    -------
+    RecommendationService
+        El servicio, compartido por todas las sesiones del proceso.
+    """
+    data = get_shared_data() if data is None else data
+    with _services_lock:
+        if data not in _services:
+            _services[data] = RecommendationService(data)
+        return _services[data]
@@ -1,6 +1,12 @@
+import weakref
+
 import pandas as pd
+import numpy as np
 from matrix_builder import *
 from neighbor_finder import *
+from instrumentation import count, stage, timed
+from model_store import DEFAULT_DATASET_DIR, load_or_build_model
+from recommender_model import RecommenderModel
 
 class Recommender:
     """
@@ -10,6 +16,10 @@ class Recommender:
     ----------
     user_id : int
         El ID del usuario para el cual se generarán recomendaciones.
+    model_dir : str or None
+        Carpeta del artefacto precalculado del modelo. Si es None, el modelo se construye en cada llamada.
+    dataset_dir : str
+        Carpeta del dataset del que sale el modelo.
 
     Methods
     -------
@@ -17,7 +27,7 @@ class Recommender:
         Genera una lista de películas recomendadas para el usuario objetivo.
     """
 
-    def __init__(self, user_id):
+    def __init__(self, user_id, model_dir=None, dataset_dir=DEFAULT_DATASET_DIR):
         """
         Inicializa la clase de recomendaciones con el ID del usuario.
 
@@ -25,8 +35,29 @@ class Recommender:
         ----------
         user_id : int
             El ID del usuario para el cual se generarán recomendaciones.
+        model_dir : str, optional
+            Carpeta del artefacto precalculado del modelo (ver ``model_store``). Si se indica, el
+            modelo se carga de disco con mmap y solo se reconstruye cuando cambia el dataset.
+        dataset_dir : str, optional
+            Carpeta del dataset que invalida el artefacto y cuyo diario se aplica al modelo.
         """
         self.user_id = user_id
+        self.model_dir = model_dir
+        self.dataset_dir = dataset_dir
+
+    @timed('load_model')
+    def load_model(self, md_genres, rates, md):
+        """
+        Devuelve el modelo (matriz híbrida y matriz de calificaciones) para los datos recibidos.
+
+        Returns
+        -------
+        RecommenderModel
+            El modelo construido o cargado del artefacto.
+        """
+        if self.model_dir is None:
+            return RecommenderModel.build(md_genres, rates, md)
+        return load_or_build_model(md_genres, rates, md, model_dir=self.model_dir, dataset_dir=self.dataset_dir)
 
     def predict_user_rating(self, ratings, item, neighbors):
         """
@@ -34,69 +65,114 @@ class Recommender:
 
         Parameters
         ----------
-        ratings : DataFrame
-            Un DataFrame que representa las calificaciones de los usuarios para diferentes películas.
+        ratings : RatingMatrix
+            Una matriz dispersa con las calificaciones de los usuarios para diferentes películas.
         item : int
             El ID de la película para la cual se quiere predecir la calificación.
         neighbors : list of tuples
             Una lista de tuplas que representan los vecinos más cercanos y sus puntajes de similitud.
-        user_id : int
-            El ID del usuario para el cual se quiere predecir la calificación.
 
         Returns
         -------
         float
             La calificación predicha para la película especificada.
         """
+        if not neighbors:
+            return 0
 
-        neighbor_ratings = ratings.loc[[n for n, _ in neighbors], item]
-        neighbor_avgs = ratings.loc[[n for n, _ in neighbors]].mean(axis=1)
-        similarities = pd.Series([sim for _, sim in neighbors], index=[n for n, _ in neighbors])
+        neighbor_rows = ratings.user_indices([n for n, _ in neighbors])
+        neighbor_ratings = ratings.column_values(item, neighbor_rows).astype(np.float64)
+        neighbor_avgs = ratings.user_means[neighbor_rows]
+        similarities = np.array([sim for _, sim in neighbors], dtype=np.float64)
 
         valid_neighbors = neighbor_ratings > 0
         if valid_neighbors.any():
-            diffs = (neighbor_ratings[valid_neighbors] - neighbor_avgs[valid_neighbors])
-            weighted_diffs = diffs.multiply(similarities[valid_neighbors], axis=0)
-
-            numerator = weighted_diffs.sum()
-            denominator = similarities[valid_neighbors].abs().sum()
+            diffs = neighbor_ratings[valid_neighbors] - neighbor_avgs[valid_neighbors]
+            numerator = (diffs * similarities[valid_neighbors]).sum()
+            denominator = np.abs(similarities[valid_neighbors]).sum()
 
-            user_avg = ratings.loc[self.user_id].mean()
+            user_avg = ratings.user_means[ratings.user_index(self.user_id)]
             result = user_avg + (numerator / denominator if denominator != 0 else 0)
             return result
         return 0
 
 
-    def recommend_movies(self,md_genres, rates, md):
+    def predict_user_ratings(self, ratings, neighbors):
+        """
+        Predice de una vez la calificación del usuario para todas las películas de la matriz.
+
+        Usa la misma fórmula que ``predict_user_rating``, pero agrega las diferencias centradas en la
+        media de todos los vecinos sobre sus filas dispersas en una sola pasada.
+
+        Parameters
+        ----------
+        ratings : RatingMatrix
+            Una matriz dispersa con las calificaciones de los usuarios para diferentes películas.
+        neighbors : list of tuples
+            Una lista de tuplas que representan los vecinos más cercanos y sus puntajes de similitud.
+
+        Returns
+        -------
+        ndarray of float64
+            La calificación predicha para cada columna de ``ratings``, o 0 si ningún vecino calificó la película.
+        """
+        n_movies = ratings.shape[1]
+        if not neighbors:
+            return np.zeros(n_movies)
+
+        neighbor_rows = ratings.user_indices([n for n, _ in neighbors])
+        similarities = np.array([sim for _, sim in neighbors], dtype=np.float64)
+
+        owner, cols, values = ratings.rows_entries(neighbor_rows)
+        values = values.astype(np.float64)
+        valid = values > 0
+        cols = cols[valid]
+        owner = owner[valid]
+
+        diffs = values[valid] - ratings.user_means[neighbor_rows][owner]
+        numerator = np.bincount(cols, weights=diffs * similarities[owner], minlength=n_movies)
+        denominator = np.bincount(cols, weights=np.abs(similarities[owner]), minlength=n_movies)
+        rated_by_neighbors = np.bincount(cols, minlength=n_movies) > 0
+
+        user_avg = ratings.user_means[ratings.user_index(self.user_id)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            offsets = np.where(denominator != 0, numerator / denominator, 0)
+        return np.where(rated_by_neighbors, user_avg + offsets, 0)
+
+    def recommend_movies(self, md_genres, rates, md, top_n=None):
         """
         Genera una lista de películas recomendadas para el usuario objetivo.
 
+        Parameters
+        ----------
+        top_n : int, optional
+            Si se indica, solo se devuelven las ``top_n`` mejores recomendaciones.
+
         Returns
         -------
         DataFrame
             Un DataFrame que contiene las películas recomendadas y sus calificaciones predichas.
         """
-        hybrid_matrix, ratings, movies = build_matrix(md_genres, rates, md)
-        neighbors = find_neighbors(hybrid_matrix, self.user_id)
-        movies = movies[movies['movieId'].isin(ratings.columns)]
-
-        predicted_rating = []
-        for movieId in ratings.columns:
-            if ratings.loc[self.user_id, movieId] == 0:
-                mov = movies[movies['movieId'] == movieId]
-                title = mov['title'].values[0]
-                genres = mov['genres'].values[0]
-                year = mov['year'].values[0]
-
-                rating = round(self.predict_user_rating(ratings, movieId, neighbors), 2)
-                predicted_rating.append((movieId, title, genres, year, rating))
-
-        predicted_rating = sorted(predicted_rating, key=lambda x: x[4], reverse=True)
-        predicted_rating = [rate for rate in predicted_rating if rate[4] > 3]
-
-        rec = pd.DataFrame(predicted_rating, columns=['movieId', 'title', 'genres', 'year', 'rating'])
-        rec['rating'] = 0
-        return rec
+        model = self.load_model(md_genres, rates, md)
+        ratings = model.ratings
+        neighbors = model.neighbors(self.user_id)
+        with stage('predict_ratings'):
+            predictions = np.round(self.predict_user_ratings(ratings, neighbors), 2)
+
+        rated_cols, _ = ratings.user_row(self.user_id)
+        candidates = predictions > 3
+        candidates[rated_cols] = False
+        cols = np.flatnonzero(candidates)
+        count('candidates_scored', len(cols))
+
+        scores = predictions[cols]
+        if top_n is None:
+            order = np.argsort(-scores, kind='stable')
+        else:
+            order = top_k_indices(scores[None, :], top_n)[0]
+        cols = cols[order]
+
+        return recommendation_frame(md, ratings.movie_ids[cols])
 
     def recommend_movies_for_test(self, test_data, md_genres, rates, md):
         """
@@ -108,21 +184,68 @@ class Recommender:
             Un DataFrame que contiene las películas recomendadas y sus calificaciones predichas.
         """
         results = []
-        hybrid_matrix, ratings, movies = build_matrix(md_genres, rates, md)
-
+        model = self.load_model(md_genres, rates, md)
+        ratings = model.ratings
 
-        for user_id in test_data['userId'].unique():
+        for user_id, user_rows in test_data.groupby('userId', sort=False):
             self.user_id = user_id
-            neighbors = find_neighbors(hybrid_matrix, user_id)
-            predicted_rating = []
-            user_rows = test_data.loc[(test_data['userId'] == user_id)]
+            neighbors = model.neighbors(user_id)
+            predictions = self.predict_user_ratings(ratings, neighbors)
+            movie_ids = user_rows['movieId'].to_numpy()
+            predicted = np.round(predictions[ratings.movie_indices(movie_ids)], 1)
 
-            for movieId in user_rows['movieId']:
-                rate = round(self.predict_user_rating(ratings, movieId, neighbors), 1)
-                if(rate):
-                    predicted_rating.append((user_id,movieId, rate))
+            predicted_rating = [(user_id, movieId, rate) for movieId, rate in zip(movie_ids.tolist(), predicted) if rate]
 
 
             results.append(predicted_rating)
 
         return results
+
+
+def recommendation_frame(md, movie_ids):
+    """
+    Arma el DataFrame de recomendaciones a partir de los IDs de las películas recomendadas.
+
+    Parameters
+    ----------
+    md : DataFrame
+        Un DataFrame con las películas y sus géneros, donde los géneros están en una sola columna.
+    movie_ids : array_like of int
+        IDs de las películas recomendadas, en orden.
+
+    Returns
+    -------
+    DataFrame
+        Las películas en el mismo orden, con sus detalles básicos y ``rating`` en 0.
+    """
+    positions = movie_positions(md, movie_ids)
+    rec = md.iloc[positions[positions >= 0]][['movieId', 'title', 'genres', 'year']].reset_index(drop=True)
+    rec['rating'] = 0
+    return rec
+
+
+# (weakref a ``md``, su índice movieId -> fila), reemplazados juntos en una sola asignación
+_movie_index_cache = {'entry': None}
+
+
+def movie_positions(md, movie_ids):
+    """
+    Devuelve la posición en ``md`` de cada película, usando un índice movieId -> fila precalculado.
+
+    Parameters
+    ----------
+    md : DataFrame
+        Un DataFrame con las películas y sus géneros, donde los géneros están en una sola columna.
+    movie_ids : array_like of int
+        IDs de las películas a buscar.
+
+    Returns
+    -------
+    ndarray of int
+        La posición de cada película en ``md``, o -1 si no está.
+    """
+    entry = _movie_index_cache['entry']
+    if entry is None or entry[0]() is not md:
+        entry = (weakref.ref(md), pd.Index(md['movieId']))
+        _movie_index_cache['entry'] = entry
+    return entry[1].get_indexer(movie_ids)
@@ -0,0 +1,289 @@
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count
+from matrix_builder import build_hybrid_matrix, genre_preferences, hybrid_rows, time_decay_weights
+from neighbor_finder import NeighborFinder
+from rating_matrix import RatingMatrix
+
+DEFAULT_PARAMS = {'decay': 'linear', 'half_life_days': 365.0}
+
+_instance_ids = itertools.count()
+
+
+def model_params(**params):
+    """Completa los parámetros de construcción del modelo con sus valores por defecto."""
+    unknown = set(params) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise TypeError(f"Unknown model parameters: {sorted(unknown)}")
+    return {**DEFAULT_PARAMS, **params}
+
+
+class RecommenderModel:
+    """
+    Modelo en memoria del recomendador: la matriz híbrida, la matriz de calificaciones y el estado
+    necesario para actualizarlas de forma incremental.
+
+    ``update_rating`` aplica una calificación nueva o modificada tocando solo la fila del usuario:
+    su entrada en la matriz de calificaciones, sus sumas por género, su fila híbrida y su norma.
+    Los vecinos de los demás usuarios no se recalculan; se invalidan de forma perezosa mediante
+    ``hybrid_version``, que solo aumenta cuando alguna fila híbrida cambia de verdad.
+
+    Attributes
+    ----------
+    ratings : RatingMatrix
+        Las calificaciones de los usuarios para diferentes películas.
+    finder : NeighborFinder
+        El motor de búsqueda de vecinos sobre la matriz híbrida.
+    genre_names : list of str
+        Los géneros, en el orden de las columnas de la matriz híbrida.
+    params : dict
+        Los parámetros de construcción (decaimiento temporal).
+    reference_time : int
+        La marca de tiempo de referencia usada para el decaimiento temporal.
+    version : int
+        Aumenta con cada calificación aplicada.
+    hybrid_version : int
+        Aumenta cada vez que cambia alguna fila de la matriz híbrida.
+    instance_id : int
+        Identifica al modelo dentro del proceso, para distinguirlo de uno reconstruido.
+    """
+
+    def __init__(self, hybrid_matrix, ratings, genre_sums, movie_genres, params=None, reference_time=None):
+        """
+        Parameters
+        ----------
+        hybrid_matrix : DataFrame
+            Un DataFrame que representa las preferencias de los usuarios por diferentes géneros.
+        ratings : RatingMatrix
+            Las calificaciones de los usuarios para diferentes películas.
+        genre_sums : ndarray
+            Suma ponderada de películas gustadas por usuario y género, con las filas en el orden de
+            ``hybrid_matrix``.
+        movie_genres : dict of ndarray
+            Índice película -> géneros, como lo devuelve ``movie_genre_index``.
+        params : dict, optional
+            Los parámetros de construcción.
+        reference_time : int, optional
+            La marca de tiempo de referencia para el decaimiento temporal.
+        """
+        self.ratings = ratings
+        self.finder = NeighborFinder(hybrid_matrix)
+        self.hybrid_columns = hybrid_matrix.columns.tolist()
+        self.genre_names = [column[len('likes_many_'):] for column in self.hybrid_columns[0::2]]
+        self._genre_sums = np.array(genre_sums, dtype=np.float64).reshape(-1, len(self.genre_names))
+        self.movie_genres = movie_genres
+        self.params = model_params(**(params or {}))
+        self.reference_time = int(time.time()) if reference_time is None else int(reference_time)
+        self.version = 0
+        self.hybrid_version = 0
+        self.instance_id = next(_instance_ids)
+        self._neighbor_cache = {}  # userId -> (hybrid_version, vecinos)
+
+    @classmethod
+    def build(cls, md_genres, ratings, md=None, now=None, **params):
+        """
+        Construye el modelo completo a partir de los DataFrames de ``read_data``.
+
+        Parameters
+        ----------
+        md_genres : DataFrame
+            Las películas con un género por fila.
+        ratings : DataFrame
+            Las calificaciones de los usuarios.
+        md : DataFrame, optional
+            No se usa; se acepta para mantener la misma firma que ``build_matrix``.
+        now : int, optional
+            Marca de tiempo de referencia para el decaimiento. Por defecto, el instante actual.
+        **params
+            Parámetros de ``build_matrix`` (``decay``, ``half_life_days``).
+
+        Returns
+        -------
+        RecommenderModel
+            El modelo construido.
+        """
+        params = model_params(**params)
+        now = int(time.time()) if now is None else int(now)
+
+        pivot_table = genre_preferences(md_genres, ratings, now=now, **params)
+        proportions = pivot_table.div(pivot_table.sum(axis=1), axis=0)
+        hybrid_matrix = build_hybrid_matrix(proportions)
+        movie_genres = movie_genre_index(md_genres, pivot_table.columns.tolist())
+
+        return cls(hybrid_matrix, RatingMatrix.from_ratings(ratings), pivot_table.to_numpy(),
+                   movie_genres, params, now)
+
+    @property
+    def hybrid_matrix(self):
+        """La matriz híbrida actual como DataFrame."""
+        return pd.DataFrame(self.finder.values.astype(np.int64), index=self.finder.user_ids,
+                            columns=self.hybrid_columns)
+
+    @property
+    def genre_sums(self):
+        """Suma ponderada de películas gustadas por usuario y género, en el orden de ``finder.user_ids``."""
+        return self._genre_sums[:self.finder.n]
+
+    @property
+    def stamp(self):
+        """Identifica el estado actual del modelo: cambia con cada calificación o al reconstruirlo."""
+        return (self.instance_id, self.version)
+
+    def neighbors(self, user_id):
+        """
+        Devuelve los vecinos de un usuario, reutilizando el resultado mientras la matriz híbrida no cambie.
+
+        Raises
+        ------
+        ValueError
+            Si el usuario no está en la matriz híbrida.
+        """
+        cached = self._neighbor_cache.get(user_id)
+        if cached is not None and cached[0] == self.hybrid_version:
+            count('neighbor_cache_hits')
+            return cached[1]
+        neighbors = self.finder.find(user_id)
+        self._neighbor_cache[user_id] = (self.hybrid_version, neighbors)
+        return neighbors
+
+    def use_index(self, index='exact', **params):
+        """
+        Cambia el índice con el que se buscan los vecinos (ver ``neighbor_index``).
+
+        Parameters
+        ----------
+        index : str or object, optional
+            ``'exact'``, ``'lsh'``, ``'ivf'`` o un índice ya creado.
+        **params
+            Parámetros del índice.
+        """
+        self.finder.set_index(index, **params)
+        self._neighbor_cache.clear()
+
+    def genres_of(self, movie_id):
+        """Devuelve las columnas de género de una película (vacío si no tiene géneros)."""
+        movie_ids = self.movie_genres['movie_ids']
+        pos = np.searchsorted(movie_ids, movie_id)
+        if pos == len(movie_ids) or movie_ids[pos] != movie_id:
+            return np.empty(0, dtype=np.int64)
+        indptr = self.movie_genres['indptr']
+        return self.movie_genres['genres'][indptr[pos]:indptr[pos + 1]]
+
+    def liked_weight(self, rating, timestamp):
+        """Aporte de una calificación a las sumas por género: su peso temporal si es mayor que 3, o 0."""
+        if rating <= 3:
+            return 0.0
+        return float(time_decay_weights([timestamp], now=self.reference_time, **self.params)[0])
+
+    def update_rating(self, user_id, movie_id, rating, timestamp):
+        """
+        Aplica una calificación nueva o modificada sin reconstruir el modelo.
+
+        Actualiza la entrada de la matriz de calificaciones, las sumas por género del usuario, su
+        fila híbrida y su norma, en O(géneros) más el costo de ``RatingMatrix.set``.
+
+        Parameters
+        ----------
+        user_id : int
+            El ID del usuario.
+        movie_id : int
+            El ID de la película.
+        rating : float
+            La calificación.
+        timestamp : int
+            La marca de tiempo de la calificación.
+        """
+        previous = self.ratings.set(user_id, movie_id, rating, timestamp)
+        self.version += 1
+
+        genres = self.genres_of(movie_id)
+        if len(genres) == 0:
+            return
+
+        delta = self.liked_weight(rating, timestamp)
+        if previous is not None:
+            delta -= self.liked_weight(*previous)
+
+        if user_id in self.finder:
+            sums = self._genre_sums[self.finder.position(user_id)].copy()
+        else:
+            sums = np.zeros(len(self.genre_names))
+        sums[genres] += delta
+
+        total = sums.sum()
+        proportions = sums / total if total != 0 else np.full_like(sums, np.nan)
+        if self.finder.update_row(user_id, hybrid_rows(proportions[None, :])[0]):
+            self.hybrid_version += 1
+
+        pos = self.finder.position(user_id)
+        if pos >= len(self._genre_sums):
+            self._genre_sums = np.resize(self._genre_sums, (max(2 * len(self._genre_sums), 16), len(sums)))
+        self._genre_sums[pos] = sums
+
+    def to_arrays(self):
+        """Devuelve los arreglos que definen el modelo, para guardarlo en disco."""
+        arrays = self.ratings.to_arrays()
+        arrays['hybrid_values'] = self.finder.values.astype(np.int64)
+        arrays['hybrid_user_ids'] = np.asarray(self.finder.user_ids)
+        arrays['genre_sums'] = self.genre_sums
+        arrays['genre_movie_ids'] = self.movie_genres['movie_ids']
+        arrays['genre_indptr'] = self.movie_genres['indptr']
+        arrays['genre_indices'] = self.movie_genres['genres']
+        return arrays
+
+    def to_meta(self):
+        """Devuelve los metadatos no tabulares del modelo, para guardarlo en disco."""
+        return {
+            'params': self.params,
+            'reference_time': self.reference_time,
+            'hybrid_columns': self.hybrid_columns,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        """Reconstruye el modelo a partir de ``to_arrays`` y ``to_meta``."""
+        hybrid_matrix = pd.DataFrame(arrays['hybrid_values'], index=arrays['hybrid_user_ids'],
+                                     columns=meta['hybrid_columns'])
+        movie_genres = {
+            'movie_ids': arrays['genre_movie_ids'],
+            'indptr': arrays['genre_indptr'],
+            'genres': arrays['genre_indices'],
+        }
+        return cls(hybrid_matrix, RatingMatrix.from_arrays(arrays), arrays['genre_sums'], movie_genres,
+                   meta['params'], meta['reference_time'])
+
+
+def movie_genre_index(md_genres, genre_names):
+    """
+    Construye un índice compacto película -> columnas de género.
+
+    Parameters
+    ----------
+    md_genres : DataFrame
+        Las películas con un género por fila.
+    genre_names : list of str
+        Los géneros, en el orden de las columnas de la matriz híbrida.
+
+    Returns
+    -------
+    dict of ndarray
+        ``movie_ids`` (ordenados), ``indptr`` y ``genres``: los géneros de ``movie_ids[i]`` son
+        ``genres[indptr[i]:indptr[i + 1]]``.
+    """
+    genres = md_genres['genres']
+    # Los géneros fuera de ``genre_names`` (como '(no genres listed)') quedan con código -1
+    codes = pd.Categorical(genres.where(genres.isin(genre_names)), categories=genre_names).codes
+    movie_ids = md_genres['movieId'].to_numpy(dtype=np.int64)
+    keep = codes >= 0
+    movie_ids, codes = movie_ids[keep], codes[keep].astype(np.int32)
+
+    order = np.lexsort((codes, movie_ids))
+    movie_ids, codes = movie_ids[order], codes[order]
+    unique_ids, counts = np.unique(movie_ids, return_counts=True)
+    indptr = np.zeros(len(unique_ids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return {'movie_ids': unique_ids, 'indptr': indptr, 'genres': codes}
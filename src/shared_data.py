@@ -0,0 +1,319 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from batch_recommender import DEFAULT_OUTPUT, PrecomputedRecommendations
+from data_reader import read_compact_data
+from model_store import DEFAULT_DATASET_DIR, DEFAULT_MODEL_DIR, load_or_build_model, model_position, sync_loaded_model
+from popularity import PopularityStore
+from rating_log import LogRotated, read_log
+from recommendation_cache import RecommendationCache
+from title_search import TitleIndex
+
+_shared = {}  # (dataset_dir, model_dir) -> SharedData, compartido por todas las sesiones del proceso
+_shared_lock = threading.Lock()
+
+
+class SharedData:
+    """
+    Datos y modelo de solo lectura compartidos por todas las sesiones de un proceso.
+
+    El dataset se lee una sola vez en formato compacto (``read_compact_data``) y el modelo se carga
+    con ``load_or_build_model``; cada sesión (``UserInteraction``) solo guarda las calificaciones de
+    su propio usuario. Las calificaciones nuevas no modifican los DataFrames compartidos: se
+    escriben en el diario (``rating_log``) y se aplican al modelo con ``sync``.
+
+    Las calificaciones de un usuario y los IDs de usuario nuevos salen del dataset más lo que se
+    agregó al diario desde que se leyó, sin tocar el modelo: no esperan a que se cargue ni a
+    ``lock``, así que se pueden pedir desde el hilo de la interfaz.
+
+    Attributes
+    ----------
+    data : CompactData
+        El dataset leído al iniciar.
+    recommendations : RecommendationCache
+        Las recomendaciones ya calculadas de los usuarios, válidas mientras el modelo no cambie.
+    precomputed : PrecomputedRecommendations or None
+        Las recomendaciones calculadas por ``batch_recommender``, si existe el archivo.
+    popularity : PopularityStore
+        Las listas de películas populares para los usuarios sin calificaciones, actualizadas con
+        las calificaciones que se agregan al diario, desde cualquier proceso (ver ``sync``).
+    title_index : TitleIndex
+        El índice de búsqueda de los títulos de ``md``, construido en la primera búsqueda.
+    lock : threading.RLock
+        Protege al modelo mientras se le aplican calificaciones o se calculan recomendaciones.
+    """
+
+    def __init__(self, dataset_dir=DEFAULT_DATASET_DIR, model_dir=DEFAULT_MODEL_DIR, cache=None,
+                 precomputed_path=DEFAULT_OUTPUT):
+        """
+        Parameters
+        ----------
+        dataset_dir : str, optional
+            Carpeta del dataset.
+        model_dir : str, optional
+            Carpeta del artefacto del modelo.
+        cache : RecommendationCache, optional
+            La cache de recomendaciones. Por defecto, una con los límites de ``RecommendationCache``.
+        precomputed_path : str, optional
+            Archivo escrito por ``batch_recommender``. Si no existe, todo se calcula en el momento.
+        """
+        self.dataset_dir = dataset_dir
+        self.model_dir = model_dir
+        self.data = read_compact_data(dataset_dir)
+        self.recommendations = RecommendationCache() if cache is None else cache
+        self.lock = threading.RLock()
+        self._next_user_id = int(self.ratings['userId'].max()) + 1
+        # Lo que se agregó al diario después de leer el dataset (por cualquier proceso), sin el modelo
+        self._journal_lock = threading.Lock()
+        self._journal_offset = self.ratings.attrs.get('log_offset', 0)
+        self._journal_generation = self.ratings.attrs.get('log_generation')
+        self._journal_ratings = {}  # userId -> {movieId: calificación}
+        self._user_rows = None
+        # Se arma al iniciar para que incluya todas las calificaciones que lleguen después
+        self.popularity = PopularityStore.build(self.data)
+        self._title_index = None
+        self._title_lock = threading.Lock()
+        self.precomputed = None
+        self._rated_since_start = set()  # Usuarios cuya lista precalculada ya no sirve
+        if precomputed_path and os.path.exists(precomputed_path):
+            self.precomputed = PrecomputedRecommendations.load(precomputed_path)
+            self._skip_rated_since_batch()
+        self._model_loaded = False
+
+    @property
+    def md_genres(self):
+        """Las películas con un género por fila; solo se arma si hay que reconstruir el modelo."""
+        return self.data.md_genres
+
+    @property
+    def ratings(self):
+        """Las calificaciones leídas al cargar el dataset."""
+        return self.data.ratings
+
+    @property
+    def md(self):
+        """Las películas con sus géneros en una sola columna."""
+        return self.data.md
+
+    @property
+    def title_index(self):
+        """El índice de búsqueda de títulos; se construye una sola vez y lo comparten todas las sesiones."""
+        if self._title_index is None:
+            with self._title_lock:
+                if self._title_index is None:
+                    self._title_index = TitleIndex(self.md['title'])
+        return self._title_index
+
+    def search_movies(self, query, limit=20):
+        """
+        Busca películas por título (ver ``TitleIndex.search``).
+
+        Returns
+        -------
+        DataFrame
+            Las filas de ``md`` encontradas, de más a menos relevante.
+        """
+        return self.md.iloc[self.title_index.search(query, limit)]
+
+    def model(self):
+        """Devuelve el modelo del dataset, con el diario de calificaciones ya aplicado."""
+        with self.lock:
+            model = load_or_build_model(self.md_genres, self.ratings, self.md,
+                                        model_dir=self.model_dir, dataset_dir=self.dataset_dir)
+            self._model_loaded = True
+            return model
+
+    def sync(self):
+        """
+        Aplica al modelo y a las listas de películas populares las calificaciones agregadas al diario
+        (por este o por otro proceso) desde la última sincronización.
+        """
+        with self._journal_lock:
+            self._read_journal()
+        with self.lock:
+            sync_loaded_model(self.model_dir, self.dataset_dir)
+
+    def model_stamp(self):
+        """Devuelve la versión actual del modelo, con la que se validan las recomendaciones guardadas."""
+        with self.lock:
+            return self.model().stamp
+
+    def try_model_stamp(self):
+        """
+        Como ``model_stamp``, pero sin esperar: devuelve None si otro hilo está usando el modelo o si
+        todavía no se cargó (cargarlo o construirlo es justamente lo que no debe hacer quien llama).
+        """
+        if not self._model_loaded or not self.lock.acquire(blocking=False):
+            return None
+        try:
+            return self.model().stamp
+        finally:
+            self.lock.release()
+
+    def precomputed_for(self, user_id):
+        """
+        Devuelve las películas precalculadas para un usuario, si todavía sirven.
+
+        Las listas precalculadas se usan mientras el modelo cargado sea el mismo con el que se
+        calcularon más las calificaciones agregadas después al diario (ver
+        ``PrecomputedRecommendations.matches``); otros CSV, otros parámetros o una compactación del
+        diario las dejan de lado. La lista de un usuario deja de usarse en cuanto él califica una
+        película, en esta sesión, en otra o en otro proceso (ver ``discard_precomputed``).
+
+        Returns
+        -------
+        ndarray or None
+            Los IDs de las películas recomendadas, o None si hay que calcularlas.
+        """
+        if self.precomputed is None or not self.precomputed.matches(model_position(self.model_dir)):
+            return None
+        with self._journal_lock:
+            self._read_journal()
+            if user_id in self._rated_since_start:
+                return None
+        return self.precomputed.get(user_id)
+
+    def discard_precomputed(self, user_id):
+        """Deja de servir la lista precalculada de un usuario, porque sus calificaciones cambiaron."""
+        self._rated_since_start.add(user_id)
+
+    def user_ratings(self, user_id):
+        """
+        Devuelve las calificaciones actuales de un usuario, del dataset y del diario.
+
+        No usa el modelo, así que nunca espera a que se cargue ni a que termine otro cálculo.
+
+        Returns
+        -------
+        dict
+            movieId -> calificación; vacío si el usuario no calificó ninguna película.
+        """
+        with self._journal_lock:
+            self._read_journal()
+            ratings = self._dataset_user_ratings(user_id)
+            ratings.update(self._journal_ratings.get(user_id, {}))
+            return ratings
+
+    def new_user_id(self):
+        """Reserva un ID de usuario que no usa ningún usuario del dataset, del diario ni otra sesión del proceso."""
+        with self._journal_lock:
+            self._read_journal()
+            user_id = self._next_user_id
+            self._next_user_id += 1
+            return user_id
+
+    def _skip_rated_since_batch(self):
+        # Los usuarios que calificaron entre el cálculo de las listas y la lectura del dataset
+        position = self.precomputed.position
+        if not position or position.get('log_offset') is None:
+            return
+        try:
+            entries, _, _ = read_log(self.dataset_dir, position['log_offset'], position.get('log_generation'))
+        except LogRotated:
+            return  # Las listas son de un diario anterior: ``matches`` ya las deja de lado
+        self._rated_since_start.update(entries['userId'].tolist())
+
+    def _read_journal(self):
+        # Aplica lo agregado al diario desde la última lectura; quien llama tiene ``_journal_lock``
+        try:
+            entries, end, generation = read_log(self.dataset_dir, self._journal_offset, self._journal_generation)
+        except LogRotated:
+            # El diario se compactó: lo que faltaba ya está en ``ratings.csv``
+            self._reload_dataset()
+            return
+        for user_id, movie_id, rating, timestamp in entries.itertuples(index=False):
+            user_ratings = self._journal_ratings.setdefault(int(user_id), {})
+            previous = user_ratings.get(int(movie_id))
+            if previous is None:
+                previous = self._dataset_user_ratings(int(user_id)).get(int(movie_id))
+            user_ratings[int(movie_id)] = float(rating)
+            # Solo cambian los acumulados de la película, igual en todos los procesos que leen el diario
+            self.popularity.add_rating(int(movie_id), float(rating), int(timestamp), previous)
+        self._rated_since_start.update(entries['userId'].tolist())
+        if len(entries):
+            self._next_user_id = max(self._next_user_id, int(entries['userId'].max()) + 1)
+        self._journal_offset, self._journal_generation = end, generation
+
+    def _reload_dataset(self):
+        self.data = read_compact_data(self.dataset_dir)
+        self._journal_offset = self.ratings.attrs.get('log_offset', 0)
+        self._journal_generation = self.ratings.attrs.get('log_generation')
+        self._journal_ratings = {}
+        self._user_rows = None
+        self._next_user_id = max(self._next_user_id, int(self.ratings['userId'].max()) + 1)
+        self.popularity = PopularityStore.build(self.data)
+
+    def _dataset_user_ratings(self, user_id):
+        # Las filas de cada usuario se ubican con una búsqueda binaria sobre los IDs ordenados
+        if self._user_rows is None:
+            user_ids = self.ratings['userId'].to_numpy()
+            order = np.argsort(user_ids, kind='stable')
+            self._user_rows = (user_ids[order], order)
+        sorted_ids, order = self._user_rows
+        start, stop = np.searchsorted(sorted_ids, [user_id, user_id + 1])
+        rows = order[start:stop]
+        movie_ids = self.ratings['movieId'].to_numpy()[rows]
+        values = self.ratings['rating'].to_numpy()[rows]
+        return dict(zip(movie_ids.tolist(), values.tolist()))
+
+    def popular_movies(self, n=10, kind='popular', genre=None, decade=None):
+        """
+        Devuelve los IDs de las ``n`` películas más populares, de las listas precalculadas.
+
+        Parameters
+        ----------
+        n : int, optional
+            Cantidad de películas.
+        kind : {'popular', 'trending'}, optional
+            Por promedio bayesiano de las calificaciones o por calificaciones recientes.
+        genre : str, optional
+            Solo las películas de ese género.
+        decade : int, optional
+            Solo las películas de esa década (por ejemplo, 1990).
+
+        Returns
+        -------
+        ndarray of int
+            Los IDs, de más a menos popular (ver ``PopularityStore.ranked``).
+        """
+        with self._journal_lock:
+            self._read_journal()
+        return self.popularity.ranked(n, kind, genre, decade)
+
+    def movies_with_ratings(self, user_ratings, movies=None):
+        """
+        Devuelve las películas con una columna ``rating`` con la calificación del usuario.
+
+        Parameters
+        ----------
+        user_ratings : dict
+            movieId -> calificación del usuario.
+        movies : DataFrame, optional
+            Las películas a completar. Por defecto, todas las de ``md``.
+
+        Returns
+        -------
+        DataFrame
+            Una copia de ``movies`` con la columna ``rating`` (NaN para las no calificadas).
+        """
+        movies = self.md if movies is None else movies
+        return movies.assign(rating=movies['movieId'].map(pd.Series(user_ratings, dtype='float64')))
+
+
+def get_shared_data(dataset_dir=DEFAULT_DATASET_DIR, model_dir=DEFAULT_MODEL_DIR):
+    """
+    Devuelve los datos compartidos del dataset, leyéndolos solo la primera vez en el proceso.
+
+    Returns
+    -------
+    SharedData
+        Los datos y el modelo compartidos.
+    """
+    key = (dataset_dir, model_dir)
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = SharedData(dataset_dir, model_dir)
+        return _shared[key]
@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_reader import read_data
+from matrix_builder import build_hybrid_matrix, build_matrix, genre_preferences
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset')
+
+
+def loop_hybrid_matrix(proportions):
+    """La construcción original de ``build_matrix``: un ciclo por usuario con ``.loc`` y ``pd.concat``."""
+    likes_many_X_movies = pd.DataFrame(0, index=proportions.index, columns=proportions.columns)
+    likes_some_X_movies = pd.DataFrame(0, index=proportions.index, columns=proportions.columns)
+
+    for user in proportions.index:
+        sorted_genres = proportions.loc[user].sort_values(ascending=False)
+        n_genres = len(sorted_genres)
+        if n_genres == 0:
+            continue
+        first_third = int(n_genres / 3)
+        second_third = int(2 * n_genres / 3)
+        likes_many_X_movies.loc[user, sorted_genres.index[:first_third]] = 1
+        likes_some_X_movies.loc[user, sorted_genres.index[first_third:second_third]] = 1
+
+    likes_many_X_movies_prefixed = likes_many_X_movies.add_prefix('likes_many_')
+    likes_some_X_movies_prefixed = likes_some_X_movies.add_prefix('likes_some_')
+    interleaved_columns = np.array(list(zip(likes_many_X_movies_prefixed.columns,
+                                            likes_some_X_movies_prefixed.columns))).flatten()
+    likes_many_X_movies_prefixed = likes_many_X_movies_prefixed.reindex(columns=interleaved_columns)
+    likes_some_X_movies_prefixed = likes_some_X_movies_prefixed.reindex(columns=interleaved_columns)
+
+    hybrid_matrix = pd.DataFrame()
+    for col_many, col_some in zip(likes_many_X_movies_prefixed.columns, likes_some_X_movies_prefixed.columns):
+        if not likes_many_X_movies_prefixed[col_many].isna().all():
+            hybrid_matrix = pd.concat([hybrid_matrix, likes_many_X_movies_prefixed[col_many]], axis=1)
+        if not likes_some_X_movies_prefixed[col_some].isna().all():
+            hybrid_matrix = pd.concat([hybrid_matrix, likes_some_X_movies_prefixed[col_some]], axis=1)
+    return hybrid_matrix
+
+
+def assert_same_matrix(proportions):
+    expected = loop_hybrid_matrix(proportions)
+    result = build_hybrid_matrix(proportions)
+    assert list(result.columns) == list(expected.columns)
+    assert list(result.index) == list(expected.index)
+    np.testing.assert_array_equal(result.to_numpy(), expected.to_numpy(dtype=np.int64))
+
+
+def proportions_frame(values, genres=None, index=None):
+    values = np.asarray(values, dtype=np.float64)
+    genres = genres or [f'Genre{i:02d}' for i in range(values.shape[1])]
+    index = pd.Index(index if index is not None else np.arange(1, len(values) + 1), name='userId')
+    return pd.DataFrame(values, index=index, columns=genres)
+
+
+def test_bundled_dataset():
+    md_genres, ratings, md = read_data(DATASET_DIR)
+    pivot_table = genre_preferences(md_genres, ratings, decay=None)
+    proportions = pivot_table.div(pivot_table.sum(axis=1), axis=0)
+    assert_same_matrix(proportions)
+
+
+def test_build_matrix_shape_on_bundled_dataset():
+    md_genres, ratings, md = read_data(DATASET_DIR)
+    hybrid_matrix, user_movie_matrix, _ = build_matrix(md_genres, ratings, md, decay=None)
+    assert hybrid_matrix.shape[1] == 2 * md_genres.loc[md_genres['genres'] != '(no genres listed)', 'genres'].nunique()
+    assert list(hybrid_matrix.index) == sorted(ratings['userId'].unique())
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_proportions(seed):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, 4, size=(40, 19)).astype(np.float64)
+    assert_same_matrix(proportions_frame(counts / counts.sum(axis=1, keepdims=True)))
+
+
+@pytest.mark.parametrize('n_genres', [1, 2, 3, 5, 7, 20])
+def test_tied_proportions(n_genres):
+    # Empates completos y parciales: el orden de los géneros empatados decide qué tercio marca cada uno
+    rows = [
+        np.full(n_genres, 1 / n_genres),
+        np.r_[np.full(n_genres - n_genres // 2, 0.5), np.zeros(n_genres // 2)],
+        np.r_[np.zeros(n_genres // 2), np.full(n_genres - n_genres // 2, 0.5)],
+        np.tile([0.25, 0.25, 0.5], n_genres)[:n_genres],
+    ]
+    assert_same_matrix(proportions_frame(rows))
+
+
+def test_zero_and_nan_rows():
+    # Un usuario sin películas gustadas tiene suma 0 y, al dividir, una fila de NaN
+    counts = np.array([[0, 0, 0, 0, 0, 0], [1, 0, 2, 0, 0, 1], [0, 0, 0, 0, 0, 0], [3, 3, 0, 0, 1, 1]], dtype=float)
+    with np.errstate(invalid='ignore'):
+        proportions = proportions_frame(counts / counts.sum(axis=1, keepdims=True))
+    assert proportions.iloc[0].isna().all()
+    assert_same_matrix(proportions)
+    assert_same_matrix(proportions_frame(np.zeros((3, 6))))
+
+
+def test_column_order_and_index():
+    proportions = proportions_frame([[0.1, 0.6, 0.3], [0.5, 0.0, 0.5]], genres=['Drama', 'Action', 'Comedy'],
+                                    index=[42, 7])
+    result = build_hybrid_matrix(proportions)
+    assert list(result.columns) == ['likes_many_Drama', 'likes_some_Drama', 'likes_many_Action',
+                                    'likes_some_Action', 'likes_many_Comedy', 'likes_some_Comedy']
+    assert list(result.index) == [42, 7]
+    assert result.index.name is None
+    assert_same_matrix(proportions)
@@ -0,0 +1,101 @@
+import os
+
+import pandas as pd
+import pytest
+
+import model_store
+from data_reader import read_data
+from model_store import checkpoint_model, load_or_build_model, read_model_meta
+from rating_log import LogRotated, RatingLog, compact, log_path, read_log
+from recommender_model import RecommenderModel
+
+
+@pytest.fixture
+def rating_log(dataset_dir):
+    log = RatingLog(log_path(dataset_dir))
+    yield log
+    log.close()
+
+
+def append_all(log, entries):
+    for user_id, movie_id, rating, timestamp in entries:
+        log.append(user_id, movie_id, rating, timestamp)
+    log.flush()
+
+
+def test_read_log_from_offset(dataset_dir, rating_log):
+    append_all(rating_log, [(1, 2, 4.0, 10), (3, 4, 2.5, 11)])
+    entries, end, generation = read_log(dataset_dir)
+    assert entries.values.tolist() == [[1, 2, 4.0, 10], [3, 4, 2.5, 11]]
+    assert generation
+
+    append_all(rating_log, [(5, 6, 1.0, 12)])
+    with open(log_path(dataset_dir), 'ab') as f:
+        f.write(b'7,8,3.0')  # Una línea a medio escribir no se lee
+    entries, new_end, _ = read_log(dataset_dir, end, generation)
+    assert entries.values.tolist() == [[5, 6, 1.0, 12]]
+    assert new_end == os.path.getsize(log_path(dataset_dir)) - len(b'7,8,3.0')
+
+
+def test_compact_rotates_journal(dataset_dir, rating_log):
+    append_all(rating_log, [(1, 2, 4.0, 10), (100, 3, 5.0, 11)])
+    _, end, generation = read_log(dataset_dir)
+
+    assert compact(dataset_dir) == 2
+    ratings = pd.read_csv(os.path.join(dataset_dir, 'ratings.csv'))
+    assert ((ratings['userId'] == 100) & (ratings['movieId'] == 3)).sum() == 1
+
+    entries, new_end, new_generation = read_log(dataset_dir)
+    assert entries.empty and new_generation != generation
+    # Una posición del diario anterior nunca se confunde con una del nuevo
+    with pytest.raises(LogRotated):
+        read_log(dataset_dir, end, generation)
+    with pytest.raises(LogRotated):
+        read_log(dataset_dir, new_end + 1, new_generation)
+
+    # El escritor abierto antes de compactar escribe en el diario nuevo
+    append_all(rating_log, [(2, 3, 3.0, 12)])
+    entries, _, _ = read_log(dataset_dir, new_end, new_generation)
+    assert entries.values.tolist() == [[2, 3, 3.0, 12]]
+
+
+def test_load_replays_only_entries_past_checkpoint(dataset_dir, rating_log, tmp_path, monkeypatch):
+    model_dir = str(tmp_path / 'model')
+    load_or_build_model(*read_data(dataset_dir), model_dir=model_dir, dataset_dir=dataset_dir)
+    append_all(rating_log, [(1, 2, 4.0, 10), (31, 5, 5.0, 11)])
+    assert checkpoint_model(model_dir, dataset_dir)
+    assert read_model_meta(model_dir)['log_offset'] == os.path.getsize(log_path(dataset_dir))
+
+    after_checkpoint = [(2, 7, 1.5, 12), (32, 1, 4.5, 13), (1, 2, 2.0, 14)]
+    append_all(rating_log, after_checkpoint)
+    replayed = []
+    update_rating = RecommenderModel.update_rating
+
+    def record(model, *entry):
+        replayed.append(entry)
+        update_rating(model, *entry)
+
+    monkeypatch.setattr(RecommenderModel, 'update_rating', record)
+    monkeypatch.setattr(model_store, '_loaded_models', {})  # Como un proceso nuevo
+    model = load_or_build_model(*read_data(dataset_dir), model_dir=model_dir, dataset_dir=dataset_dir)
+
+    assert replayed == after_checkpoint
+    assert model.ratings.get(31, 5) == 5.0 and model.ratings.get(1, 2) == 2.0
+
+
+def test_load_after_compaction_rereads_dataset(dataset_dir, rating_log, tmp_path):
+    model_dir = str(tmp_path / 'model')
+    model = load_or_build_model(*read_data(dataset_dir), model_dir=model_dir, dataset_dir=dataset_dir)
+    append_all(rating_log, [(1, 2, 4.0, 10), (31, 5, 5.0, 11)])
+    load_or_build_model(None, None, None, model_dir=model_dir, dataset_dir=dataset_dir)
+
+    compact(dataset_dir)  # Otro proceso compacta y sigue calificando
+    append_all(rating_log, [(32, 1, 4.5, 12), (1, 2, 2.0, 13)])
+    reloaded = load_or_build_model(None, None, None, model_dir=model_dir, dataset_dir=dataset_dir)
+
+    assert reloaded is not model
+    assert reloaded.ratings.get(31, 5) == 5.0
+    assert reloaded.ratings.get(32, 1) == 4.5
+    assert reloaded.ratings.get(1, 2) == 2.0
+    meta = read_model_meta(model_dir)
+    assert meta['log_generation'] == read_log(dataset_dir)[2]
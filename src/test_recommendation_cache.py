@@ -0,0 +1,89 @@
+import pandas as pd
+import pytest
+
+import user
+from recommendation_cache import RecommendationCache
+from shared_data import SharedData
+from user import UserInteraction
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def recommendations(*movie_ids):
+    return pd.DataFrame({'movieId': list(movie_ids)})
+
+
+def test_entry_is_dropped_when_stamp_changes():
+    cache = RecommendationCache()
+    cache.put(5, recommendations(1, 2), stamp=(0, 1))
+    assert cache.get('5', (0, 1)) is not None
+    assert cache.get(5, (0, 2)) is None
+    # La entrada de la versión anterior ya no está, aunque se vuelva a pedir con esa versión
+    assert cache.get(5, (0, 1)) is None
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_entry_expires_after_ttl():
+    clock = FakeClock()
+    cache = RecommendationCache(ttl=60, clock=clock)
+    cache.put(5, recommendations(1), stamp=0)
+    clock.now = 60
+    assert cache.get(5, 0) is not None
+    clock.now = 61
+    assert cache.get(5, 0) is None
+    assert len(cache) == 0 and cache.stats()['expirations'] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = RecommendationCache(max_entries=2)
+    cache.put(1, recommendations(1), 0)
+    cache.put(2, recommendations(2), 0)
+    cache.get(1, 0)
+    cache.put(3, recommendations(3), 0)
+    assert cache.get(2, 0) is None and cache.get(1, 0) is not None and cache.get(3, 0) is not None
+
+
+@pytest.fixture
+def session(dataset_dir, tmp_path, monkeypatch):
+    clock = FakeClock()
+    data = SharedData(dataset_dir, str(tmp_path / 'model'), cache=RecommendationCache(ttl=600, clock=clock),
+                      precomputed_path=None)
+    monkeypatch.setattr(user, 'get_shared_data', lambda: data)
+    session = UserInteraction(1)
+    calls = []
+    recommend_movies = session.recommender.recommend_movies
+
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return recommend_movies(*args, **kwargs)
+
+    session.recommender.recommend_movies = counting
+    return session, clock, calls
+
+
+def test_get_recommendation_reuses_cache_until_model_changes(session):
+    session, clock, calls = session
+    first = session.get_recommendation()
+    assert session.get_recommendation() is first
+    assert len(calls) == 1
+
+    # Una calificación cambia la versión del modelo: la entrada guardada ya no sirve
+    unrated = next(movie_id for movie_id in session.data.md['movieId'] if movie_id not in session.user_ratings)
+    session.rate_movie(unrated, 5.0)
+    session.get_recommendation()
+    assert len(calls) == 2
+    assert session.data.recommendations.stats()['invalidations'] == 1
+
+
+def test_get_recommendation_recomputes_after_ttl(session):
+    session, clock, calls = session
+    session.get_recommendation()
+    clock.now = 601
+    session.get_recommendation()
+    assert len(calls) == 2
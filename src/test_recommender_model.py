@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_reader import read_data
+from rating_log import apply_log
+from recommender_model import RecommenderModel
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset')
+NOW = 1_600_000_000
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    md_genres, ratings, md = read_data(DATASET_DIR)
+    return md_genres, ratings[['userId', 'movieId', 'rating', 'timestamp']], md
+
+
+def random_updates(ratings, md, n=300, seed=0):
+    """Calificaciones nuevas y modificadas, de usuarios existentes y nuevos, sobre películas del catálogo."""
+    rng = np.random.default_rng(seed)
+    user_ids = ratings['userId'].unique()
+    new_users = np.arange(user_ids.max() + 1, user_ids.max() + 6)
+    movie_ids = md['movieId'].to_numpy()
+    rows = []
+    for _ in range(n):
+        kind = rng.integers(3)
+        if kind == 0:
+            # Vuelve a calificar una película que el usuario ya tenía
+            user_id, movie_id = ratings.iloc[rng.integers(len(ratings))][['userId', 'movieId']]
+        else:
+            user_id = rng.choice(new_users) if kind == 1 else rng.choice(user_ids)
+            movie_id = rng.choice(movie_ids)
+        rows.append((int(user_id), int(movie_id), float(rng.choice(np.arange(1, 11) / 2)),
+                     int(rng.integers(NOW - 5 * 365 * 86400, NOW))))
+    return pd.DataFrame(rows, columns=['userId', 'movieId', 'rating', 'timestamp'])
+
+
+def rating_triples(matrix):
+    compacted = matrix.compacted()
+    coo = compacted.csr.tocoo()
+    triples = pd.DataFrame({'userId': compacted.user_ids[coo.row], 'movieId': compacted.movie_ids[coo.col],
+                            'rating': coo.data, 'timestamp': compacted.times})
+    return triples.sort_values(['userId', 'movieId']).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('decay', ['linear', 'exponential', None])
+def test_updates_match_full_rebuild(dataset, decay):
+    md_genres, ratings, md = dataset
+    updates = random_updates(ratings, md)
+
+    model = RecommenderModel.build(md_genres, ratings, md, now=NOW, decay=decay)
+    for user_id, movie_id, rating, timestamp in updates.itertuples(index=False):
+        model.update_rating(user_id, movie_id, rating, timestamp)
+    rebuilt = RecommenderModel.build(md_genres, apply_log(ratings, updates), md, now=NOW, decay=decay)
+
+    pd.testing.assert_frame_equal(model.hybrid_matrix.sort_index(), rebuilt.hybrid_matrix)
+    pd.testing.assert_frame_equal(rating_triples(model.ratings), rating_triples(rebuilt.ratings))
+
+    rng = np.random.default_rng(1)
+    users = np.union1d(updates['userId'].unique(), rng.choice(ratings['userId'].unique(), 20, replace=False))
+    for user_id in users:
+        neighbors, expected = model.neighbors(user_id), rebuilt.neighbors(user_id)
+        assert [user for user, _ in neighbors] == [user for user, _ in expected]
+        np.testing.assert_allclose([score for _, score in neighbors], [score for _, score in expected])
+
+
+def test_rerating_back_restores_model(dataset):
+    md_genres, ratings, md = dataset
+    model = RecommenderModel.build(md_genres, ratings, md, now=NOW)
+    before = model.hybrid_matrix
+    user_id, movie_id, rating, timestamp = ratings.iloc[0]
+    model.update_rating(user_id, movie_id, 5.0 if rating <= 3 else 1.0, NOW)
+    model.update_rating(user_id, movie_id, rating, timestamp)
+    pd.testing.assert_frame_equal(model.hybrid_matrix, before)
+    assert model.ratings.get(user_id, movie_id) == rating
@@ -0,0 +1,134 @@
+import bisect
+import re
+import unicodedata
+
+import numpy as np
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_title(text):
+    """
+    Normaliza un texto para buscarlo: sin acentos, en minúsculas y solo con letras, dígitos y espacios.
+
+    Examples
+    --------
+    >>> normalize_title('Léon: The Professional')
+    'leon the professional'
+    """
+    if not isinstance(text, str):
+        return ''
+    folded = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(' ', folded.casefold()).strip()
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TitleIndex:
+    """
+    Índice invertido de los títulos de las películas para la búsqueda de la aplicación.
+
+    Los títulos se normalizan con ``normalize_title`` y se indexan de tres formas: ordenados completos
+    (para los que empiezan con la búsqueda), por palabra (para prefijos de palabras) y por trigramas
+    (para la búsqueda de subcadenas, como ``str.contains``). Una búsqueda solo recorre las listas de
+    las palabras o trigramas de la consulta, nunca todo el catálogo.
+
+    Attributes
+    ----------
+    titles : list of str
+        Los títulos normalizados, en el orden del catálogo.
+    """
+
+    def __init__(self, titles):
+        """
+        Parameters
+        ----------
+        titles : iterable of str
+            Los títulos del catálogo; la posición de cada uno es la que devuelve ``search``.
+        """
+        self.titles = [normalize_title(title) for title in titles]
+
+        order = sorted(range(len(self.titles)), key=self.titles.__getitem__)
+        self._sorted_titles = [self.titles[pos] for pos in order]
+        self._sorted_positions = np.array(order, dtype=np.int64)
+
+        tokens, trigrams = {}, {}
+        for pos, title in enumerate(self.titles):
+            for token in set(title.split()):
+                tokens.setdefault(token, []).append(pos)
+            for trigram in _trigrams(title):
+                trigrams.setdefault(trigram, []).append(pos)
+        self._tokens = sorted(tokens)
+        self._token_postings = [np.array(tokens[token], dtype=np.int64) for token in self._tokens]
+        self._trigram_postings = {trigram: np.array(positions, dtype=np.int64)
+                                  for trigram, positions in trigrams.items()}
+
+    def __len__(self):
+        return len(self.titles)
+
+    def search(self, query, limit=20):
+        """
+        Busca las películas cuyo título coincide con la consulta.
+
+        Los resultados se ordenan por relevancia: primero los títulos que empiezan con la consulta
+        (en orden alfabético), luego los que tienen palabras que empiezan con cada palabra de la
+        consulta y por último los que la contienen en cualquier parte (ambos en el orden del catálogo).
+        La búsqueda termina en cuanto se juntan ``limit`` resultados.
+
+        Parameters
+        ----------
+        query : str
+            El texto buscado; se normaliza igual que los títulos.
+        limit : int, optional
+            Cantidad máxima de resultados.
+
+        Returns
+        -------
+        ndarray of int
+            Las posiciones de los títulos encontrados, de más a menos relevante.
+        """
+        query = normalize_title(query)
+        if not query or limit <= 0:
+            return np.zeros(0, dtype=np.int64)
+
+        results, seen = [], set()
+        for tier in (self._title_prefix, self._token_prefix, self._substring):
+            for pos in tier(query).tolist():
+                if pos not in seen:
+                    seen.add(pos)
+                    results.append(pos)
+                    if len(results) == limit:
+                        return np.array(results, dtype=np.int64)
+        return np.array(results, dtype=np.int64)
+
+    def _title_prefix(self, query):
+        start = bisect.bisect_left(self._sorted_titles, query)
+        end = bisect.bisect_left(self._sorted_titles, query + '\uffff', start)
+        return self._sorted_positions[start:end]
+
+    def _token_prefix(self, query):
+        matches = None
+        for word in query.split():
+            start = bisect.bisect_left(self._tokens, word)
+            end = bisect.bisect_left(self._tokens, word + '\uffff', start)
+            if start == end:
+                return np.zeros(0, dtype=np.int64)
+            positions = np.unique(np.concatenate(self._token_postings[start:end]))
+            matches = positions if matches is None else np.intersect1d(matches, positions, assume_unique=True)
+        return matches
+
+    def _substring(self, query):
+        trigrams = _trigrams(query)
+        if not trigrams:
+            return np.zeros(0, dtype=np.int64)
+        postings = sorted((self._trigram_postings.get(trigram, np.zeros(0, dtype=np.int64)) for trigram in trigrams),
+                          key=len)
+        candidates = postings[0]
+        for positions in postings[1:]:
+            if not len(candidates):
+                break
+            candidates = np.intersect1d(candidates, positions, assume_unique=True)
+        # Los trigramas pueden coincidir sin estar contiguos; se confirma con la subcadena completa.
+        return np.array([pos for pos in candidates.tolist() if query in self.titles[pos]], dtype=np.int64)
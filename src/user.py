@@ -1,16 +1,19 @@
-from recommender import Recommender
-from data_reader import read_data
-import pandas as pd
-import os
+from instrumentation import annotate, count, request, stage
+from item_recommender import ItemRecommender
+from mf_recommender import FactorRecommender, fold_in_user
+from recommender import Recommender, recommendation_frame
+from shared_data import get_shared_data
+from rating_log import get_rating_log
 import time
 
 class UserInteraction:
     """
     Clase destinada a manejar la interacción del usuario con el sistema de recomendaciones,
     facilitando la evaluación de películas y la obtención de recomendaciones.
-    """
 
-    _recommendation_cache = {}  # Cache para guardar las recomendaciones de los usuarios
+    El dataset y el modelo se comparten entre todas las sesiones del proceso (ver ``shared_data``);
+    cada instancia solo guarda las calificaciones de su usuario.
+    """
 
     def __init__(self, idx=None):
         """
@@ -21,27 +24,64 @@ class UserInteraction:
         idx : int, optional
             ID del usuario. Si no se proporciona, se asignará un nuevo ID único.
         """
-        self.md_genres, self.ratings, self.md = read_data()
+        self.data = get_shared_data()
         if not idx:
-            self.user_id = int(self.ratings['userId'].max()) + 1  # Asigna un nuevo ID único al usuario.
+            self.user_id = self.data.new_user_id()  # Asigna un nuevo ID único al usuario.
         else:
-            self.user_id = idx
-        self.recommender = Recommender(self.user_id)  # Crea una instancia del sistema de recomendaciones.
+            self.user_id = int(idx)
+        self.recommender = Recommender(self.user_id, model_dir=self.data.model_dir,
+                                       dataset_dir=self.data.dataset_dir)  # Crea una instancia del sistema de recomendaciones.
+        self.item_recommender = ItemRecommender(self.user_id, model_dir=self.data.model_dir,
+                                                dataset_dir=self.data.dataset_dir)
+        self.factor_recommender = FactorRecommender(self.user_id, model_dir=self.data.model_dir,
+                                                    dataset_dir=self.data.dataset_dir)
+
+        # Calificaciones del usuario actual (movieId -> calificación)
+        self.user_ratings = self.data.user_ratings(self.user_id)
+        # Calificaciones hechas en la sesión y cuántas de ellas ya se aplicaron al modelo (ver ``apply_ratings``)
+        self._rated = 0
+        self._applied = 0
+
+    @property
+    def merged_df(self):
+        """
+        Las películas con la calificación del usuario en la columna ``rating`` (0 para películas no vistas).
 
-        # Filtra las calificaciones para el usuario actual
-        df2_filtered = self.ratings[self.ratings['userId'] == self.user_id]
+        Se arma a partir de las películas compartidas cada vez que se consulta, así que no ocupa
+        memoria por sesión.
+        """
+        merged_df = self.data.movies_with_ratings(self.user_ratings)
+        merged_df['rating'] = merged_df['rating'].fillna(0)
+        return merged_df
 
-        # Realizar un merge entre las películas y las calificaciones del usuario
-        self.merged_df = pd.merge(self.md, df2_filtered[['movieId', 'rating']], on='movieId', how='left')
 
-        # Rellenar los NaN en la columna de rating con 0 (para películas no vistas por el usuario)
-        self.merged_df['rating'] = self.merged_df['rating'].fillna(0)
+    def search_movies(self, query, limit=20):
+        """
+        Busca películas por título, con la calificación del usuario como en ``merged_df``.
 
+        Parameters
+        ----------
+        query : str
+            El texto buscado; no distingue mayúsculas ni acentos.
+        limit : int, optional
+            Cantidad máxima de resultados.
+
+        Returns
+        -------
+        DataFrame
+            Las películas encontradas, de más a menos relevante, con la columna ``rating``.
+        """
+        results = self.data.movies_with_ratings(self.user_ratings, self.data.search_movies(query, limit))
+        results['rating'] = results['rating'].fillna(0)
+        return results
 
     def rate_movie(self, movie_id, rating):
         """
         Permite al usuario calificar una película, añadiendo o actualizando esta calificación en el conjunto de datos.
 
+        Solo escribe la calificación en el diario, sin esperar al modelo: se aplica al modelo compartido
+        después, con ``apply_ratings``, desde un hilo de fondo (ver ``RecommendationService.rate_movie``).
+
         Parameters
         ----------
         movie_id : int
@@ -50,68 +90,120 @@ class UserInteraction:
             La calificación otorgada por el usuario a la película.
         """
         current_timestamp = int(time.time())  # Obtén el timestamp actual
+        movie_id = int(movie_id)
+        self.user_ratings[movie_id] = rating
 
-        # Asegurarse de que los tipos de datos sean consistentes
-        self.ratings['userId'] = self.ratings['userId'].astype(str)
-        self.ratings['movieId'] = self.ratings['movieId'].astype(int)
-
-        # Convertir self.user_id a string para la comparación
-        self.user_id = str(self.user_id)
-
-        # Encontrar el índice de la fila que queremos actualizar
-        indices_to_update = self.ratings[
-            (self.ratings['userId'] == self.user_id) & (self.ratings['movieId'] == movie_id)
-        ].index
-
-
-
-        if not indices_to_update.empty:
-            # Actualiza la calificación y el timestamp si el usuario ya calificó la película
-            self.ratings.loc[indices_to_update, ['rating', 'timestamp']] = [rating, current_timestamp]
-            print(self.ratings.loc[indices_to_update, ['rating', 'timestamp']])
-            print(movie_id, rating)
-        else:
-            self.user_id = int(self.user_id)
-            # Si no existe, añade una nueva fila con el rating y timestamp actual
-            new_data = pd.DataFrame([[self.user_id, movie_id, rating, current_timestamp]],
-                                    columns=['userId', 'movieId', 'rating', 'timestamp'])
-            self.ratings = pd.concat([self.ratings, new_data], ignore_index=True)
-
-        # Invalida la cache al usuario calificar una nueva película
-        if self.user_id in self._recommendation_cache:
-            del self._recommendation_cache[self.user_id]
+        with request('rate_movie', user_id=self.user_id, movie_id=movie_id):
+            # Agrega la calificación al diario en lugar de reescribir ratings.csv completo
+            with stage('append_rating'):
+                get_rating_log(self.data.dataset_dir).append(self.user_id, movie_id, rating, current_timestamp)
 
-        # Actualiza el DataFrame merged_df con las nuevas calificaciones
-        df2_filtered = self.ratings[self.ratings['userId'] == self.user_id]
-        self.merged_df = pd.merge(self.md, df2_filtered[['movieId', 'rating']], on='movieId', how='left')
-        self.merged_df['rating'] = self.merged_df['rating'].fillna(0)
-        self.ratings.to_csv('dataset/ratings.csv', index=False, mode='w')
+            # Las listas de populares la toman del diario, como las de otros procesos (ver ``SharedData.sync``)
+            self.data.discard_precomputed(self.user_id)
+        self._rated += 1
+        # La cache de recomendaciones se invalida sola: la calificación cambia la versión del modelo
 
+    def apply_ratings(self):
+        """
+        Aplica al modelo compartido las calificaciones del usuario que todavía no tiene.
 
-    def get_recommendation(self):
+        Espera a ``SharedData.lock`` (y, si todavía no se cargó, a que se cargue el modelo), así que
+        no se llama desde el hilo de la interfaz sino desde los hilos de ``RecommendationService``.
+        ``get_recommendation`` lo llama antes de calcular.
+        """
+        rated = self._rated
+        if self._applied >= rated:
+            return
+        with request('apply_ratings', user_id=self.user_id):
+            # Aplica las calificaciones nuevas del diario al modelo compartido, sin reconstruirlo
+            with stage('sync_model'):
+                self.data.sync()
+            # Recalcula los factores latentes del usuario (si el modelo de factores está cargado) sin reentrenarlo
+            with self.data.lock, stage('fold_in'):
+                fold_in_user(self.user_id, dict(self.user_ratings), self.factor_recommender.factor_model_dir)
+                self._applied = max(self._applied, rated)
+
+
+    def get_recommendation(self, mode='user'):
         """
         Genera y devuelve un DataFrame con las top 10 películas recomendadas para el usuario.
 
+        Parameters
+        ----------
+        mode : {'user', 'item', 'mf'}, optional
+            ``'user'`` recomienda a partir de usuarios parecidos (``Recommender``), ``'item'`` a partir
+            de películas parecidas a las que calificó (``ItemRecommender``) y ``'mf'`` a partir de
+            factores latentes (``FactorRecommender``).
+
         Returns
         -------
         DataFrame
             Un DataFrame que contiene las top 10 películas recomendadas, incluyendo sus detalles básicos.
         """
-        # Verifica si las recomendaciones están en la cache
-        if self.user_id in self._recommendation_cache:
-            return self._recommendation_cache[self.user_id]
+        recommenders = {'user': self.recommender, 'item': self.item_recommender, 'mf': self.factor_recommender}
+        if mode not in recommenders:
+            raise ValueError(f"Unknown recommendation mode: {mode!r} (expected one of {sorted(recommenders)})")
+
+        self.apply_ratings()
+        with request('get_recommendation', user_id=self.user_id, mode=mode):
+            stamp = (self.data.model_stamp(), mode)
+            recommendation = self._ready_recommendation(stamp, mode)
+            if recommendation is None:
+                # Verifica si el usuario ha calificado alguna película y obtiene recomendaciones basadas en eso.
+                annotate(source='model')
+                with self.data.lock, stage('recommend_movies'):
+                    recommendation = recommenders[mode].recommend_movies(self.data.md_genres, self.data.ratings,
+                                                                         self.data.md, top_n=10).head(10)
+                self.data.recommendations.put(self.user_id, recommendation, stamp)
+            return recommendation
+
+    def ready_recommendation(self, mode='user'):
+        """
+        Devuelve las recomendaciones del usuario solo si no hay que calcularlas.
 
-        # Verifica si el usuario ha calificado alguna película y obtiene recomendaciones basadas en eso.
-        if self.user_id in self.ratings['userId'].unique():
-            recommendation = self.recommender.recommend_movies(self.md_genres, self.ratings, self.md)
-            self._recommendation_cache[self.user_id] = recommendation.head(10)
-        else:
-            # Si el usuario es completamente nuevo y no tiene calificaciones, devuelve las películas más populares.
-            top_movies = self.ratings.groupby('movieId').rating.mean().nlargest(10).index
-            top_movie_details = self.md[self.md['movieId'].isin(top_movies)]
-            df2_filtered = self.ratings[self.ratings['userId'] == self.user_id]
+        Nunca espera al modelo: si otro hilo lo está usando (por ejemplo, calculando recomendaciones),
+        devuelve None igual que si hubiera que calcularlas.
 
-            top_movie_details = pd.merge(top_movie_details, df2_filtered[['movieId', 'rating']], on='movieId', how='left')
-            self._recommendation_cache[self.user_id] = top_movie_details
+        Returns
+        -------
+        DataFrame or None
+            Las recomendaciones guardadas en la cache, las precalculadas o las populares (para un
+            usuario sin calificaciones); None si hay que llamar a ``get_recommendation``.
+        """
+        model_stamp = self.data.try_model_stamp()
+        if model_stamp is None:
+            return None
+        return self._ready_recommendation((model_stamp, mode), mode)
 
-        return self._recommendation_cache[self.user_id]
+    def popular_recommendation(self, kind='popular', genre=None, decade=None):
+        """
+        Devuelve las 10 películas más populares, con la calificación del usuario en la columna ``rating``.
+
+        Los parámetros eligen la lista precalculada (ver ``SharedData.popular_movies``).
+        """
+        top_movies = self.data.popular_movies(10, kind, genre, decade)
+        return self.data.movies_with_ratings(self.user_ratings, recommendation_frame(self.data.md, top_movies))
+
+    def _ready_recommendation(self, stamp, mode):
+        cache = self.data.recommendations
+        # Verifica si las recomendaciones están en la cache y siguen siendo válidas para el modelo actual
+        recommendation = cache.get(self.user_id, stamp)
+        if recommendation is not None:
+            count('cache_hits')
+            annotate(source='cache')
+            return recommendation
+        count('cache_misses')
+
+        precomputed = self.data.precomputed_for(self.user_id) if self.user_ratings and mode == 'user' else None
+        if precomputed is not None:
+            # Lista calculada por batch_recommender; no hace falta buscar vecinos ni predecir
+            annotate(source='precomputed')
+            recommendation = recommendation_frame(self.data.md, precomputed[:10])
+        elif not self.user_ratings:
+            # Si el usuario es completamente nuevo y no tiene calificaciones, devuelve las películas más populares.
+            annotate(source='popular')
+            recommendation = self.popular_recommendation()
+        else:
+            return None
+        cache.put(self.user_id, recommendation, stamp)
+        return recommendation